@@ -107,7 +107,7 @@ case $1 in
         export SQLALCHEMY_DATABASE_URI=postgresql+psycopg://localhost:5432/dummy
         exec flask swpt_creditors "$@"
         ;;
-    verify_shard_content)
+    verify_shard_content | notify_triggers)
         exec flask swpt_creditors "$@"
         ;;
     webserver)
@@ -117,6 +117,10 @@ case $1 in
     consume_messages)
         exec flask swpt_creditors "$@"
         ;;
+    consume_transfer_messages)
+        shift
+        exec flask swpt_creditors consume_messages --transfers "$@"
+        ;;
     process_ledger_updates | process_log_additions | scan_creditors | scan_accounts \
         | scan_committed_transfers | scan_ledger_entries | scan_log_entries)
         exec flask swpt_creditors "$@"
@@ -0,0 +1,234 @@
+"""direct transfer procedures
+
+Revision ID: 10422ed57ae8
+Revises: 2dddf667338b
+Create Date: 2026-10-16 11:41:09.873264
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from swpt_creditors.migration_helpers import ReplaceableObject
+
+# revision identifiers, used by Alembic.
+revision = '10422ed57ae8'
+down_revision = '2dddf667338b'
+branch_labels = None
+depends_on = None
+
+finalize_running_transfer_sp = ReplaceableObject(
+    "finalize_running_transfer("
+    " cid BIGINT,"
+    " tuuid UUID,"
+    " finalization_error_code VARCHAR,"
+    " finalization_total_locked_amount BIGINT"
+    ")",
+    """
+    RETURNS void AS $$
+    DECLARE
+      current_ts TIMESTAMP WITH TIME ZONE := CURRENT_TIMESTAMP;
+      update_id BIGINT;
+    BEGIN
+      UPDATE running_transfer
+      SET
+        latest_update_id = latest_update_id + 1,
+        latest_update_ts = current_ts,
+        finalized_at = current_ts,
+        error_code = finalization_error_code,
+        total_locked_amount = finalization_total_locked_amount
+      WHERE
+        creditor_id = cid
+        AND transfer_uuid = tuuid
+        AND finalized_at IS NULL
+      RETURNING latest_update_id INTO update_id;
+
+      IF FOUND THEN
+        INSERT INTO pending_log_entry (
+          creditor_id, added_at, object_type_hint,
+          transfer_uuid, object_update_id,
+          data_finalized_at, data_error_code
+        )
+        VALUES (
+          cid, current_ts, 1,
+          tuuid, update_id,
+          current_ts, finalization_error_code
+        );
+      END IF;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+process_rejected_direct_transfer_signal_sp = ReplaceableObject(
+    "process_rejected_direct_transfer_signal("
+    " coid BIGINT,"
+    " crid BIGINT,"
+    " status_code VARCHAR,"
+    " total_locked_amount BIGINT,"
+    " did BIGINT,"
+    " cid BIGINT"
+    ")",
+    """
+    RETURNS void AS $$
+    DECLARE
+      rt RECORD;
+    BEGIN
+      SELECT
+        creditor_id, transfer_uuid, debtor_id, finalized_at
+      INTO rt
+      FROM running_transfer
+      WHERE creditor_id = coid AND coordinator_request_id = crid
+      FOR NO KEY UPDATE;
+
+      IF NOT FOUND OR rt.finalized_at IS NOT NULL THEN
+        RETURN;
+      END IF;
+
+      IF status_code != 'OK'
+         AND rt.debtor_id = did
+         AND rt.creditor_id = cid
+           THEN
+        PERFORM finalize_running_transfer(
+          rt.creditor_id, rt.transfer_uuid, status_code, total_locked_amount
+        );
+      ELSE
+        PERFORM finalize_running_transfer(
+          rt.creditor_id, rt.transfer_uuid, 'UNEXPECTED_ERROR', NULL
+        );
+      END IF;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+process_prepared_direct_transfer_signal_sp = ReplaceableObject(
+    "process_prepared_direct_transfer_signal("
+    " did BIGINT,"
+    " cid BIGINT,"
+    " tid BIGINT,"
+    " coid BIGINT,"
+    " crid BIGINT,"
+    " locked_amount BIGINT,"
+    " recipient VARCHAR"
+    ")",
+    """
+    RETURNS void AS $$
+    DECLARE
+      rt running_transfer%ROWTYPE;
+    BEGIN
+      SELECT * INTO rt
+      FROM running_transfer
+      WHERE creditor_id = coid AND coordinator_request_id = crid
+      FOR NO KEY UPDATE;
+
+      IF FOUND
+         AND rt.debtor_id = did
+         AND rt.creditor_id = cid
+         AND rt.recipient = recipient
+         AND rt.locked_amount <= locked_amount
+           THEN
+        IF rt.finalized_at IS NULL AND rt.transfer_id IS NULL THEN
+          rt.transfer_id := tid;
+
+          UPDATE running_transfer
+          SET transfer_id = tid
+          WHERE creditor_id = rt.creditor_id AND transfer_uuid = rt.transfer_uuid;
+        END IF;
+
+        IF rt.transfer_id = tid THEN
+          INSERT INTO finalize_transfer_signal (
+            creditor_id, debtor_id, transfer_id,
+            coordinator_id, coordinator_request_id,
+            committed_amount, transfer_note_format, transfer_note,
+            inserted_at
+          )
+          VALUES (
+            cid, rt.debtor_id, tid,
+            coid, crid,
+            rt.amount, rt.transfer_note_format, rt.transfer_note,
+            CURRENT_TIMESTAMP
+          );
+          RETURN;
+        END IF;
+      END IF;
+
+      -- Dismiss the prepared transfer.
+      INSERT INTO finalize_transfer_signal (
+        creditor_id, debtor_id, transfer_id,
+        coordinator_id, coordinator_request_id,
+        committed_amount, transfer_note_format, transfer_note,
+        inserted_at
+      )
+      VALUES (
+        cid, did, tid,
+        coid, crid,
+        0, '', '',
+        CURRENT_TIMESTAMP
+      );
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+process_finalized_direct_transfer_signal_sp = ReplaceableObject(
+    "process_finalized_direct_transfer_signal("
+    " did BIGINT,"
+    " cid BIGINT,"
+    " tid BIGINT,"
+    " coid BIGINT,"
+    " crid BIGINT,"
+    " committed_amount BIGINT,"
+    " status_code VARCHAR,"
+    " total_locked_amount BIGINT"
+    ")",
+    """
+    RETURNS void AS $$
+    DECLARE
+      rt RECORD;
+    BEGIN
+      SELECT
+        creditor_id, transfer_uuid, debtor_id, transfer_id, amount
+      INTO rt
+      FROM running_transfer
+      WHERE creditor_id = coid AND coordinator_request_id = crid
+      FOR NO KEY UPDATE;
+
+      IF NOT FOUND
+         OR rt.debtor_id != did
+         OR rt.creditor_id != cid
+         OR rt.transfer_id IS DISTINCT FROM tid
+           THEN
+        RETURN;
+      END IF;
+
+      IF status_code = 'OK' AND committed_amount = rt.amount THEN
+        PERFORM finalize_running_transfer(
+          rt.creditor_id, rt.transfer_uuid, NULL, NULL
+        );
+      ELSIF status_code != 'OK' AND committed_amount = 0 THEN
+        PERFORM finalize_running_transfer(
+          rt.creditor_id, rt.transfer_uuid, status_code, total_locked_amount
+        );
+      ELSE
+        PERFORM finalize_running_transfer(
+          rt.creditor_id, rt.transfer_uuid, 'UNEXPECTED_ERROR', NULL
+        );
+      END IF;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+
+def upgrade():
+    op.create_sp(finalize_running_transfer_sp)
+    op.create_sp(process_rejected_direct_transfer_signal_sp)
+    op.create_sp(process_prepared_direct_transfer_signal_sp)
+    op.create_sp(process_finalized_direct_transfer_signal_sp)
+
+
+def downgrade():
+    op.drop_sp(process_finalized_direct_transfer_signal_sp)
+    op.drop_sp(process_prepared_direct_transfer_signal_sp)
+    op.drop_sp(process_rejected_direct_transfer_signal_sp)
+    op.drop_sp(finalize_running_transfer_sp)
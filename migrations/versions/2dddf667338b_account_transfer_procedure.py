@@ -0,0 +1,109 @@
+"""account transfer procedure
+
+Revision ID: 2dddf667338b
+Revises: 8b1a6b20f3d5
+Create Date: 2026-10-16 11:03:47.551920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from swpt_creditors.migration_helpers import ReplaceableObject
+
+# revision identifiers, used by Alembic.
+revision = '2dddf667338b'
+down_revision = '8b1a6b20f3d5'
+branch_labels = None
+depends_on = None
+
+process_account_transfer_signal_sp = ReplaceableObject(
+    "process_account_transfer_signal("
+    " did BIGINT,"
+    " cid BIGINT,"
+    " creation_date DATE,"
+    " transfer_number BIGINT,"
+    " coordinator_type VARCHAR,"
+    " sender VARCHAR,"
+    " recipient VARCHAR,"
+    " acquired_amount BIGINT,"
+    " transfer_note_format TEXT,"
+    " transfer_note TEXT,"
+    " committed_at TIMESTAMP WITH TIME ZONE,"
+    " principal BIGINT,"
+    " ts TIMESTAMP WITH TIME ZONE,"
+    " previous_transfer_number BIGINT,"
+    " retention_interval INTERVAL"
+    ")",
+    """
+    RETURNS void AS $$
+    DECLARE
+      current_ts TIMESTAMP WITH TIME ZONE := CURRENT_TIMESTAMP;
+      ledger_date DATE;
+      ledger_last_transfer_number BIGINT;
+    BEGIN
+      IF current_ts - LEAST(ts, committed_at) > retention_interval THEN
+        RETURN;
+      END IF;
+
+      -- NOTE: We must obtain a "FOR SHARE" lock here to ensure that
+      -- the `ledger_last_transfer_number` will not be increased by
+      -- another concurrent transaction, without inserting a
+      -- corresponding `pending_ledger_update` record, which would
+      -- result in the ledger not being updated.
+      SELECT ad.creation_date, ad.ledger_last_transfer_number
+      INTO ledger_date, ledger_last_transfer_number
+      FROM account_data ad
+      WHERE ad.creditor_id = cid AND ad.debtor_id = did
+      FOR SHARE;
+
+      IF NOT FOUND THEN
+        RETURN;
+      END IF;
+
+      INSERT INTO committed_transfer (
+        creditor_id, debtor_id, creation_date, transfer_number,
+        acquired_amount, principal, committed_at, previous_transfer_number,
+        coordinator_type, sender, recipient,
+        transfer_note_format, transfer_note
+      )
+      VALUES (
+        cid, did, creation_date, transfer_number,
+        acquired_amount, principal, committed_at, previous_transfer_number,
+        coordinator_type, sender, recipient,
+        transfer_note_format, transfer_note
+      )
+      ON CONFLICT DO NOTHING;
+
+      IF NOT FOUND THEN
+        -- The transfer has already been processed.
+        RETURN;
+      END IF;
+
+      INSERT INTO pending_log_entry (
+        creditor_id, added_at, object_type_hint,
+        debtor_id, creation_date, transfer_number
+      )
+      VALUES (
+        cid, current_ts, 3,
+        did, creation_date, transfer_number
+      );
+
+      IF creation_date = ledger_date
+         AND previous_transfer_number = ledger_last_transfer_number
+           THEN
+        INSERT INTO pending_ledger_update (creditor_id, debtor_id)
+        VALUES (cid, did)
+        ON CONFLICT DO NOTHING;
+      END IF;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+
+def upgrade():
+    op.create_sp(process_account_transfer_signal_sp)
+
+
+def downgrade():
+    op.drop_sp(process_account_transfer_signal_sp)
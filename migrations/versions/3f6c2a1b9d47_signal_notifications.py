@@ -0,0 +1,63 @@
+"""signal notifications
+
+Revision ID: 3f6c2a1b9d47
+Revises: 10422ed57ae8
+Create Date: 2026-10-16 19:20:42.518306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from swpt_creditors.migration_helpers import ReplaceableObject
+
+# revision identifiers, used by Alembic.
+revision = '3f6c2a1b9d47'
+down_revision = '10422ed57ae8'
+branch_labels = None
+depends_on = None
+
+SIGNAL_TABLES = [
+    'configure_account_signal',
+    'prepare_transfer_signal',
+    'finalize_transfer_signal',
+    'updated_ledger_signal',
+    'updated_policy_signal',
+    'updated_flags_signal',
+    'rejected_config_signal',
+]
+
+notify_signals_inserted_sp = ReplaceableObject(
+    "notify_signals_inserted()",
+    """
+    RETURNS trigger AS $$
+    BEGIN
+      -- NOTE: Identical notifications sent in the same transaction
+      -- are delivered only once. Therefore, at most one notification
+      -- per table will be sent for each transaction.
+      PERFORM pg_notify('swpt_creditors_signals', TG_TABLE_NAME);
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+
+def upgrade():
+    op.create_sp(notify_signals_inserted_sp)
+    for table in SIGNAL_TABLES:
+        # NOTE: The triggers are created disabled. Sending a
+        # notification serializes the commits of all notifying
+        # transactions, and therefore, the triggers are enabled only
+        # when a flushing process starts listening for notifications
+        # (see `swpt_creditors.flush_utils.SignalListener`).
+        op.execute(
+            f"CREATE TRIGGER {table}_notify AFTER INSERT ON {table} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION notify_signals_inserted()"
+        )
+        op.execute(f"ALTER TABLE {table} DISABLE TRIGGER {table}_notify")
+
+
+def downgrade():
+    for table in SIGNAL_TABLES:
+        op.execute(f"DROP TRIGGER {table}_notify ON {table}")
+    op.drop_sp(notify_signals_inserted_sp)
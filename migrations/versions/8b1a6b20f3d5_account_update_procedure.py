@@ -0,0 +1,326 @@
+"""account update procedure
+
+Revision ID: 8b1a6b20f3d5
+Revises: 7efa67e7f781
+Create Date: 2026-10-16 10:12:31.204118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from swpt_creditors.migration_helpers import ReplaceableObject
+
+# revision identifiers, used by Alembic.
+revision = '8b1a6b20f3d5'
+down_revision = '7efa67e7f781'
+branch_labels = None
+depends_on = None
+
+process_account_update_signal_sp = ReplaceableObject(
+    "process_account_update_signal("
+    " did BIGINT,"
+    " cid BIGINT,"
+    " creation_date DATE,"
+    " last_change_ts TIMESTAMP WITH TIME ZONE,"
+    " last_change_seqnum INTEGER,"
+    " principal BIGINT,"
+    " interest FLOAT,"
+    " interest_rate FLOAT,"
+    " last_interest_rate_change_ts TIMESTAMP WITH TIME ZONE,"
+    " transfer_note_max_bytes INTEGER,"
+    " last_config_ts TIMESTAMP WITH TIME ZONE,"
+    " last_config_seqnum INTEGER,"
+    " negligible_amount FLOAT,"
+    " config_flags INTEGER,"
+    " config_data VARCHAR,"
+    " account_id VARCHAR,"
+    " debtor_info_iri VARCHAR,"
+    " debtor_info_content_type VARCHAR,"
+    " debtor_info_sha256 BYTEA,"
+    " last_transfer_number BIGINT,"
+    " last_transfer_committed_at TIMESTAMP WITH TIME ZONE,"
+    " ts TIMESTAMP WITH TIME ZONE,"
+    " ttl INTEGER,"
+    " account_info_object_type VARCHAR,"
+    " account_info_object_uri VARCHAR"
+    ")",
+    """
+    RETURNS void AS $$
+    DECLARE
+      current_ts TIMESTAMP WITH TIME ZONE := CURRENT_TIMESTAMP;
+      ad account_data%ROWTYPE;
+      seqnum_diff BIGINT;
+      is_new_server_account BOOLEAN;
+      is_account_id_changed BOOLEAN;
+      is_config_effectual BOOLEAN;
+      is_info_updated BOOLEAN;
+      new_config_error VARCHAR;
+      ledger_principal BIGINT;
+      ledger_last_transfer_number BIGINT;
+      data account_ledger_data%ROWTYPE;
+      ulr update_ledger_result%ROWTYPE;
+      log_entry pending_log_entry_result%ROWTYPE;
+    BEGIN
+      IF current_ts - ts > make_interval(secs => ttl) THEN
+        RETURN;
+      END IF;
+
+      SELECT * INTO ad
+      FROM account_data
+      WHERE creditor_id = cid AND debtor_id = did
+      FOR NO KEY UPDATE;
+
+      IF NOT FOUND THEN
+        -- The account is orphaned, and should be scheduled for
+        -- deletion (unless it is already scheduled for deletion).
+        IF NOT (
+              config_flags & 1 != 0
+              AND negligible_amount >= (1.0 - 1e-5) * 1e30
+            ) THEN
+          -- NOTE: Using `clock_timestamp()` here, guarantees that the
+          -- primary key will be unique, even when the function is
+          -- called several times in the same transaction.
+          INSERT INTO configure_account_signal (
+            creditor_id, debtor_id, ts, seqnum,
+            negligible_amount, config_data, config_flags,
+            inserted_at
+          )
+          VALUES (
+            cid, did, clock_timestamp(), 0,
+            1e30, '', 0 | 1,
+            current_ts
+          );
+        END IF;
+        RETURN;
+      END IF;
+
+      IF ts > ad.last_heartbeat_ts THEN
+        ad.last_heartbeat_ts := LEAST(ts, current_ts);
+      END IF;
+
+      -- Compare the events the same way `swpt_pythonlib.utils.Seqnum`
+      -- does: sequential numbers wrap around, and a number is
+      -- considered bigger when it is "ahead" by less than 2**31.
+      seqnum_diff := (
+        (last_change_seqnum::BIGINT - ad.last_change_seqnum::BIGINT)
+        & 4294967295
+      );
+      IF creation_date < ad.creation_date
+         OR creation_date = ad.creation_date AND (
+              last_change_ts < ad.last_change_ts
+              OR last_change_ts = ad.last_change_ts
+                 AND NOT seqnum_diff BETWEEN 1 AND 2147483647
+            )
+           THEN
+        -- This is an old event, but it still may contain a newer
+        -- heartbeat timestamp.
+        UPDATE account_data
+        SET last_heartbeat_ts = ad.last_heartbeat_ts
+        WHERE
+          creditor_id = cid
+          AND debtor_id = did
+          AND last_heartbeat_ts < ad.last_heartbeat_ts;
+        RETURN;
+      END IF;
+
+      is_new_server_account := creation_date > ad.creation_date;
+      is_account_id_changed := account_id != ad.account_id;
+      is_config_effectual := (
+        last_config_ts = ad.last_config_ts
+        AND last_config_seqnum = ad.last_config_seqnum
+        AND config_flags = ad.config_flags
+        AND config_data = ad.config_data
+        AND abs(ad.negligible_amount::FLOAT - negligible_amount)
+            <= 1e-5 * negligible_amount
+      );
+      new_config_error := CASE
+        WHEN is_config_effectual THEN NULL
+        ELSE ad.config_error
+      END;
+      is_info_updated := (
+        (
+          NOT ad.has_server_account
+          AND ad.config_flags & 1 != 0
+          AND ad.is_config_effectual
+        )
+        OR ad.account_id != account_id
+        OR abs(ad.interest_rate::FLOAT - interest_rate) > 1e-5 * interest_rate
+        OR ad.last_interest_rate_change_ts != last_interest_rate_change_ts
+        OR ad.transfer_note_max_bytes != transfer_note_max_bytes
+        OR ad.debtor_info_iri IS DISTINCT FROM debtor_info_iri
+        OR ad.debtor_info_content_type IS DISTINCT FROM debtor_info_content_type
+        OR ad.debtor_info_sha256 IS DISTINCT FROM debtor_info_sha256
+        OR ad.config_error IS DISTINCT FROM new_config_error
+      );
+
+      ad.has_server_account := TRUE;
+      ad.creation_date := creation_date;
+      ad.last_change_ts := last_change_ts;
+      ad.last_change_seqnum := last_change_seqnum;
+      ad.principal := principal;
+      ad.interest := interest;
+      ad.interest_rate := interest_rate;
+      ad.last_interest_rate_change_ts := last_interest_rate_change_ts;
+      ad.transfer_note_max_bytes := transfer_note_max_bytes;
+      ad.account_id := account_id;
+      ad.debtor_info_iri := debtor_info_iri;
+      ad.debtor_info_content_type := debtor_info_content_type;
+      ad.debtor_info_sha256 := debtor_info_sha256;
+      ad.last_transfer_number := last_transfer_number;
+      ad.last_transfer_committed_at := last_transfer_committed_at;
+      ad.is_config_effectual := is_config_effectual;
+      ad.config_error := new_config_error;
+
+      IF is_info_updated THEN
+        ad.info_latest_update_id := ad.info_latest_update_id + 1;
+        ad.info_latest_update_ts := current_ts;
+
+        INSERT INTO pending_log_entry (
+          creditor_id, added_at,
+          object_type, object_uri,
+          object_update_id
+        )
+        VALUES (
+          cid, current_ts,
+          account_info_object_type, account_info_object_uri,
+          ad.info_latest_update_id
+        );
+
+        PERFORM nextval('object_update_id_seq');
+      END IF;
+
+      IF is_new_server_account OR is_account_id_changed THEN
+        IF is_new_server_account THEN
+          ad.ledger_pending_transfer_ts := NULL;
+          ledger_principal := 0;
+          ledger_last_transfer_number := 0;
+        ELSE
+          -- When the `account_id` field is changed, we should send a
+          -- corresponding `UpdatedLedgerSignal` message. To do this
+          -- consistently with the Web API, first we need to add a
+          -- ledger update log entry, even when the ledger did not
+          -- really change.
+          ledger_principal := ad.ledger_principal;
+          ledger_last_transfer_number := ad.ledger_last_transfer_number;
+        END IF;
+
+        data := ROW(
+          ad.creditor_id,
+          ad.debtor_id,
+          ad.creation_date,
+          ad.principal,
+          ad.account_id,
+          ad.ledger_principal,
+          ad.ledger_last_entry_id,
+          ad.ledger_last_transfer_number,
+          ad.ledger_latest_update_id,
+          ad.ledger_latest_update_ts,
+          ad.ledger_pending_transfer_ts,
+          ad.last_transfer_number,
+          ad.last_transfer_committed_at
+        );
+        ulr := update_ledger(
+          data,
+          ledger_last_transfer_number,
+          0,
+          ledger_principal,
+          current_ts
+        );
+        data := ulr.data;
+        log_entry := ulr.log_entry;
+
+        IF log_entry IS NULL THEN
+          -- A ledger update log entry must always be inserted here.
+          data.ledger_latest_update_id := data.ledger_latest_update_id + 1;
+          data.ledger_latest_update_ts := current_ts;
+          log_entry := ROW(
+            data.creditor_id,
+            current_ts,
+            4,
+            data.debtor_id,
+            data.ledger_latest_update_id,
+            ledger_principal,
+            data.ledger_last_entry_id + 1
+          );
+        END IF;
+
+        ad.ledger_principal := data.ledger_principal;
+        ad.ledger_last_entry_id := data.ledger_last_entry_id;
+        ad.ledger_last_transfer_number := data.ledger_last_transfer_number;
+        ad.ledger_latest_update_id := data.ledger_latest_update_id;
+        ad.ledger_latest_update_ts := data.ledger_latest_update_ts;
+
+        INSERT INTO updated_ledger_signal (
+          creditor_id, debtor_id, update_id,
+          account_id, creation_date, principal,
+          last_transfer_number, ts,
+          inserted_at
+        )
+        VALUES (
+          cid, did, ad.ledger_latest_update_id,
+          ad.account_id, ad.creation_date, ledger_principal,
+          ledger_last_transfer_number, current_ts,
+          current_ts
+        );
+
+        INSERT INTO pending_log_entry (
+          creditor_id, added_at,
+          object_update_id, object_type_hint,
+          debtor_id, data_principal,
+          data_next_entry_id
+        )
+        VALUES (
+          log_entry.creditor_id, log_entry.added_at,
+          log_entry.object_update_id, log_entry.object_type_hint,
+          log_entry.debtor_id, log_entry.data_principal,
+          log_entry.data_next_entry_id
+        );
+
+        PERFORM nextval('object_update_id_seq');
+
+        INSERT INTO pending_ledger_update (creditor_id, debtor_id)
+        VALUES (cid, did)
+        ON CONFLICT DO NOTHING;
+      END IF;
+
+      UPDATE account_data
+      SET
+        has_server_account = ad.has_server_account,
+        creation_date = ad.creation_date,
+        last_change_ts = ad.last_change_ts,
+        last_change_seqnum = ad.last_change_seqnum,
+        last_heartbeat_ts = ad.last_heartbeat_ts,
+        principal = ad.principal,
+        interest = ad.interest,
+        interest_rate = ad.interest_rate,
+        last_interest_rate_change_ts = ad.last_interest_rate_change_ts,
+        transfer_note_max_bytes = ad.transfer_note_max_bytes,
+        account_id = ad.account_id,
+        debtor_info_iri = ad.debtor_info_iri,
+        debtor_info_content_type = ad.debtor_info_content_type,
+        debtor_info_sha256 = ad.debtor_info_sha256,
+        last_transfer_number = ad.last_transfer_number,
+        last_transfer_committed_at = ad.last_transfer_committed_at,
+        is_config_effectual = ad.is_config_effectual,
+        config_error = ad.config_error,
+        info_latest_update_id = ad.info_latest_update_id,
+        info_latest_update_ts = ad.info_latest_update_ts,
+        ledger_principal = ad.ledger_principal,
+        ledger_last_entry_id = ad.ledger_last_entry_id,
+        ledger_last_transfer_number = ad.ledger_last_transfer_number,
+        ledger_latest_update_id = ad.ledger_latest_update_id,
+        ledger_latest_update_ts = ad.ledger_latest_update_ts,
+        ledger_pending_transfer_ts = ad.ledger_pending_transfer_ts
+      WHERE creditor_id = cid AND debtor_id = did;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+
+def upgrade():
+    op.create_sp(process_account_update_signal_sp)
+
+
+def downgrade():
+    op.drop_sp(process_account_update_signal_sp)
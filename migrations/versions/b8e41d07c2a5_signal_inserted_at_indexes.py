@@ -0,0 +1,41 @@
+"""signal inserted_at indexes
+
+Revision ID: b8e41d07c2a5
+Revises: 3f6c2a1b9d47
+Create Date: 2026-10-16 20:05:11.734452
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e41d07c2a5'
+down_revision = '3f6c2a1b9d47'
+branch_labels = None
+depends_on = None
+
+SIGNAL_TABLES = [
+    'configure_account_signal',
+    'prepare_transfer_signal',
+    'finalize_transfer_signal',
+    'updated_ledger_signal',
+    'updated_policy_signal',
+    'updated_flags_signal',
+    'rejected_config_signal',
+]
+
+
+def upgrade():
+    for table in SIGNAL_TABLES:
+        op.create_index(
+            op.f(f'ix_{table}_inserted_at'),
+            table,
+            ['inserted_at'],
+            unique=False,
+        )
+
+
+def downgrade():
+    for table in SIGNAL_TABLES:
+        op.drop_index(op.f(f'ix_{table}_inserted_at'), table_name=table)
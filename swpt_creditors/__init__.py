@@ -211,12 +211,28 @@ class Configuration(metaclass=MetaEnvReader):
     PROTOCOL_BROKER_THREADS = 1
     PROTOCOL_BROKER_PREFETCH_SIZE = 0
     PROTOCOL_BROKER_PREFETCH_COUNT = 1
+    PROTOCOL_BROKER_BATCH_SIZE = 1
+    PROTOCOL_BROKER_BATCH_WAIT_MILLISECS = 20
+    PROTOCOL_BROKER_STATS_PERIOD = 0.0
+    PROTOCOL_BROKER_DISPATCH_THREADS = 0
+    PROTOCOL_BROKER_TARGET_UTILIZATION = 0.0
+    PROTOCOL_BROKER_ASYNC_PREFETCH_COUNT = 200
+    PROTOCOL_BROKER_ASYNC_DB_CONNECTIONS = 10
+    PROTOCOL_BROKER_TRANSFERS_QUEUE = ""
+    PROTOCOL_BROKER_TRANSFERS_PROCESSES = 1
+    PROTOCOL_BROKER_TRANSFERS_THREADS = 1
+    PROTOCOL_BROKER_TRANSFERS_PREFETCH_COUNT = 1
+    PROTOCOL_BROKER_CONTENT_TYPE = "application/json"
 
     PROCESS_LOG_ADDITIONS_THREADS = 1
     PROCESS_LEDGER_UPDATES_THREADS = 1
 
     FLUSH_PROCESSES = 1
     FLUSH_PERIOD = 2.0
+    FLUSH_LISTEN = False
+    FLUSH_WORKER_COUNT = 0
+    FLUSH_WORKER_INDEX = 0
+    FLUSH_PUBLISHING_CHANNELS = 1
 
     DELETE_PARENT_SHARD_RECORDS = False
 
@@ -253,6 +269,9 @@ class Configuration(metaclass=MetaEnvReader):
     APP_USE_PGPLSQL_FUNCTIONS = True
 
     APP_ENABLE_CORS = False
+    APP_FAST_MESSAGE_DECODING = False
+    APP_DROP_SUPERSEDED_ACCOUNT_UPDATES = False
+    APP_SKIP_CACHE_SIZE = 0
     APP_PROCESS_LOG_ADDITIONS_WAIT = 5.0
     APP_PROCESS_LOG_ADDITIONS_MAX_COUNT = 50000
     APP_PROCESS_LEDGER_UPDATES_BURST = 1000
@@ -265,6 +284,17 @@ class Configuration(metaclass=MetaEnvReader):
     APP_FLUSH_UPDATED_POLICY_BURST_COUNT = 5000
     APP_FLUSH_UPDATED_FLAGS_BURST_COUNT = 5000
     APP_FLUSH_REJECTED_CONFIGS_BURST_COUNT = 5000
+    APP_FLUSH_CONFIGURE_ACCOUNTS_PERIOD = 0.0
+    APP_FLUSH_PREPARE_TRANSFERS_PERIOD = 0.0
+    APP_FLUSH_FINALIZE_TRANSFERS_PERIOD = 0.0
+    APP_FLUSH_UPDATED_LEDGER_PERIOD = 0.0
+    APP_FLUSH_UPDATED_POLICY_PERIOD = 0.0
+    APP_FLUSH_UPDATED_FLAGS_PERIOD = 0.0
+    APP_FLUSH_REJECTED_CONFIGS_PERIOD = 0.0
+    APP_FLUSH_STATS_PERIOD = 0.0
+    APP_FLUSH_DEBOUNCE_MILLISECS = 10
+    APP_FLUSH_LATEST_TRADE_SIGNALS_ONLY = False
+    APP_FLUSH_LATEST_CONFIGS_ONLY = False
     APP_CREDITORS_SCAN_DAYS = 7.0
     APP_CREDITORS_SCAN_BLOCKS_PER_QUERY = 40
     APP_CREDITORS_SCAN_BEAT_MILLISECS = 100
@@ -327,6 +357,7 @@ def create_app(config_dict={}):
     )
     from .schemas import type_registry
     from .cli import swpt_creditors
+    from .message_codecs import is_supported_content_type
     from . import procedures
     from . import models  # noqa
 
@@ -344,6 +375,13 @@ def create_app(config_dict={}):
         app.config["APP_SUPERVISOR_SUBJECT_REGEX"] = _as_regex(
             app.config["OAUTH2_SUPERVISOR_USERNAME"]
         )
+    content_type = app.config["PROTOCOL_BROKER_CONTENT_TYPE"]
+    if not is_supported_content_type(content_type):
+        raise RuntimeError(
+            f'PROTOCOL_BROKER_CONTENT_TYPE is not supported: "{content_type}".'
+            " Note that MessagePack and CBOR require the msgpack and the"
+            " cbor2 packages to be installed."
+        )
     app.config["API_SPEC_OPTIONS"] = specs.API_SPEC_OPTIONS
     app.config["SHARDING_REALM"] = ShardingRealm(
         app.config["PROTOCOL_BROKER_QUEUE_ROUTING_KEY"]
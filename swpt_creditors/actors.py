@@ -1,15 +1,28 @@
 import logging
-import json
-from datetime import datetime, date, timedelta
+import time
+import threading
+from datetime import datetime, date, timedelta, timezone
+from typing import Optional, Callable, NamedTuple, Union, Hashable
 from base64 import b16decode
 from marshmallow import ValidationError
+from sqlalchemy.pool import QueuePool
 from flask import current_app
 import swpt_pythonlib.protocol_schemas as ps
 from swpt_pythonlib import rabbitmq
+from swpt_pythonlib.utils import Seqnum
 from swpt_creditors.extensions import db
 from swpt_creditors import procedures
 from swpt_creditors.models import CT_DIRECT, is_valid_creditor_id
 from swpt_creditors.schemas import ActivateCreditorMessageSchema
+from swpt_creditors.consumer_utils import (
+    ActorBatcher,
+    AdaptiveConcurrencyLimiter,
+    ConsumerStats,
+    KeyedDispatcher,
+    SkipCache,
+    SupersededFilter,
+)
+from swpt_creditors.message_codecs import get_body_parser, compile_schema
 
 
 def _on_rejected_config_signal(
@@ -37,60 +50,43 @@ def _on_rejected_config_signal(
     )
 
 
-def _on_account_update_signal(
-    debtor_id: int,
-    creditor_id: int,
-    last_change_ts: datetime,
-    last_change_seqnum: int,
-    principal: int,
-    interest: float,
-    interest_rate: float,
-    demurrage_rate: float,
-    commit_period: int,
-    transfer_note_max_bytes: int,
-    last_interest_rate_change_ts: datetime,
-    last_transfer_number: int,
-    last_transfer_committed_at: datetime,
-    last_config_ts: datetime,
-    last_config_seqnum: int,
-    creation_date: date,
-    negligible_amount: float,
-    config_data: str,
-    config_flags: int,
-    ts: datetime,
-    ttl: int,
-    account_id: str,
-    debtor_info_iri: str,
-    debtor_info_content_type: str,
-    debtor_info_sha256: str,
-    *args,
-    **kwargs
-) -> None:
+def get_account_update_kwargs(c: dict) -> dict:
+    """Return the arguments for `process_account_update_signal`, given
+    the content of an `AccountUpdate` message.
+    """
+
+    return {
+        "debtor_id": c["debtor_id"],
+        "creditor_id": c["creditor_id"],
+        "creation_date": c["creation_date"],
+        "last_change_ts": c["last_change_ts"],
+        "last_change_seqnum": c["last_change_seqnum"],
+        "principal": c["principal"],
+        "interest": c["interest"],
+        "interest_rate": c["interest_rate"],
+        "last_interest_rate_change_ts": c["last_interest_rate_change_ts"],
+        "transfer_note_max_bytes": c["transfer_note_max_bytes"],
+        "last_config_ts": c["last_config_ts"],
+        "last_config_seqnum": c["last_config_seqnum"],
+        "negligible_amount": c["negligible_amount"],
+        "config_flags": c["config_flags"],
+        "config_data": c["config_data"],
+        "account_id": c["account_id"],
+        "debtor_info_iri": c["debtor_info_iri"] or None,
+        "debtor_info_content_type": c["debtor_info_content_type"] or None,
+        "debtor_info_sha256": (
+            b16decode(c["debtor_info_sha256"], casefold=True) or None
+        ),
+        "last_transfer_number": c["last_transfer_number"],
+        "last_transfer_committed_at": c["last_transfer_committed_at"],
+        "ts": c["ts"],
+        "ttl": c["ttl"],
+    }
+
+
+def _on_account_update_signal(**message_content) -> None:
     procedures.process_account_update_signal(
-        debtor_id=debtor_id,
-        creditor_id=creditor_id,
-        creation_date=creation_date,
-        last_change_ts=last_change_ts,
-        last_change_seqnum=last_change_seqnum,
-        principal=principal,
-        interest=interest,
-        interest_rate=interest_rate,
-        last_interest_rate_change_ts=last_interest_rate_change_ts,
-        transfer_note_max_bytes=transfer_note_max_bytes,
-        last_config_ts=last_config_ts,
-        last_config_seqnum=last_config_seqnum,
-        negligible_amount=negligible_amount,
-        config_flags=config_flags,
-        config_data=config_data,
-        account_id=account_id,
-        debtor_info_iri=debtor_info_iri or None,
-        debtor_info_content_type=debtor_info_content_type or None,
-        debtor_info_sha256=b16decode(debtor_info_sha256, casefold=True)
-        or None,
-        last_transfer_number=last_transfer_number,
-        last_transfer_committed_at=last_transfer_committed_at,
-        ts=ts,
-        ttl=ttl,
+        **get_account_update_kwargs(message_content)
     )
 
 
@@ -109,42 +105,35 @@ def _on_account_purge_signal(
     )
 
 
-def _on_account_transfer_signal(
-    debtor_id: int,
-    creditor_id: int,
-    transfer_number: int,
-    creation_date: date,
-    coordinator_type: str,
-    sender: str,
-    recipient: str,
-    acquired_amount: int,
-    transfer_note_format: str,
-    transfer_note: str,
-    committed_at: datetime,
-    principal: int,
-    ts: datetime,
-    previous_transfer_number: int,
-    *args,
-    **kwargs
-) -> None:
-    procedures.process_account_transfer_signal(
-        debtor_id=debtor_id,
-        creditor_id=creditor_id,
-        creation_date=creation_date,
-        transfer_number=transfer_number,
-        coordinator_type=coordinator_type,
-        sender=sender,
-        recipient=recipient,
-        acquired_amount=acquired_amount,
-        transfer_note_format=transfer_note_format,
-        transfer_note=transfer_note,
-        committed_at=committed_at,
-        principal=principal,
-        ts=ts,
-        previous_transfer_number=previous_transfer_number,
-        retention_interval=timedelta(
-            days=current_app.config["APP_LOG_RETENTION_DAYS"]
+def get_account_transfer_kwargs(c: dict, config) -> dict:
+    """Return the arguments for `process_account_transfer_signal`,
+    given the content of an `AccountTransfer` message.
+    """
+
+    return {
+        "debtor_id": c["debtor_id"],
+        "creditor_id": c["creditor_id"],
+        "creation_date": c["creation_date"],
+        "transfer_number": c["transfer_number"],
+        "coordinator_type": c["coordinator_type"],
+        "sender": c["sender"],
+        "recipient": c["recipient"],
+        "acquired_amount": c["acquired_amount"],
+        "transfer_note_format": c["transfer_note_format"],
+        "transfer_note": c["transfer_note"],
+        "committed_at": c["committed_at"],
+        "principal": c["principal"],
+        "ts": c["ts"],
+        "previous_transfer_number": c["previous_transfer_number"],
+        "retention_interval": timedelta(
+            days=config["APP_LOG_RETENTION_DAYS"]
         ),
+    }
+
+
+def _on_account_transfer_signal(**message_content) -> None:
+    procedures.process_account_transfer_signal(
+        **get_account_transfer_kwargs(message_content, current_app.config)
     )
 
 
@@ -328,34 +317,104 @@ _LOGGER = logging.getLogger(__name__)
 TerminatedConsumtion = rabbitmq.TerminatedConsumtion
 
 
-class SmpConsumer(rabbitmq.Consumer):
-    """Passes messages to proper handlers (actors)."""
+class DecodedMessage(NamedTuple):
+    type: str
+    actor: Callable[..., None]
+    content: dict
+    skip_key: Optional[Hashable] = None
+
+
+class MessageDecoder:
+    """Decodes and validates incoming SMP messages.
+
+    When `fast_decoding` is true, the messages will be parsed and
+    validated by the functions from the `message_codecs` module, which
+    are faster, but give the same results. The time spent in decoding
+    and validation, as well as the number of rejected and expired
+    messages, are recorded in `stats`.
+
+    Besides "application/json", the "application/msgpack" and the
+    "application/cbor" content types are accepted, if the `msgpack` or
+    the `cbor2` package is installed (see `message_codecs`).
+
+    When `skip_cache_size` is bigger than zero, the keys of up to
+    `skip_cache_size` recently applied messages will be remembered
+    (see the `remember` method), and redelivered messages with the
+    same keys will be acknowledged without being validated and
+    processed again. This is done only for message types that would
+    be ignored by their actors anyway, if received twice.
+    """
+
+    def __init__(
+        self,
+        stats: ConsumerStats,
+        fast_decoding: bool = False,
+        skip_cache_size: int = 0,
+    ):
+        self.stats = stats
+        self._fast_decoding = fast_decoding
+        self._skip_cache = (
+            SkipCache(skip_cache_size) if skip_cache_size > 0 else None
+        )
+        if fast_decoding:
+            self._loaders = {
+                message_type: compile_schema(schema)
+                for message_type, (schema, _) in _MESSAGE_TYPES.items()
+            }
+        else:
+            self._loaders = {
+                message_type: schema.load
+                for message_type, (schema, _) in _MESSAGE_TYPES.items()
+            }
+
+    def decode(self, body, properties) -> Union[DecodedMessage, bool]:
+        """Decode and validate the message.
+
+        Returns either a `DecodedMessage`, or (when the message should
+        not be processed) the value that `process_message` should
+        return: `False` for invalid messages, and `True` for expired
+        messages.
+        """
+
+        stats = self.stats
+        massage_type = getattr(properties, "type", None)
+        stats_key = (
+            massage_type if massage_type in _MESSAGE_TYPES else "UNKNOWN"
+        )
 
-    def process_message(self, body, properties):
         content_type = getattr(properties, "content_type", None)
-        if content_type != "application/json":
+        parse = get_body_parser(content_type, self._fast_decoding)
+        if parse is None:
             _LOGGER.error('Unknown message content type: "%s"', content_type)
+            stats.increment(stats_key, "rejected")
             return False
 
-        massage_type = getattr(properties, "type", None)
         try:
-            schema, actor = _MESSAGE_TYPES[massage_type]
+            load = self._loaders[massage_type]
+            actor = _MESSAGE_TYPES[massage_type][1]
         except KeyError:
             _LOGGER.error('Unknown message type: "%s"', massage_type)
+            stats.increment(stats_key, "rejected")
             return False
 
+        started_at = time.monotonic()
         try:
-            obj = json.loads(body.decode("utf8"))
-        except (UnicodeError, json.JSONDecodeError):
+            obj = parse(body)
+        except ValueError:
             _LOGGER.error(
-                "The message does not contain a valid JSON document."
+                'The message does not contain a valid "%s" document.',
+                content_type,
             )
+            stats.increment(stats_key, "rejected")
             return False
 
+        decoded_at = time.monotonic()
+        stats.observe(stats_key, "decode", decoded_at - started_at)
         try:
-            message_content = schema.load(obj)
+            message_content = load(obj)
         except ValidationError as e:
             _LOGGER.error("Message validation error: %s", str(e))
+            stats.increment(stats_key, "rejected")
             return False
 
         if (
@@ -366,6 +425,374 @@ class SmpConsumer(rabbitmq.Consumer):
                 "The agent is not responsible for this creditor."
             )
 
-        actor(**message_content)
-        db.session.close()
+        stats.observe(stats_key, "validate", time.monotonic() - decoded_at)
+        is_expired = _EXPIRATION_CHECKS.get(massage_type)
+        if is_expired and is_expired(message_content):
+            # NOTE: Expired messages would be ignored by the actor
+            # anyway. Here we avoid opening a database transaction.
+            stats.increment(stats_key, "expired")
+            return True
+
+        skip_cache = self._skip_cache
+        skip_key = None
+        if skip_cache is not None:
+            skip_key = _get_skip_key(massage_type, message_content)
+            if skip_key is not None and skip_key in skip_cache:
+                stats.increment(stats_key, "duplicate")
+                return True
+
+        return DecodedMessage(massage_type, actor, message_content, skip_key)
+
+    def remember(self, decoded: DecodedMessage) -> None:
+        """Remember that the message has been successfully processed."""
+
+        if decoded.skip_key is not None:
+            self._skip_cache.add(decoded.skip_key)
+
+
+class SmpConsumer(rabbitmq.Consumer):
+    """Passes messages to proper handlers (actors).
+
+    When `batch_size` is bigger than 1, the actors for up to
+    `batch_size` messages (processed in parallel by the consumer
+    threads) will be executed in a single database transaction. A
+    batch will wait at most `batch_wait` seconds for more messages to
+    arrive. When `batch_size` and `batch_wait` are not specified, the
+    values of the PROTOCOL_BROKER_BATCH_SIZE and
+    PROTOCOL_BROKER_BATCH_WAIT_MILLISECS configuration variables will
+    be used.
+
+    For each message type, the consumer counts the processed and the
+    rejected messages, and measures the time spent in JSON decoding,
+    in validation, and in the actor. Every `stats_period` seconds
+    (PROTOCOL_BROKER_STATS_PERIOD by default), the collected
+    statistics are logged as a single JSON line.
+
+    When `fast_decoding` is true (APP_FAST_MESSAGE_DECODING by
+    default), the messages will be parsed and validated by the
+    functions from the `message_codecs` module, which are faster, but
+    give the same results (see `MessageDecoder`).
+
+    When `dispatch_threads` is bigger than zero
+    (PROTOCOL_BROKER_DISPATCH_THREADS by default), the actors will be
+    executed by a separate set of `dispatch_threads` worker threads,
+    and the worker thread for each message will be chosen by the hash
+    of its (creditor_id, debtor_id) pair. Therefore, messages for the
+    same account will be processed one after another, on the same
+    thread, and will not wait for each other's database row locks.
+
+    When `drop_superseded` is true
+    (APP_DROP_SUPERSEDED_ACCOUNT_UPDATES by default), `AccountUpdate`
+    messages which are superseded by a newer in-flight `AccountUpdate`
+    message for the same account will be acknowledged without being
+    processed, and will be counted as "superseded" (not as
+    "processed"). The messages are ordered by (creation_date,
+    last_change_ts, Seqnum(last_change_seqnum), ts). Note that only
+    messages that have been passed to `process_message` can be
+    compared, and without batching or dispatching, messages almost
+    never wait for each other. Therefore, this option takes effect
+    only when `batch_size` is bigger than 1, or `dispatch_threads` is
+    bigger than zero.
+
+    When `target_utilization` is bigger than zero
+    (PROTOCOL_BROKER_TARGET_UTILIZATION by default), the number of
+    consumer threads that are allowed to execute actors at the same
+    time will be adjusted automatically, according to the measured
+    actor latency and the saturation of the database connection pool
+    (see `AdaptiveConcurrencyLimiter`). In this case, the number of
+    consumer threads and the prefetch count should be set to the
+    biggest acceptable values.
+
+    When `skip_cache_size` is bigger than zero (APP_SKIP_CACHE_SIZE by
+    default), the keys of the recently processed messages will be
+    remembered, so that redelivered messages can be acknowledged
+    without touching the database (see `MessageDecoder`).
+    """
+
+    def __init__(
+        self,
+        *args,
+        batch_size: int = None,
+        batch_wait: float = None,
+        stats_period: float = None,
+        fast_decoding: bool = None,
+        dispatch_threads: int = None,
+        drop_superseded: bool = None,
+        target_utilization: float = None,
+        skip_cache_size: int = None,
+        **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self._threads = kwargs.get("threads")
+        self._target_utilization = target_utilization
+        self._limiter = None
+        self._batch_size = batch_size
+        self._batch_wait = batch_wait
+        self._stats_period = stats_period
+        self._fast_decoding = fast_decoding
+        self._dispatch_threads = dispatch_threads
+        self._dispatcher = None
+        self._drop_superseded = drop_superseded
+        self._superseded_filter = None
+        self._skip_cache_size = skip_cache_size
+        self._decoder = None
+        self._batcher = None
+        self._stats = None
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    @property
+    def stats(self) -> ConsumerStats:
+        self._ensure_initialized()
+        return self._stats
+
+    def process_message(self, body, properties):
+        self._ensure_initialized()
+        decoded = self._decoder.decode(body, properties)
+        if isinstance(decoded, bool):
+            return decoded
+
+        massage_type, actor, message_content, _ = decoded
+        stats = self._stats
+        started_at = time.monotonic()
+        if (
+                massage_type == "AccountUpdate"
+                and self._superseded_filter is not None
+        ):
+            account_key = (
+                message_content["creditor_id"],
+                message_content["debtor_id"],
+            )
+            order = _get_account_update_order(message_content)
+            self._superseded_filter.register(account_key, order)
+            actor = self._skip_if_superseded(actor, account_key, order)
+        else:
+            account_key = None
+
+        try:
+            self._execute_actor(actor, message_content)
+        except Exception:
+            stats.increment(massage_type, "failed")
+            raise
+        finally:
+            if account_key is not None:
+                self._superseded_filter.release(account_key)
+
+        self._decoder.remember(decoded)
+        if not getattr(actor, "superseded", False):
+            stats.observe(
+                massage_type, "actor", time.monotonic() - started_at
+            )
+            stats.increment(massage_type, "processed")
+
         return True
+
+    def _skip_if_superseded(self, actor, account_key, order):
+        superseded_filter = self._superseded_filter
+        stats = self._stats
+
+        def run_actor_unless_superseded(**kwargs):
+            # NOTE: The check is performed right before the actor is
+            # executed, so that all the messages which have arrived
+            # in the meantime are taken into account.
+            if superseded_filter.is_superseded(account_key, order):
+                if not run_actor_unless_superseded.superseded:
+                    run_actor_unless_superseded.superseded = True
+                    stats.increment("AccountUpdate", "superseded")
+            else:
+                actor(**kwargs)
+
+        run_actor_unless_superseded.superseded = False
+        return run_actor_unless_superseded
+
+    def _execute_actor(self, actor, message_content: dict) -> None:
+        if self._limiter is None:
+            self._dispatch_actor(actor, message_content)
+        else:
+            self._limiter.run(self._dispatch_actor, actor, message_content)
+
+    def _dispatch_actor(self, actor, message_content: dict) -> None:
+        if self._dispatcher is None:
+            self._run_actor(actor, message_content)
+        else:
+            account_key = (
+                message_content["creditor_id"],
+                message_content.get("debtor_id"),
+            )
+            self._dispatcher.run(
+                account_key, self._run_actor, actor, message_content
+            )
+
+    def _run_actor(self, actor, message_content: dict) -> None:
+        if self._batcher is None:
+            actor(**message_content)
+        else:
+            self._batcher.run(actor, message_content)
+
+        db.session.close()
+
+    def _ensure_initialized(self) -> None:
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self._initialize(current_app.config)
+                    self._initialized = True
+
+    def _initialize(self, config) -> None:
+        batch_size = self._batch_size or config["PROTOCOL_BROKER_BATCH_SIZE"]
+        batch_wait = (
+            self._batch_wait
+            if self._batch_wait is not None
+            else config["PROTOCOL_BROKER_BATCH_WAIT_MILLISECS"] / 1000.0
+        )
+        if batch_size > 1:
+            self._batcher = ActorBatcher(batch_size, batch_wait)
+
+        stats_period = (
+            self._stats_period
+            if self._stats_period is not None
+            else config["PROTOCOL_BROKER_STATS_PERIOD"]
+        )
+        self._stats = ConsumerStats(stats_period)
+
+        dispatch_threads = (
+            self._dispatch_threads
+            if self._dispatch_threads is not None
+            else config["PROTOCOL_BROKER_DISPATCH_THREADS"]
+        )
+        if dispatch_threads > 0:
+            self._dispatcher = KeyedDispatcher(
+                dispatch_threads, current_app._get_current_object()
+            )
+
+        drop_superseded = (
+            self._drop_superseded
+            if self._drop_superseded is not None
+            else config["APP_DROP_SUPERSEDED_ACCOUNT_UPDATES"]
+        )
+        if drop_superseded and (batch_size > 1 or dispatch_threads > 0):
+            self._superseded_filter = SupersededFilter()
+
+        fast_decoding = (
+            self._fast_decoding
+            if self._fast_decoding is not None
+            else config["APP_FAST_MESSAGE_DECODING"]
+        )
+        skip_cache_size = (
+            self._skip_cache_size
+            if self._skip_cache_size is not None
+            else config["APP_SKIP_CACHE_SIZE"]
+        )
+        self._decoder = MessageDecoder(
+            self._stats, fast_decoding, skip_cache_size
+        )
+
+        target_utilization = (
+            self._target_utilization
+            if self._target_utilization is not None
+            else config["PROTOCOL_BROKER_TARGET_UTILIZATION"]
+        )
+        if target_utilization > 0.0:
+            self._limiter = AdaptiveConcurrencyLimiter(
+                self._threads or config["PROTOCOL_BROKER_THREADS"],
+                target_utilization,
+                is_saturated=_is_db_pool_saturated,
+            )
+
+
+def _is_db_pool_saturated() -> bool:
+    pool = db.engine.pool
+    if isinstance(pool, QueuePool) and pool.size() > 0:
+        return pool.checkedout() >= pool.size()
+
+    return False
+
+
+def _is_account_update_expired(message_content: dict) -> bool:
+    """Check if the ttl of the validated `AccountUpdate` message has
+    passed.
+    """
+
+    current_ts = datetime.now(tz=timezone.utc)
+    ts = message_content["ts"]
+    return (current_ts - ts).total_seconds() > message_content["ttl"]
+
+
+def _is_account_transfer_expired(message_content: dict) -> bool:
+    """Check if the validated `AccountTransfer` message is older than
+    the retention interval.
+    """
+
+    current_ts = datetime.now(tz=timezone.utc)
+    retention_interval = timedelta(
+        days=current_app.config["APP_LOG_RETENTION_DAYS"]
+    )
+    ts = message_content["ts"]
+    committed_at = message_content["committed_at"]
+    return current_ts - min(ts, committed_at) > retention_interval
+
+
+_EXPIRATION_CHECKS = {
+    "AccountUpdate": _is_account_update_expired,
+    "AccountTransfer": _is_account_transfer_expired,
+}
+
+
+# NOTE: Only the message types for which the processing of a second
+# identical message has no effect are included here. For example,
+# `PreparedTransfer` messages are not included, because their
+# processing (re)sends a `FinalizeTransfer` message.
+_SKIP_KEY_FIELDS = {
+    "AccountUpdate": (
+        "creditor_id",
+        "debtor_id",
+        "creation_date",
+        "last_change_ts",
+        "last_change_seqnum",
+        "ts",
+    ),
+    "AccountTransfer": (
+        "creditor_id",
+        "debtor_id",
+        "creation_date",
+        "transfer_number",
+    ),
+    "RejectedTransfer": (
+        "creditor_id",
+        "debtor_id",
+        "coordinator_type",
+        "coordinator_id",
+        "coordinator_request_id",
+    ),
+    "FinalizedTransfer": (
+        "creditor_id",
+        "debtor_id",
+        "transfer_id",
+        "coordinator_type",
+        "coordinator_id",
+        "coordinator_request_id",
+    ),
+}
+
+
+def _get_skip_key(
+    message_type: str, message_content: dict
+) -> Optional[tuple]:
+    """Return the skip cache key for the validated message, or `None`
+    if messages of this type should never be skipped.
+    """
+
+    fields = _SKIP_KEY_FIELDS.get(message_type)
+    if fields is None:
+        return None
+
+    return (message_type, *(message_content[field] for field in fields))
+
+
+def _get_account_update_order(message_content: dict) -> tuple:
+    return (
+        message_content["creation_date"],
+        message_content["last_change_ts"],
+        Seqnum(message_content["last_change_seqnum"]),
+        message_content["ts"],
+    )
@@ -0,0 +1,294 @@
+"""An asyncio-based consumer for incoming SMP messages.
+
+This is an alternative to `actors.SmpConsumer`, which allows hundreds
+of messages to be processed concurrently by a single process. The
+messages are decoded and validated exactly as `SmpConsumer` does it.
+The message types for which there is a PG/PLSQL implementation are
+processed asynchronously, by calling the corresponding stored
+procedure via an async database engine. All other message types are
+processed by calling their actors in a thread pool.
+
+NOTE: This module requires the `aio-pika` package to be installed.
+"""
+
+import asyncio
+import logging
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Set, Tuple
+import psycopg.errors
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+from sqlalchemy.sql.expression import TextClause
+from swpt_creditors.actors import (
+    MessageDecoder,
+    DecodedMessage,
+    get_account_update_kwargs,
+    get_account_transfer_kwargs,
+)
+from swpt_creditors.consumer_utils import ConsumerStats
+from swpt_creditors.models import CT_DIRECT
+from swpt_creditors.procedures.account_updates import (
+    CALL_PROCESS_ACCOUNT_UPDATE_SIGNAL,
+    get_account_update_signal_params,
+)
+from swpt_creditors.procedures.transfers import (
+    CALL_PROCESS_ACCOUNT_TRANSFER_SIGNAL,
+    CALL_PROCESS_REJECTED_DIRECT_TRANSFER_SIGNAL,
+    CALL_PROCESS_PREPARED_DIRECT_TRANSFER_SIGNAL,
+    CALL_PROCESS_FINALIZED_DIRECT_TRANSFER_SIGNAL,
+)
+
+try:
+    import aio_pika
+except ImportError:  # pragma: no cover
+    aio_pika = None
+
+_LOGGER = logging.getLogger(__name__)
+
+HANDLED_SIGNALS = {signal.SIGINT, signal.SIGTERM}
+MAX_RETRIES = 5
+RETRIABLE_DB_ERRORS = (
+    psycopg.errors.SerializationFailure,
+    psycopg.errors.DeadlockDetected,
+)
+
+
+def _check_coordinator_type(coordinator_type: str) -> None:
+    if coordinator_type != CT_DIRECT:  # pragma: no cover
+        raise RuntimeError(
+            f'Unexpected coordinator type: "{coordinator_type}"'
+        )
+
+
+def _get_account_update_params(c: dict, config) -> dict:
+    return get_account_update_signal_params(get_account_update_kwargs(c))
+
+
+def _get_rejected_direct_transfer_params(c: dict, config) -> dict:
+    _check_coordinator_type(c["coordinator_type"])
+    return {
+        "coordinator_id": c["coordinator_id"],
+        "coordinator_request_id": c["coordinator_request_id"],
+        "status_code": c["status_code"],
+        "total_locked_amount": c["total_locked_amount"],
+        "debtor_id": c["debtor_id"],
+        "creditor_id": c["creditor_id"],
+    }
+
+
+def _get_prepared_direct_transfer_params(c: dict, config) -> dict:
+    _check_coordinator_type(c["coordinator_type"])
+    return {
+        "debtor_id": c["debtor_id"],
+        "creditor_id": c["creditor_id"],
+        "transfer_id": c["transfer_id"],
+        "coordinator_id": c["coordinator_id"],
+        "coordinator_request_id": c["coordinator_request_id"],
+        "locked_amount": c["locked_amount"],
+        "recipient": c["recipient"],
+    }
+
+
+def _get_finalized_direct_transfer_params(c: dict, config) -> dict:
+    _check_coordinator_type(c["coordinator_type"])
+    return {
+        "debtor_id": c["debtor_id"],
+        "creditor_id": c["creditor_id"],
+        "transfer_id": c["transfer_id"],
+        "coordinator_id": c["coordinator_id"],
+        "coordinator_request_id": c["coordinator_request_id"],
+        "committed_amount": c["committed_amount"],
+        "status_code": c["status_code"],
+        "total_locked_amount": c["total_locked_amount"],
+    }
+
+
+_STORED_PROCEDURE_CALLS: Dict[
+    str, Tuple[TextClause, Callable[[dict, dict], dict]]
+] = {
+    "AccountUpdate": (
+        CALL_PROCESS_ACCOUNT_UPDATE_SIGNAL,
+        _get_account_update_params,
+    ),
+    "AccountTransfer": (
+        CALL_PROCESS_ACCOUNT_TRANSFER_SIGNAL,
+        get_account_transfer_kwargs,
+    ),
+    "RejectedTransfer": (
+        CALL_PROCESS_REJECTED_DIRECT_TRANSFER_SIGNAL,
+        _get_rejected_direct_transfer_params,
+    ),
+    "PreparedTransfer": (
+        CALL_PROCESS_PREPARED_DIRECT_TRANSFER_SIGNAL,
+        _get_prepared_direct_transfer_params,
+    ),
+    "FinalizedTransfer": (
+        CALL_PROCESS_FINALIZED_DIRECT_TRANSFER_SIGNAL,
+        _get_finalized_direct_transfer_params,
+    ),
+}
+
+
+class AsyncSmpConsumer:
+    """Consumes and processes SMP messages using asyncio.
+
+    Up to `prefetch_count` messages will be processed concurrently.
+    Stored procedures are called using a pool of up to
+    `db_connections` database connections, and the actors for which
+    there are no stored procedures are executed in a pool of
+    `threads` threads. When APP_USE_PGPLSQL_FUNCTIONS is false, all
+    messages will be processed by the thread pool.
+
+    The `run` method must be called with a pushed application context.
+    """
+
+    def __init__(
+        self,
+        app,
+        *,
+        url: str,
+        queue: str,
+        prefetch_count: int,
+        threads: int,
+        db_connections: int,
+        stats_period: float = 0.0,
+        fast_decoding: bool = False,
+        skip_cache_size: int = 0,
+    ):
+        assert prefetch_count > 0
+        assert threads > 0
+        assert db_connections > 0
+        self.app = app
+        self.url = url
+        self.queue = queue
+        self.prefetch_count = prefetch_count
+        self.threads = threads
+        self.db_connections = db_connections
+        self.stats = ConsumerStats(stats_period)
+        self._decoder = MessageDecoder(
+            self.stats, fast_decoding, skip_cache_size
+        )
+        self._stored_procedure_calls = (
+            _STORED_PROCEDURE_CALLS
+            if app.config["APP_USE_PGPLSQL_FUNCTIONS"]
+            else {}
+        )
+        self._tasks: Set[asyncio.Task] = set()
+        self._stopped: Optional[asyncio.Event] = None
+        self._failed = False
+        self._engine: Optional[AsyncEngine] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def run(self) -> None:
+        """Consume messages until stopped by a signal.
+
+        Raises `RuntimeError` if the consumption has been stopped due
+        to an error.
+        """
+
+        if aio_pika is None:  # pragma: no cover
+            raise RuntimeError(
+                "The asyncio consumer requires the aio-pika package."
+            )
+
+        asyncio.run(self._run())
+        if self._failed:
+            raise RuntimeError("The message consumption has been stopped.")
+
+    def stop(self) -> None:
+        if self._stopped is not None:
+            self._stopped.set()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        for sig in HANDLED_SIGNALS:
+            loop.add_signal_handler(sig, self.stop)
+
+        self._engine = create_async_engine(
+            self.app.config["SQLALCHEMY_DATABASE_URI"],
+            pool_size=self.db_connections,
+            max_overflow=0,
+        )
+        self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        connection = await aio_pika.connect_robust(self.url)
+        try:
+            channel = await connection.channel()
+            await channel.set_qos(prefetch_count=self.prefetch_count)
+            queue = await channel.get_queue(self.queue)
+            consumer_tag = await queue.consume(self._on_message)
+            await self._stopped.wait()
+
+            await queue.cancel(consumer_tag)
+            if self._tasks:
+                await asyncio.wait(self._tasks)
+        finally:
+            await connection.close()
+            await self._engine.dispose()
+            self._executor.shutdown()
+
+    async def _on_message(self, message) -> None:
+        task = asyncio.ensure_future(self._process_message(message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process_message(self, message) -> None:
+        try:
+            decoded = self._decoder.decode(message.body, message)
+            if decoded is False:
+                await message.reject(requeue=False)
+            elif decoded is True:
+                await message.ack()
+            else:
+                await self._execute(decoded)
+                await message.ack()
+        except Exception:
+            _LOGGER.exception("Caught error while processing a message.")
+            self._failed = True
+            self.stop()
+            await message.nack(requeue=True)
+
+    async def _execute(self, decoded: DecodedMessage) -> None:
+        stats = self.stats
+        started_at = time.monotonic()
+        try:
+            call = self._stored_procedure_calls.get(decoded.type)
+            if call is None:
+                await asyncio.get_running_loop().run_in_executor(
+                    self._executor,
+                    self._run_actor,
+                    decoded.actor,
+                    decoded.content,
+                )
+            else:
+                statement, get_params = call
+                params = get_params(decoded.content, self.app.config)
+                await self._call_stored_procedure(statement, params)
+        except Exception:
+            stats.increment(decoded.type, "failed")
+            raise
+
+        self._decoder.remember(decoded)
+        stats.observe(decoded.type, "actor", time.monotonic() - started_at)
+        stats.increment(decoded.type, "processed")
+
+    async def _call_stored_procedure(
+        self, statement: TextClause, params: dict
+    ) -> None:
+        for retry in range(MAX_RETRIES + 1):
+            try:
+                async with self._engine.begin() as conn:
+                    await conn.execute(statement, params)
+                return
+            except OperationalError as e:
+                if (
+                        retry == MAX_RETRIES
+                        or not isinstance(e.orig, RETRIABLE_DB_ERRORS)
+                ):
+                    raise
+
+    def _run_actor(self, actor, message_content: dict) -> None:
+        with self.app.app_context():
+            actor(**message_content)
@@ -1,9 +1,12 @@
 import logging
+import json
 import os
 import time
 import signal
 import sys
 import random
+import multiprocessing
+import multiprocessing.connection
 import click
 import pika
 from typing import Optional, Any
@@ -25,6 +28,7 @@ from .table_scanners import (
 from swpt_pythonlib.multiproc_utils import (
     ThreadPoolProcessor,
     spawn_worker_processes,
+    try_block_signals,
     try_unblock_signals,
     HANDLED_SIGNALS,
 )
@@ -32,6 +36,16 @@ from swpt_pythonlib.flask_signalbus import SignalBus, get_models_to_flush
 
 CA_LOOPBACK_EXCHANGE = "ca.loopback"
 CA_LOOPBACK_FILTER_EXCHANGE = "ca.loopback_filter"
+CA_TRANSFERS_SPLIT_EXCHANGE = "ca.transfers_split"
+CA_TRANSFERS_EXCHANGE = "ca.transfers"
+
+# When a separate queue for transfer messages is configured, these
+# message types will be routed to it, instead of to the main queue.
+TRANSFER_MESSAGE_TYPES = [
+    "PreparedTransfer",
+    "FinalizedTransfer",
+    "RejectedTransfer",
+]
 
 
 @click.group("swpt_creditors")
@@ -59,7 +73,15 @@ def swpt_creditors():
     type=str,
     help="The RabbitMQ binding key for the queue.",
 )
-def subscribe(url, queue, queue_routing_key):  # pragma: no cover
+@click.option(
+    "-t",
+    "--transfers-queue",
+    type=str,
+    help="The name of a separate queue for transfer messages.",
+)
+def subscribe(
+    url, queue, queue_routing_key, transfers_queue
+):  # pragma: no cover
     """Declare a RabbitMQ queue, and subscribe it to receive incoming
     messages.
 
@@ -71,6 +93,19 @@ def subscribe(url, queue, queue_routing_key):  # pragma: no cover
     * PROTOCOL_BROKER_QUEUE (defalut "swpt_creditors")
 
     * PROTOCOL_BROKER_QUEUE_ROUTING_KEY (default "#")
+
+    * PROTOCOL_BROKER_TRANSFERS_QUEUE (default "", meaning no separate
+      queue for transfer messages)
+
+    When a separate queue for transfer messages is specified, the
+    PreparedTransfer, FinalizedTransfer, and RejectedTransfer messages
+    will be routed to it, instead of to the main queue. In this case,
+    the incoming messages for all shards that share the same RabbitMQ
+    exchanges will be routed through the "ca.transfers_split" exchange
+    (even when the shards are subscribed without a separate queue for
+    transfer messages), but the transfer messages for shards that do
+    not have a separate queue will still be delivered to their main
+    queues.
     """
 
     from .extensions import (
@@ -86,7 +121,10 @@ def subscribe(url, queue, queue_routing_key):  # pragma: no cover
         queue_routing_key
         or current_app.config["PROTOCOL_BROKER_QUEUE_ROUTING_KEY"]
     )
-    dead_letter_queue_name = queue_name + ".XQ"
+    transfers_queue_name = (
+        transfers_queue
+        or current_app.config["PROTOCOL_BROKER_TRANSFERS_QUEUE"]
+    )
     broker_url = url or current_app.config["PROTOCOL_BROKER_URL"]
     connection = pika.BlockingConnection(pika.URLParameters(broker_url))
     channel = connection.channel()
@@ -133,19 +171,162 @@ def subscribe(url, queue, queue_routing_key):  # pragma: no cover
         CA_LOOPBACK_FILTER_EXCHANGE,
         CA_LOOPBACK_EXCHANGE,
     )
+    # route the incoming messages
+    if transfers_queue_name or _exchange_exists(
+            connection, CA_TRANSFERS_SPLIT_EXCHANGE
+    ):
+        _route_through_split_exchange(channel)
+    else:
+        _route_directly(channel)
+
+    # declare and bind the queue
+    _declare_queue(channel, queue_name)
+    _bind_queue(channel, CA_CREDITORS_EXCHANGE, queue_name, routing_key)
+
+    # bind the queue to the loopback exchange
+    channel.queue_bind(
+        exchange=CA_LOOPBACK_EXCHANGE,
+        queue=queue_name,
+    )
+    logger.info(
+        'Created a binding from "%s" to "%s".',
+        CA_LOOPBACK_EXCHANGE,
+        queue_name,
+    )
+
+    # declare and bind the transfers queue
+    if transfers_queue_name:
+        _declare_queue(channel, transfers_queue_name)
+        _bind_queue(
+            channel, CA_TRANSFERS_EXCHANGE, transfers_queue_name, routing_key
+        )
+
+
+def _get_incoming_messages_binding_arguments() -> dict:
+    return {
+        "x-match": "all",
+        "ca-creditors": True,
+    }
+
+
+def _exchange_exists(connection, exchange: str) -> bool:  # pragma: no cover
+    channel = connection.channel()
+    try:
+        channel.exchange_declare(exchange, passive=True)
+    except pika.exceptions.ChannelClosedByBroker:
+        return False
+
+    channel.close()
+    return True
+
+
+def _route_through_split_exchange(channel) -> None:
+    """Route incoming messages through the transfers split exchange.
+
+    Transfer messages are routed to the transfers exchange. All other
+    messages are not routable by the split exchange, and therefore
+    will be sent to the split exchange's alternate exchange (the
+    "ca.creditors" exchange). Transfer messages for shards that do not
+    have a separate queue for transfer messages are not routable by
+    the transfers exchange, and will be sent to its alternate exchange
+    (also the "ca.creditors" exchange).
+    """
+
+    from .extensions import CREDITORS_IN_EXCHANGE, CA_CREDITORS_EXCHANGE
+
+    logger = logging.getLogger(__name__)
+    channel.exchange_declare(
+        CA_TRANSFERS_SPLIT_EXCHANGE,
+        exchange_type="headers",
+        durable=True,
+        arguments={"alternate-exchange": CA_CREDITORS_EXCHANGE},
+    )
+    logger.info(
+        'Declared "%s" as alternative exchange for the "%s" exchange.',
+        CA_CREDITORS_EXCHANGE,
+        CA_TRANSFERS_SPLIT_EXCHANGE,
+    )
+    channel.exchange_declare(
+        CA_TRANSFERS_EXCHANGE,
+        exchange_type="topic",
+        durable=True,
+        arguments={"alternate-exchange": CA_CREDITORS_EXCHANGE},
+    )
+    logger.info(
+        'Declared "%s" as alternative exchange for the "%s" exchange.',
+        CA_CREDITORS_EXCHANGE,
+        CA_TRANSFERS_EXCHANGE,
+    )
+    for message_type in TRANSFER_MESSAGE_TYPES:
+        channel.exchange_bind(
+            source=CA_TRANSFERS_SPLIT_EXCHANGE,
+            destination=CA_TRANSFERS_EXCHANGE,
+            arguments={
+                "x-match": "all",
+                "message-type": message_type,
+            },
+        )
+    logger.info(
+        'Created a binding from "%s" to the "%s" exchange.',
+        CA_TRANSFERS_SPLIT_EXCHANGE,
+        CA_TRANSFERS_EXCHANGE,
+    )
     channel.exchange_bind(
+        source=CREDITORS_IN_EXCHANGE,
+        destination=CA_TRANSFERS_SPLIT_EXCHANGE,
+        arguments=_get_incoming_messages_binding_arguments(),
+    )
+    logger.info(
+        'Created a binding from "%s" to the "%s" exchange.',
+        CREDITORS_IN_EXCHANGE,
+        CA_TRANSFERS_SPLIT_EXCHANGE,
+    )
+
+    # NOTE: The direct binding must be removed only after the binding
+    # to the split exchange has been created. Otherwise, some messages
+    # could be lost.
+    channel.exchange_unbind(
         source=CREDITORS_IN_EXCHANGE,
         destination=CA_CREDITORS_EXCHANGE,
-        arguments={
-            "x-match": "all",
-            "ca-creditors": True,
-        },
+        arguments=_get_incoming_messages_binding_arguments(),
+    )
+    logger.info(
+        'Removed binding from "%s" to the "%s" exchange.',
+        CREDITORS_IN_EXCHANGE,
+        CA_CREDITORS_EXCHANGE,
+    )
+
+
+def _route_directly(channel, delete_split_exchange: bool = False) -> None:
+    """Route incoming messages directly to the "ca.creditors" exchange.
+
+    When `delete_split_exchange` is true, the transfers split exchange
+    (and its bindings) will be deleted after the direct binding has
+    been created. Note that for a short while, incoming messages may
+    be routed through both paths.
+    """
+
+    from .extensions import CREDITORS_IN_EXCHANGE, CA_CREDITORS_EXCHANGE
+
+    logger = logging.getLogger(__name__)
+    channel.exchange_bind(
+        source=CREDITORS_IN_EXCHANGE,
+        destination=CA_CREDITORS_EXCHANGE,
+        arguments=_get_incoming_messages_binding_arguments(),
     )
     logger.info(
         'Created a binding from "%s" to the "%s" exchange.',
         CREDITORS_IN_EXCHANGE,
         CA_CREDITORS_EXCHANGE,
     )
+    if delete_split_exchange:
+        channel.exchange_delete(CA_TRANSFERS_SPLIT_EXCHANGE)
+        logger.info('Deleted "%s" exchange.', CA_TRANSFERS_SPLIT_EXCHANGE)
+
+
+def _declare_queue(channel, queue_name: str) -> None:  # pragma: no cover
+    logger = logging.getLogger(__name__)
+    dead_letter_queue_name = queue_name + ".XQ"
 
     # declare a corresponding dead-letter queue
     channel.queue_declare(
@@ -168,30 +349,22 @@ def subscribe(url, queue, queue_routing_key):  # pragma: no cover
     )
     logger.info('Declared "%s" queue.', queue_name)
 
-    # bind the queue
+
+def _bind_queue(
+    channel, exchange: str, queue_name: str, routing_key: str
+) -> None:  # pragma: no cover
     channel.queue_bind(
-        exchange=CA_CREDITORS_EXCHANGE,
+        exchange=exchange,
         queue=queue_name,
         routing_key=routing_key,
     )
-    logger.info(
+    logging.getLogger(__name__).info(
         'Created a binding from "%s" to "%s" with routing key "%s".',
-        CA_CREDITORS_EXCHANGE,
+        exchange,
         queue_name,
         routing_key,
     )
 
-    # bind the queue to the loopback exchange
-    channel.queue_bind(
-        exchange=CA_LOOPBACK_EXCHANGE,
-        queue=queue_name,
-    )
-    logger.info(
-        'Created a binding from "%s" to "%s".',
-        CA_LOOPBACK_EXCHANGE,
-        queue_name,
-    )
-
 
 @swpt_creditors.command("unsubscribe")
 @with_appcontext
@@ -213,7 +386,15 @@ def subscribe(url, queue, queue_routing_key):  # pragma: no cover
     type=str,
     help="The RabbitMQ binding key for the queue.",
 )
-def unsubscribe(url, queue, queue_routing_key):  # pragma: no cover
+@click.option(
+    "-t",
+    "--transfers-queue",
+    type=str,
+    help="The name of the separate queue for transfer messages.",
+)
+def unsubscribe(
+    url, queue, queue_routing_key, transfers_queue
+):  # pragma: no cover
     """Unsubscribe a RabbitMQ queue from receiving incoming messages.
 
     If some of the available options are not specified directly, the
@@ -224,6 +405,16 @@ def unsubscribe(url, queue, queue_routing_key):  # pragma: no cover
     * PROTOCOL_BROKER_QUEUE (defalut "swpt_creditors")
 
     * PROTOCOL_BROKER_QUEUE_ROUTING_KEY (default "#")
+
+    * PROTOCOL_BROKER_TRANSFERS_QUEUE (default "", meaning no separate
+      queue for transfer messages)
+
+    When a separate queue for transfer messages is specified, it will
+    be unsubscribed too, and the incoming messages for all shards will
+    again be routed directly to the "ca.creditors" exchange (that is,
+    transfer messages will be delivered to the main queues). Shards
+    that still need a separate queue for transfer messages should be
+    subscribed again.
     """
 
     from .extensions import CA_CREDITORS_EXCHANGE
@@ -234,6 +425,10 @@ def unsubscribe(url, queue, queue_routing_key):  # pragma: no cover
         queue_routing_key
         or current_app.config["PROTOCOL_BROKER_QUEUE_ROUTING_KEY"]
     )
+    transfers_queue_name = (
+        transfers_queue
+        or current_app.config["PROTOCOL_BROKER_TRANSFERS_QUEUE"]
+    )
     broker_url = url or current_app.config["PROTOCOL_BROKER_URL"]
     connection = pika.BlockingConnection(pika.URLParameters(broker_url))
     channel = connection.channel()
@@ -262,6 +457,21 @@ def unsubscribe(url, queue, queue_routing_key):  # pragma: no cover
         queue_name,
     )
 
+    # unbind the transfers queue
+    if transfers_queue_name:
+        channel.queue_unbind(
+            exchange=CA_TRANSFERS_EXCHANGE,
+            queue=transfers_queue_name,
+            routing_key=routing_key,
+        )
+        logger.info(
+            'Removed binding from "%s" to "%s" with routing key "%s".',
+            CA_TRANSFERS_EXCHANGE,
+            transfers_queue_name,
+            routing_key,
+        )
+        _route_directly(channel, delete_split_exchange=True)
+
 
 @swpt_creditors.command("delete_queue")
 @with_appcontext
@@ -665,14 +875,47 @@ def scan_committed_transfers(days, quit_early):
     type=int,
     help="The prefetch window in terms of whole messages.",
 )
+@click.option(
+    "-b",
+    "--batch-size",
+    type=int,
+    help="The maximal number of messages processed in one DB transaction.",
+)
+@click.option(
+    "--batch-wait",
+    type=float,
+    help="The maximal number of milliseconds to wait for a batch to fill.",
+)
+@click.option(
+    "--dispatch-threads",
+    type=int,
+    help="The number of threads to which the accounts are distributed.",
+)
+@click.option(
+    "--target-utilization",
+    type=float,
+    help="Adjust the number of active threads, aiming at this utilization.",
+)
 @click.option(
     "--draining-mode",
     is_flag=True,
     help="Make periodic pauses to allow the queue to be deleted safely.",
 )
+@click.option(
+    "--asyncio",
+    "use_asyncio",
+    is_flag=True,
+    help="Process the messages concurrently, using asyncio.",
+)
+@click.option(
+    "--transfers",
+    is_flag=True,
+    help="Consume from the separate queue for transfer messages.",
+)
 def consume_messages(
     url, queue, processes, threads, prefetch_size, prefetch_count,
-    draining_mode
+    batch_size, batch_wait, dispatch_threads, target_utilization,
+    draining_mode, use_asyncio, transfers
 ):
     """Consume and process incoming Swaptacular Messaging Protocol
     messages.
@@ -692,10 +935,132 @@ def consume_messages(
 
     * PROTOCOL_BROKER_PREFETCH_SIZE (default 0, meaning unlimited)
 
+    * PROTOCOL_BROKER_BATCH_SIZE (default 1, meaning no batching)
+
+    * PROTOCOL_BROKER_BATCH_WAIT_MILLISECS (default 20)
+
+    * PROTOCOL_BROKER_STATS_PERIOD (default 0, meaning no statistics)
+
+    * PROTOCOL_BROKER_DISPATCH_THREADS (default 0, meaning no dispatching)
+
+    * PROTOCOL_BROKER_TARGET_UTILIZATION (default 0, meaning no tuning)
+
+    * PROTOCOL_BROKER_ASYNC_PREFETCH_COUNT (default 200)
+
+    * PROTOCOL_BROKER_ASYNC_DB_CONNECTIONS (default 10)
+
+    When the "--transfers" option is given, the messages will be
+    consumed from the separate queue for transfer messages (see the
+    "subscribe" command), and the values of the following environment
+    variables will be used instead:
+
+    * PROTOCOL_BROKER_TRANSFERS_QUEUE (must not be empty)
+
+    * PROTOCOL_BROKER_TRANSFERS_PROCESSES (default 1)
+
+    * PROTOCOL_BROKER_TRANSFERS_THREADS (default 1)
+
+    * PROTOCOL_BROKER_TRANSFERS_PREFETCH_COUNT (default 1)
+
+    When the batch size is bigger than 1, the messages processed in
+    parallel by the threads of one worker process will be collected
+    in batches, and each batch will be processed in a single database
+    transaction. Note that the batch size can not effectively exceed
+    the number of threads.
+
+    When the number of dispatch threads is bigger than zero, each
+    worker process will start that many additional threads, and will
+    always process the messages for a given account on the same
+    thread, chosen by the hash of the account's creditor ID and debtor
+    ID.
+
+    When the statistics period is bigger than zero, each worker
+    process will periodically log a line with per-message-type
+    counters and latency percentiles.
+
+    When the target utilization is between 0 and 1, each worker process
+    will automatically adjust the number of threads that are allowed
+    to process messages at the same time, according to the measured
+    message processing latency, and the saturation of the database
+    connection pool. In this case, the number of threads and the
+    prefetch count should be set to the biggest acceptable values.
+
+    When the "--asyncio" option is given, each worker process will
+    process up to PROTOCOL_BROKER_ASYNC_PREFETCH_COUNT messages
+    concurrently, calling the PG/PLSQL implementations of the most
+    frequent messages directly, using up to
+    PROTOCOL_BROKER_ASYNC_DB_CONNECTIONS database connections. The
+    remaining messages will be processed by the worker's threads. In
+    this mode, the prefetch count defaults to
+    PROTOCOL_BROKER_ASYNC_PREFETCH_COUNT, and the batching, dispatch,
+    and draining mode options are ignored. This mode requires the
+    "aio-pika" package to be installed.
     """
 
+    def _consume_messages_asyncio(
+        url, queue, threads, prefetch_count
+    ):  # pragma: no cover
+        """Consume messages in a subprocess, using asyncio."""
+
+        from swpt_creditors.async_consumer import AsyncSmpConsumer
+        from swpt_creditors import create_app
+
+        app = create_app()
+        config = app.config
+        consumer = AsyncSmpConsumer(
+            app,
+            url=url or config["PROTOCOL_BROKER_URL"],
+            queue=queue or config["PROTOCOL_BROKER_QUEUE"],
+            prefetch_count=(
+                prefetch_count
+                or config["PROTOCOL_BROKER_ASYNC_PREFETCH_COUNT"]
+            ),
+            threads=threads or config["PROTOCOL_BROKER_THREADS"],
+            db_connections=config["PROTOCOL_BROKER_ASYNC_DB_CONNECTIONS"],
+            stats_period=config["PROTOCOL_BROKER_STATS_PERIOD"],
+            fast_decoding=config["APP_FAST_MESSAGE_DECODING"],
+            skip_cache_size=config["APP_SKIP_CACHE_SIZE"],
+        )
+
+        pid = os.getpid()
+        logger = logging.getLogger(__name__)
+        logger.info("Worker with PID %i started processing messages.", pid)
+
+        with app.app_context():
+            consumer.run()
+
+        logger.info("Worker with PID %i stopped processing messages.", pid)
+
+    if transfers:
+        config = current_app.config
+        queue = queue or config["PROTOCOL_BROKER_TRANSFERS_QUEUE"]
+        if not queue:
+            raise click.UsageError(
+                "No separate queue for transfer messages is configured."
+            )
+        processes = processes or config["PROTOCOL_BROKER_TRANSFERS_PROCESSES"]
+        threads = threads or config["PROTOCOL_BROKER_TRANSFERS_THREADS"]
+        prefetch_count = (
+            prefetch_count
+            or config["PROTOCOL_BROKER_TRANSFERS_PREFETCH_COUNT"]
+        )
+
+    if use_asyncio:
+        spawn_worker_processes(
+            processes=(
+                processes or current_app.config["PROTOCOL_BROKER_PROCESSES"]
+            ),
+            target=_consume_messages_asyncio,
+            url=url,
+            queue=queue,
+            threads=threads,
+            prefetch_count=prefetch_count,
+        )
+        sys.exit(1)
+
     def _consume_messages(
-        url, queue, threads, prefetch_size, prefetch_count
+        url, queue, threads, prefetch_size, prefetch_count, batch_size,
+        batch_wait, dispatch_threads, target_utilization
     ):  # pragma: no cover
         """Consume messages in a subprocess."""
 
@@ -711,6 +1076,10 @@ def consume_messages(
             prefetch_size=prefetch_size,
             prefetch_count=prefetch_count,
             draining_mode=draining_mode,
+            batch_size=batch_size,
+            batch_wait=None if batch_wait is None else batch_wait / 1000.0,
+            dispatch_threads=dispatch_threads,
+            target_utilization=target_utilization,
         )
         for sig in HANDLED_SIGNALS:
             signal.signal(sig, consumer.stop)
@@ -735,10 +1104,196 @@ def consume_messages(
         threads=threads,
         prefetch_size=prefetch_size,
         prefetch_count=prefetch_count,
+        batch_size=batch_size,
+        batch_wait=batch_wait,
+        dispatch_threads=dispatch_threads,
+        target_utilization=target_utilization,
     )
     sys.exit(1)
 
 
+@swpt_creditors.command("record_messages")
+@with_appcontext
+@click.option("-u", "--url", type=str, help="The RabbitMQ connection URL.")
+@click.option(
+    "-q", "--queue", type=str, help="The name the queue to consume from."
+)
+@click.option(
+    "-n",
+    "--count",
+    type=int,
+    default=10000,
+    help="The number of messages to record (default 10000).",
+)
+@click.option(
+    "--synthetic",
+    is_flag=True,
+    help="Generate synthetic messages instead of consuming a queue.",
+)
+@click.option(
+    "--accounts",
+    type=int,
+    default=1000,
+    help="The number of accounts for synthetic messages (default 1000).",
+)
+@click.argument("filename")
+def record_messages(url, queue, count, synthetic, accounts, filename):
+    """Record incoming Swaptacular Messaging Protocol messages to a
+    file.
+
+    Either "--queue" or "--synthetic" must be specified. When a queue
+    is specified, the messages will be consumed (and removed) from
+    it. Therefore, a dedicated queue, bound to the same exchange as
+    the main queue, should be used. The command stops when the
+    specified number of messages has been recorded, or when there
+    are no more messages in the queue.
+
+    Synthetic messages are AccountUpdate heartbeats for randomly
+    chosen accounts from the database.
+
+    If the RabbitMQ connection URL is not specified directly, the
+    value of the PROTOCOL_BROKER_URL environment variable will be
+    used.
+    """
+
+    from swpt_creditors.message_capture import (
+        write_messages,
+        generate_heartbeats,
+    )
+
+    if synthetic:
+        messages = generate_heartbeats(count, accounts)
+    elif queue:
+        messages = _consume_queue(
+            url or current_app.config["PROTOCOL_BROKER_URL"], queue, count
+        )
+    else:
+        raise click.UsageError('Either "--queue" or "--synthetic" is needed.')
+
+    n = write_messages(filename, messages)
+    click.echo(f"{n} messages have been recorded.")
+
+
+def _consume_queue(url, queue, count):  # pragma: no cover
+    from swpt_creditors.message_capture import CapturedMessage
+
+    connection = pika.BlockingConnection(pika.URLParameters(url))
+    channel = connection.channel()
+    channel.basic_qos(prefetch_count=100)
+    try:
+        n = 0
+        for method, properties, body in channel.consume(
+                queue, inactivity_timeout=5.0
+        ):
+            if method is None:
+                break
+
+            yield CapturedMessage.from_properties(properties, body)
+            channel.basic_ack(method.delivery_tag)
+            n += 1
+            if n >= count:
+                break
+    finally:
+        channel.cancel()
+        connection.close()
+
+
+@swpt_creditors.command("replay_messages")
+@with_appcontext
+@click.option(
+    "-t",
+    "--threads",
+    type=int,
+    default=1,
+    help="The number of parallel threads (default 1).",
+)
+@click.argument("filename")
+def replay_messages(threads, filename):
+    """Process the messages recorded in a file, and report the
+    throughput and the latencies for each message type.
+
+    The messages are processed exactly as the "consume_messages"
+    command would process them (see the PROTOCOL_BROKER_* environment
+    variables), but without a message broker. Note that the messages
+    will change the content of the database.
+    """
+
+    from swpt_creditors.actors import SmpConsumer
+    from swpt_creditors.message_capture import (
+        read_messages,
+        replay_messages as replay,
+    )
+
+    report = replay(
+        current_app._get_current_object(),
+        SmpConsumer(),
+        read_messages(filename),
+        threads=threads,
+    )
+    click.echo(json.dumps(report.as_dict(), indent=2))
+
+
+@swpt_creditors.command("outbox_stats")
+@with_appcontext
+@click.option(
+    "-p",
+    "--period",
+    type=float,
+    default=0.0,
+    help=(
+        "Measure the insertion and flushing rates over FLOAT seconds"
+        " (default 0, do not measure rates)."
+    ),
+)
+@click.argument("message_types", nargs=-1)
+def outbox_stats(period, message_types):
+    """Report the estimated number of pending messages, the maximum
+    time a pending message has waited, and the flushing throughput,
+    for each type of outgoing messages.
+
+    If a list of MESSAGE_TYPES is given, reports only these types of
+    messages. The "backlog" estimate, and the "inserted" and "flushed"
+    cumulative counters are maintained by PostgreSQL's statistics
+    collector, and include the messages flushed by all
+    "flush_messages" processes.
+    """
+
+    from swpt_creditors.flush_utils import get_outbox_stats
+
+    models = get_models_to_flush(
+        current_app.extensions["signalbus"], message_types
+    )
+    stats = get_outbox_stats(models, period)
+    click.echo(json.dumps(stats, indent=2, sort_keys=True))
+
+
+@swpt_creditors.command("notify_triggers")
+@with_appcontext
+@click.option(
+    "--enable/--disable",
+    default=True,
+    help="Enable (the default), or disable the triggers.",
+)
+@click.argument("message_types", nargs=-1)
+def notify_triggers(enable, message_types):
+    """Enable or disable the database triggers that send notifications
+    about newly recorded messages.
+
+    If a list of MESSAGE_TYPES is given, enables or disables only the
+    triggers for these types of messages. The triggers must be enabled
+    for the "flush_messages --listen" command to work. Note that when
+    the triggers are enabled, the commits of all transactions that
+    record messages will be slower.
+    """
+
+    from swpt_creditors.flush_utils import set_notify_triggers
+
+    models = get_models_to_flush(
+        current_app.extensions["signalbus"], message_types
+    )
+    set_notify_triggers([model.__table__.name for model in models], enable)
+
+
 @swpt_creditors.command("flush_messages")
 @with_appcontext
 @click.option(
@@ -761,6 +1316,37 @@ def consume_messages(
         " variable will be used, defaulting to 2 seconds if empty."
     ),
 )
+@click.option(
+    "-l",
+    "--listen",
+    is_flag=True,
+    default=False,
+    help=(
+        "Flush immediately after new messages have been recorded in the"
+        " database, and poll every FLOAT seconds only as a safety net."
+        " This is enabled also when the FLUSH_LISTEN environment"
+        " variable is true."
+    ),
+)
+@click.option(
+    "--worker-count",
+    type=int,
+    help=(
+        "The total number of flushing containers (or hosts) among which"
+        " the messages will be partitioned. If not specified, the value"
+        " of the FLUSH_WORKER_COUNT environment variable will be used,"
+        " defaulting to 0 (no partitioning) if empty."
+    ),
+)
+@click.option(
+    "--worker-index",
+    type=int,
+    help=(
+        "The index of this container (or host), from 0 to worker count"
+        " minus 1. If not specified, the value of the FLUSH_WORKER_INDEX"
+        " environment variable will be used, defaulting to 0 if empty."
+    ),
+)
 @click.option(
     "--quit-early",
     is_flag=True,
@@ -772,6 +1358,9 @@ def flush_messages(
     message_types: list[str],
     processes: int,
     wait: float,
+    listen: bool,
+    worker_count: Optional[int],
+    worker_index: Optional[int],
     quit_early: bool,
 ) -> None:
     """Send pending messages to the message broker.
@@ -779,8 +1368,48 @@ def flush_messages(
     If a list of MESSAGE_TYPES is given, flushes only these types of
     messages. If no MESSAGE_TYPES are specified, flushes all messages.
 
+    Each type of messages is flushed every FLOAT seconds, unless a
+    different period has been configured for it (for example, with
+    the APP_FLUSH_FINALIZE_TRANSFERS_PERIOD environment variable). The
+    number of messages sent in one burst is configured in a similar
+    way (for example, APP_FLUSH_FINALIZE_TRANSFERS_BURST_COUNT). When
+    APP_FLUSH_STATS_PERIOD is bigger than zero, every that many
+    seconds, the number of flushed messages, and the maximal time a
+    message has waited to be flushed, are logged for each type.
+
+    When listening is enabled, the flushing processes receive
+    PostgreSQL notifications about newly inserted messages, and flush
+    them without waiting for the next period. The notifications that
+    arrive within APP_FLUSH_DEBOUNCE_MILLISECS milliseconds are
+    handled by a single flush. Note that the database triggers that
+    send the notifications are disabled by default, and must be
+    enabled with the "notify_triggers" command. Sending notifications
+    slows down the commits of all transactions that record messages.
+
+    When the worker count is bigger than zero, the pending messages
+    will be partitioned according to their creditor IDs, so that each
+    flushing process sends the messages from its own partition only.
+    The total number of partitions equals the worker count multiplied
+    by the number of processes, which must be the same for all
+    containers. For example, when the worker count is 2, and the
+    number of processes is 3, the container with worker index 0 will
+    flush partitions 0, 1, and 2, and the container with worker index
+    1 will flush partitions 3, 4, and 5.
+
     """
     logger = logging.getLogger(__name__)
+    config = current_app.config
+    if processes is None:
+        processes = config["FLUSH_PROCESSES"]
+    if worker_count is None:
+        worker_count = config["FLUSH_WORKER_COUNT"]
+    if worker_index is None:
+        worker_index = config["FLUSH_WORKER_INDEX"]
+    if worker_count > 0 and not 0 <= worker_index < worker_count:
+        raise click.UsageError(
+            "The worker index must be between 0 and worker count - 1."
+        )
+
     models_to_flush = get_models_to_flush(
         current_app.extensions["signalbus"], message_types
     )
@@ -788,14 +1417,30 @@ def flush_messages(
         "Started flushing %s.", ", ".join(m.__name__ for m in models_to_flush)
     )
 
+    partitions = worker_count * processes
+
     def _flush(
         models_to_flush: list[type[Model]],
         wait: Optional[float],
+        listen: bool,
+        partition: int = 0,
     ) -> None:  # pragma: no cover
         from swpt_creditors import create_app
+        from swpt_creditors.flush_utils import (
+            SignalListener,
+            FlushStats,
+            flush_signals,
+        )
 
         app = create_app()
         stopped = False
+        if partitions > 0:
+            logger.info(
+                "Worker with PID %i started flushing partition %i of %i.",
+                os.getpid(),
+                partition,
+                partitions,
+            )
 
         def stop(signum: Any = None, frame: Any = None) -> None:
             nonlocal stopped
@@ -807,12 +1452,56 @@ def flush_messages(
 
         with app.app_context():
             signalbus: SignalBus = current_app.extensions["signalbus"]
+            config = current_app.config
+            stats = FlushStats(config["APP_FLUSH_STATS_PERIOD"])
+            listener = (
+                SignalListener(
+                    db.engine, [m.__table__.name for m in models_to_flush]
+                )
+                if listen
+                else None
+            )
+            debounce = config["APP_FLUSH_DEBOUNCE_MILLISECS"] / 1000.0
+            flush_periods = {
+                model: getattr(model, "signalbus_flush_period", 0.0) or wait
+                for model in models_to_flush
+            }
+            next_flush_at = {model: 0.0 for model in models_to_flush}
+
+            # NOTE: When the messages are not partitioned, all types of
+            # messages are flushed with the same period, and no flush
+            # statistics are collected, the messages are flushed by
+            # the signal bus, exactly as before.
+            use_signalbus = (
+                partitions == 0
+                and stats.period == 0.0
+                and all(p == wait for p in flush_periods.values())
+            )
+
+            def flush(models: list[type[Model]]) -> int:
+                if use_signalbus:
+                    return signalbus.flushmany(models)
+
+                return sum(
+                    flush_signals(model, partition, max(partitions, 1), stats)
+                    for model in models
+                )
+
+            notified_tables: set[str] = set()
             time.sleep(wait * random.random())
 
             while not stopped:
-                started_at = time.time()
+                started_at = time.monotonic()
+                models = [
+                    model
+                    for model in models_to_flush
+                    if (
+                        next_flush_at[model] <= started_at
+                        or model.__table__.name in notified_tables
+                    )
+                ]
                 try:
-                    count = signalbus.flushmany(models_to_flush)
+                    count = flush(models)
                 except Exception:
                     logger.exception(
                         "Caught error while sending pending signals."
@@ -828,18 +1517,84 @@ def flush_messages(
 
                 if quit_early:
                     break
-                time.sleep(max(0.0, wait + started_at - time.time()))
 
-    spawn_worker_processes(
-        processes=(
-            processes
-            if processes is not None
-            else current_app.config["FLUSH_PROCESSES"]
-        ),
-        target=_flush,
+                for model in models:
+                    next_flush_at[model] = started_at + flush_periods[model]
+
+                timeout = max(
+                    0.0, min(next_flush_at.values()) - time.monotonic()
+                )
+                if listener is None:
+                    time.sleep(timeout)
+                else:
+                    notified_tables = listener.wait(timeout, debounce)
+
+            if listener is not None:
+                listener.close()
+
+    flush_kwargs = dict(
         models_to_flush=models_to_flush,
-        wait=(
-            wait if wait is not None else current_app.config["FLUSH_PERIOD"]
-        ),
+        wait=wait if wait is not None else config["FLUSH_PERIOD"],
+        listen=listen or config["FLUSH_LISTEN"],
     )
+    if partitions > 0:
+        _spawn_partition_workers(
+            partitions=[
+                worker_index * processes + i for i in range(processes)
+            ],
+            target=_flush,
+            **flush_kwargs,
+        )
+    else:
+        spawn_worker_processes(
+            processes=processes, target=_flush, **flush_kwargs
+        )
     sys.exit(1)
+
+
+def _spawn_partition_workers(
+    partitions: list[int], target, **kwargs
+) -> None:  # pragma: no cover
+    """Spawn a worker process for each of the given partitions.
+
+    In each worker process, the `target` function is called with the
+    passed keyword arguments (`kwargs`), and the number of the
+    partition (`partition`). Like `spawn_worker_processes`, this
+    function will not return until at least one of the worker
+    processes has stopped, and then the rest of the workers will be
+    terminated as well.
+    """
+
+    logger = logging.getLogger(__name__)
+    workers = [
+        multiprocessing.Process(
+            target=target, kwargs={**kwargs, "partition": partition}
+        )
+        for partition in partitions
+    ]
+
+    def terminate_workers(signum: Any = None, frame: Any = None) -> None:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+    # NOTE: The signals must be blocked before the workers are
+    # started, because the workers inherit the blocked signals, and
+    # unblock them only after they have configured their handlers.
+    try_block_signals()
+    for worker, partition in zip(workers, partitions):
+        worker.start()
+        logger.info(
+            "Spawned worker with PID %i for partition %i.",
+            worker.pid,
+            partition,
+        )
+
+    for sig in HANDLED_SIGNALS:
+        signal.signal(sig, terminate_workers)
+    try_unblock_signals()
+
+    multiprocessing.connection.wait([w.sentinel for w in workers])
+    terminate_workers()
+    for worker in workers:
+        worker.join()
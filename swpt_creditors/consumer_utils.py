@@ -0,0 +1,459 @@
+"""Helpers used by the SMP messages consumer (see `actors.SmpConsumer`)."""
+
+import os
+import json
+import time
+import logging
+import threading
+import queue
+from concurrent.futures import Future
+from bisect import bisect_left
+from collections import defaultdict, OrderedDict
+from typing import Callable, List, Tuple, Optional, Dict, Hashable, Any
+from .extensions import db
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _Batch:
+    def __init__(self):
+        self.items: List[Tuple[Callable[..., None], dict]] = []
+        self.is_closed = threading.Event()
+        self.is_done = threading.Event()
+        self.succeeded = False
+
+
+class ActorBatcher:
+    """Executes actors in batches, one database transaction per batch.
+
+    Each consumer thread calls the `run` method, passing an actor and
+    its arguments. The first thread that does not find an open batch
+    becomes the batch leader: it waits until the batch gets full (or
+    `max_wait` seconds pass), and then executes all the actors from
+    the batch in a single database transaction. The other threads
+    just wait for the leader to finish. If the batch transaction
+    fails, each thread replays its own actor in a separate
+    transaction.
+
+    Note that the consumer thread calling `run` is blocked until its
+    actor gets executed, and therefore, the size of the batches will
+    never exceed the number of consumer threads.
+    """
+
+    def __init__(self, max_size: int, max_wait: float):
+        assert max_size > 0
+        assert max_wait >= 0.0
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._open_batch: Optional[_Batch] = None
+
+    def run(self, actor: Callable[..., None], kwargs: dict) -> None:
+        with self._lock:
+            batch = self._open_batch
+            is_leader = batch is None
+            if is_leader:
+                batch = self._open_batch = _Batch()
+
+            batch.items.append((actor, kwargs))
+            if len(batch.items) >= self.max_size:
+                self._close_batch(batch)
+
+        if is_leader:
+            batch.is_closed.wait(self.max_wait)
+            with self._lock:
+                self._close_batch(batch)
+
+            batch.succeeded = _execute_batch(batch.items)
+            batch.is_done.set()
+        else:
+            batch.is_done.wait()
+
+        if not batch.succeeded:
+            actor(**kwargs)
+
+    def _close_batch(self, batch: _Batch) -> None:
+        if self._open_batch is batch:
+            self._open_batch = None
+            batch.is_closed.set()
+
+
+def _execute_batch(items: List[Tuple[Callable[..., None], dict]]) -> bool:
+    try:
+        _run_actors_atomically(items)
+    except Exception:
+        _LOGGER.warning(
+            "Failed to process a batch of %i messages. The messages will be"
+            " processed one by one.",
+            len(items),
+            exc_info=True,
+        )
+        return False
+    finally:
+        db.session.close()
+
+    return True
+
+
+@db.atomic
+def _run_actors_atomically(
+    items: List[Tuple[Callable[..., None], dict]]
+) -> None:
+    # NOTE: All procedures called by the actors are atomic. When they
+    # are called inside an already started transaction, they do not
+    # commit, and therefore here all the actors will be executed in
+    # a single database transaction.
+    for actor, kwargs in items:
+        actor(**kwargs)
+
+
+class LatencyHistogram:
+    """A histogram of durations, measured in seconds."""
+
+    BUCKETS = (
+        0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+        0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    )
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        """Return an upper bound for the `q`-th percentile (0 < q <= 100).
+
+        The returned value is the upper bound of the bucket that
+        contains the percentile, but never more than the maximal
+        observed value.
+        """
+
+        if self.count == 0:
+            return 0.0
+
+        rank = q / 100.0 * self.count
+        accumulated = 0
+        for i, bucket_count in enumerate(self.counts):
+            accumulated += bucket_count
+            if accumulated >= rank:
+                break
+
+        upper_bound = self.BUCKETS[i] if i < len(self.BUCKETS) else self.max
+        return min(upper_bound, self.max)
+
+    def summary(self) -> dict:
+        def ms(seconds):
+            return round(seconds * 1000.0, 3)
+
+        return {
+            "count": self.count,
+            "avg_ms": ms(self.sum / self.count) if self.count else 0.0,
+            "p50_ms": ms(self.percentile(50)),
+            "p90_ms": ms(self.percentile(90)),
+            "p99_ms": ms(self.percentile(99)),
+            "max_ms": ms(self.max),
+        }
+
+
+class _MessageTypeStats:
+    def __init__(self):
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.histograms: Dict[str, LatencyHistogram] = defaultdict(
+            LatencyHistogram
+        )
+
+    def summary(self) -> dict:
+        summary = dict(self.counters)
+        for stage, histogram in self.histograms.items():
+            summary[stage] = histogram.summary()
+        return summary
+
+
+class ConsumerStats:
+    """Per-message-type counters and latency histograms.
+
+    The collected statistics are written to the log as a single JSON
+    line every `period` seconds, and then reset. The log line is
+    written by the first thread which records something after the
+    period has expired, so nothing gets logged while the consumer is
+    idle. When `period` is zero, nothing will be logged.
+    """
+
+    def __init__(self, period: float):
+        assert period >= 0.0
+        self.period = period
+        self._lock = threading.Lock()
+        self._types: Dict[str, _MessageTypeStats] = defaultdict(
+            _MessageTypeStats
+        )
+        self._started_at = time.monotonic()
+
+    def increment(self, message_type: str, counter: str) -> None:
+        with self._lock:
+            self._types[message_type].counters[counter] += 1
+            report = self._get_due_report()
+
+        if report:
+            self._log_report(report)
+
+    def observe(self, message_type: str, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._types[message_type].histograms[stage].observe(seconds)
+            report = self._get_due_report()
+
+        if report:
+            self._log_report(report)
+
+    def snapshot(self, reset: bool = False) -> dict:
+        with self._lock:
+            return self._snapshot(reset)
+
+    def _snapshot(self, reset: bool) -> dict:
+        now = time.monotonic()
+        snapshot = {
+            "pid": os.getpid(),
+            "seconds": round(now - self._started_at, 3),
+            "types": {
+                message_type: stats.summary()
+                for message_type, stats in self._types.items()
+            },
+        }
+        if reset:
+            self._types.clear()
+            self._started_at = now
+
+        return snapshot
+
+    def _get_due_report(self) -> Optional[dict]:
+        if (
+                self.period > 0.0
+                and time.monotonic() - self._started_at >= self.period
+        ):
+            return self._snapshot(reset=True)
+
+        return None
+
+    def _log_report(self, report: dict) -> None:
+        _LOGGER.info("Consumer stats: %s", json.dumps(report, sort_keys=True))
+
+
+class KeyedDispatcher:
+    """Executes functions on a fixed set of worker threads.
+
+    The worker thread is chosen by the hash of a key, so that all the
+    functions called with the same key are executed on the same
+    thread, one after another, in the order in which they have been
+    passed to the `run` method. The thread that calls `run` is blocked
+    until the function is executed. The worker threads run with a
+    pushed application context for `app`.
+    """
+
+    def __init__(self, threads: int, app):
+        assert threads > 0
+        self._queues = [queue.SimpleQueue() for _ in range(threads)]
+        for q in self._queues:
+            worker = threading.Thread(target=self._work, args=(app, q))
+            worker.daemon = True
+            worker.start()
+
+    def run(self, key: Hashable, func: Callable[..., Any], *args, **kwargs):
+        future = Future()
+        q = self._queues[hash(key) % len(self._queues)]
+        q.put((future, func, args, kwargs))
+        return future.result()
+
+    @staticmethod
+    def _work(app, q: queue.SimpleQueue) -> None:
+        with app.app_context():
+            while True:
+                future, func, args, kwargs = q.get()
+                if future.set_running_or_notify_cancel():
+                    try:
+                        result = func(*args, **kwargs)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+
+
+class SupersededFilter:
+    """Detects in-flight messages that have been superseded.
+
+    Each message should be registered (calling the `register` method)
+    with a key, and an order (any comparable object). Once the
+    message has been processed, it should be released (calling the
+    `release` method). A registered message is superseded, when
+    another message with the same key, but with a bigger order, has
+    been registered before the first message was released.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # For each key, contains the biggest registered order, and the
+        # number of the registered (not yet released) messages.
+        self._entries: Dict[Hashable, list] = {}
+
+    def register(self, key: Hashable, order: Any) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = [order, 1]
+            else:
+                if entry[0] < order:
+                    entry[0] = order
+                entry[1] += 1
+
+    def is_superseded(self, key: Hashable, order: Any) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and order < entry[0]
+
+    def release(self, key: Hashable) -> None:
+        with self._lock:
+            entry = self._entries[key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._entries[key]
+
+
+class SkipCache:
+    """A bounded LRU set of keys of recently applied messages.
+
+    Once a message has been successfully processed, its key should be
+    added to the cache (calling the `add` method). Redelivered
+    messages, whose keys are found in the cache, can be acknowledged
+    without being processed again. When the cache is full, the least
+    recently used key is evicted.
+    """
+
+    def __init__(self, max_size: int):
+        assert max_size > 0
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._keys: OrderedDict = OrderedDict()
+
+    def add(self, key: Hashable) -> None:
+        with self._lock:
+            keys = self._keys
+            keys[key] = None
+            keys.move_to_end(key)
+            if len(keys) > self.max_size:
+                keys.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            keys = self._keys
+            if key in keys:
+                keys.move_to_end(key)
+                return True
+
+            return False
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._keys)
+
+
+class AdaptiveConcurrencyLimiter:
+    """Adaptively limits the number of concurrently executed functions.
+
+    Each consumer thread calls the `run` method, and will be blocked
+    while `limit` other functions are being executed. Once every
+    `period` seconds, the limit is adjusted according to the measured
+    execution latency: The minimal observed average latency is taken
+    as the latency of an idle database. When the average latency
+    exceeds `1 / (1 - target_utilization)` times the idle latency
+    (which is what the queueing theory predicts for a server at
+    `target_utilization`), or when `is_saturated()` returns true, the
+    limit is decreased multiplicatively. Otherwise, if the limit has
+    been reached during the last period, it is increased by one. The
+    limit never exceeds `max_limit`, and is never less than 1.
+    """
+
+    DECREASE_FACTOR = 0.75
+
+    # The minimal observed latency slowly "forgets" old measurements,
+    # so that the limiter can adapt to a permanent change of the load.
+    MIN_LATENCY_DRIFT = 0.01
+
+    def __init__(
+        self,
+        max_limit: int,
+        target_utilization: float,
+        period: float = 1.0,
+        is_saturated: Callable[[], bool] = None,
+    ):
+        assert max_limit > 0
+        assert 0.0 < target_utilization < 1.0
+        assert period > 0.0
+        self.max_limit = max_limit
+        self.max_latency_ratio = 1.0 / (1.0 - target_utilization)
+        self.period = period
+        self.limit = max_limit
+        self._is_saturated = is_saturated
+        self._condition = threading.Condition()
+        self._active = 0
+        self._min_latency: Optional[float] = None
+        self._start_window(time.monotonic())
+
+    def run(self, func: Callable[..., Any], *args, **kwargs):
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+            if self._active > self._window_peak:
+                self._window_peak = self._active
+
+        started_at = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            now = time.monotonic()
+            with self._condition:
+                self._active -= 1
+                self._window_count += 1
+                self._window_latency += now - started_at
+                if now - self._window_started_at >= self.period:
+                    self._adjust_limit()
+                    self._start_window(now)
+                self._condition.notify_all()
+
+    def _start_window(self, now: float) -> None:
+        self._window_started_at = now
+        self._window_count = 0
+        self._window_latency = 0.0
+        self._window_peak = self._active
+
+    def _adjust_limit(self) -> None:
+        avg_latency = self._window_latency / self._window_count
+        min_latency = self._min_latency
+        if min_latency is None or avg_latency < min_latency:
+            min_latency = avg_latency
+        else:
+            min_latency *= 1.0 + self.MIN_LATENCY_DRIFT
+        self._min_latency = min_latency
+
+        old_limit = self.limit
+        if (
+                avg_latency > min_latency * self.max_latency_ratio
+                or self._is_saturated is not None and self._is_saturated()
+        ):
+            self.limit = max(1, int(old_limit * self.DECREASE_FACTOR))
+        elif self._window_peak >= old_limit:
+            self.limit = min(self.max_limit, old_limit + 1)
+
+        if self.limit != old_limit:
+            _LOGGER.debug(
+                "Changed the concurrency limit from %i to %i.",
+                old_limit,
+                self.limit,
+            )
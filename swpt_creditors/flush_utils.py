@@ -0,0 +1,368 @@
+"""Helpers used by the `flush_messages` command."""
+
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from select import select as select_io
+from typing import Iterable, Optional, Set, Dict
+import psycopg
+from sqlalchemy import select, func, text
+from sqlalchemy.engine import Engine
+from flask_sqlalchemy.model import Model
+from .extensions import db
+
+SIGNALS_CHANNEL = "swpt_creditors_signals"
+
+GET_DISABLED_NOTIFY_TRIGGERS = (
+    "SELECT c.relname FROM pg_trigger t JOIN pg_class c ON c.oid = t.tgrelid "
+    "WHERE c.relnamespace = current_schema()::text::regnamespace "
+    "AND c.relname = ANY(%s) AND t.tgname = c.relname || '_notify' "
+    "AND t.tgenabled = 'D'"
+)
+GET_TABLE_COUNTERS = text(
+    "SELECT relname, n_tup_ins, n_tup_del, n_live_tup "
+    "FROM pg_stat_user_tables "
+    "WHERE schemaname = current_schema() AND relname = ANY(:tables)"
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class SignalListener:
+    """Waits for notifications about newly inserted signals.
+
+    When a row is inserted in one of the signal tables, the database
+    sends a notification on the "swpt_creditors_signals" channel. The
+    payload of the notification is the name of the table. Only the
+    notifications for `tables` are taken into account.
+
+    The listener uses a dedicated database connection, which is
+    opened lazily. If the connection gets broken, the error is logged,
+    and the connection will be re-opened by the next call to `wait`.
+
+    The database triggers that send the notifications are disabled by
+    default, because at commit time, PostgreSQL serializes all
+    transactions that have sent notifications, which is a significant
+    cost for the transactions that insert signals. The listener does
+    not change the triggers (see `set_notify_triggers`). Instead, when
+    the connection is opened, a warning is logged for each table in
+    `tables` whose trigger is disabled.
+    """
+
+    def __init__(self, engine: Engine, tables: Iterable[str]):
+        self.engine = engine
+        self.tables = frozenset(tables)
+        self._connection: Optional[psycopg.Connection] = None
+        self._notified: Set[str] = set()
+
+    def wait(self, timeout: float, debounce: float = 0.0) -> Set[str]:
+        """Wait for a notification for up to `timeout` seconds.
+
+        Returns the names of the tables for which notifications have
+        been received. In this case, before returning, the listener
+        sleeps `debounce` more seconds, so that more signals can be
+        flushed at once. Returns an empty set if the timeout has
+        expired without a notification.
+        """
+
+        deadline = time.monotonic() + timeout
+        try:
+            notified = self._wait(deadline)
+        except psycopg.Error:
+            _LOGGER.exception("Caught error while listening for signals.")
+            self.close()
+            time.sleep(max(0.0, deadline - time.monotonic()))
+            return set()
+
+        if notified and debounce > 0.0:
+            time.sleep(debounce)
+
+        return notified
+
+    def close(self) -> None:
+        connection = self._connection
+        self._connection = None
+        if connection is not None:
+            try:
+                connection.close()
+            except psycopg.Error:  # pragma: no cover
+                pass
+
+    def _wait(self, deadline: float) -> Set[str]:
+        connection = self._connection
+        if connection is None:
+            connection = self._connection = self._connect()
+
+            # NOTE: Signals inserted before the LISTEN command has
+            # been executed could have been missed.
+            return set(self.tables)
+
+        self._notified = set()
+        while True:
+            # Receive the pending notifications (if any).
+            connection.execute("SELECT 1")
+            if self._notified:
+                return self._notified
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0.0:
+                return set()
+
+            select_io([connection.fileno()], [], [], remaining)
+
+    def _connect(self) -> psycopg.Connection:
+        url = self.engine.url.set(drivername="postgresql")
+        connection = psycopg.connect(
+            url.render_as_string(hide_password=False), autocommit=True
+        )
+        connection.add_notify_handler(self._on_notify)
+        connection.execute(f"LISTEN {SIGNALS_CHANNEL}")
+        self._check_triggers(connection)
+        return connection
+
+    def _check_triggers(self, connection: psycopg.Connection) -> None:
+        disabled_tables = connection.execute(
+            GET_DISABLED_NOTIFY_TRIGGERS, (list(self.tables),)
+        ).fetchall()
+        for (table,) in disabled_tables:
+            _LOGGER.warning(
+                'The "%s_notify" trigger is disabled, and new signals will'
+                ' not be flushed immediately. To enable it, run the'
+                ' "notify_triggers" command.',
+                table,
+            )
+
+    def _on_notify(self, notify: psycopg.Notify) -> None:
+        if notify.payload in self.tables:
+            self._notified.add(notify.payload)
+
+
+class _TableStats:
+    def __init__(self):
+        self.flushed = 0
+        self.bursts = 0
+        self.max_age = 0.0
+
+    def summary(self) -> dict:
+        return {
+            "flushed": self.flushed,
+            "bursts": self.bursts,
+            "max_age": round(self.max_age, 3),
+        }
+
+
+class FlushStats:
+    """Per-table counters of the flushed signals.
+
+    For each signal table, counts the flushed signals and bursts, and
+    tracks the outbox age: the maximal time (in seconds) that a
+    flushed signal has waited in the table. The collected statistics
+    are written to the log as a single JSON line every `period`
+    seconds, and then reset. When `period` is zero, nothing will be
+    logged.
+    """
+
+    def __init__(self, period: float):
+        assert period >= 0.0
+        self.period = period
+        self._lock = threading.Lock()
+        self._tables: Dict[str, _TableStats] = {}
+        self._started_at = time.monotonic()
+
+    def record(self, table: str, count: int, max_age: float) -> None:
+        with self._lock:
+            stats = self._tables.get(table)
+            if stats is None:
+                stats = self._tables[table] = _TableStats()
+            stats.flushed += count
+            stats.bursts += 1
+            stats.max_age = max(stats.max_age, max_age)
+            report = self._get_due_report()
+
+        if report:
+            self._log_report(report)
+
+    def snapshot(self, reset: bool = False) -> dict:
+        with self._lock:
+            return self._snapshot(reset)
+
+    def _snapshot(self, reset: bool) -> dict:
+        now = time.monotonic()
+        snapshot = {
+            "pid": os.getpid(),
+            "seconds": round(now - self._started_at, 3),
+            "tables": {
+                table: stats.summary()
+                for table, stats in self._tables.items()
+            },
+        }
+        if reset:
+            self._tables.clear()
+            self._started_at = now
+
+        return snapshot
+
+    def _get_due_report(self) -> Optional[dict]:
+        if (
+                self.period > 0.0
+                and time.monotonic() - self._started_at >= self.period
+        ):
+            return self._snapshot(reset=True)
+
+        return None
+
+    def _log_report(self, report: dict) -> None:
+        _LOGGER.info("Flush stats: %s", json.dumps(report, sort_keys=True))
+
+
+def flush_signals(
+    model: type[Model],
+    partition: int = 0,
+    partitions: int = 1,
+    stats: Optional[FlushStats] = None,
+) -> int:
+    """Send and delete the pending signals from one partition.
+
+    The signals are sent in bursts of up to `model.signalbus_burst_count`
+    signals. The signals are divided into `partitions` disjoint
+    partitions, according to the remainder of the division of their
+    `creditor_id` by `partitions`. Only the signals from the partition
+    with number `partition` (0 <= partition < partitions) will be sent.
+    Returns the number of sent signals.
+
+    Note that the partition condition can not use an index, and
+    therefore the signals from the other partitions are read and
+    skipped. This is acceptable only because the signal tables are
+    normally small.
+    """
+
+    assert 0 <= partition < partitions
+    burst_count = int(model.signalbus_burst_count)
+    query = (
+        select(model)
+        .limit(burst_count)
+        .with_for_update(skip_locked=True)
+    )
+    if partitions > 1:
+        creditor_id = model.creditor_id
+        query = query.where(
+            (creditor_id % partitions + partitions) % partitions == partition
+        )
+    count = 0
+
+    while True:
+        signals = db.session.execute(query).scalars().all()
+        if signals:
+            oldest_inserted_at = min(s.inserted_at for s in signals)
+            model.send_signalbus_messages(signals)
+            for signal in signals:
+                db.session.delete(signal)
+            db.session.commit()
+            count += len(signals)
+            if stats is not None:
+                current_ts = datetime.now(tz=timezone.utc)
+                stats.record(
+                    model.__table__.name,
+                    len(signals),
+                    (current_ts - oldest_inserted_at).total_seconds(),
+                )
+        else:
+            db.session.rollback()
+
+        if len(signals) < burst_count:
+            return count
+
+
+def set_notify_triggers(tables: Iterable[str], enabled: bool) -> None:
+    """Enable or disable the triggers that send notifications about
+    newly inserted signals, for the given signal tables.
+
+    This requires the database user to own the tables. Note that
+    altering a trigger takes a lock on the table, which blocks the
+    transactions that insert signals in it, until the trigger has been
+    altered.
+    """
+
+    action = "ENABLE" if enabled else "DISABLE"
+    for table in tables:
+        db.session.execute(
+            text(f"ALTER TABLE {table} {action} TRIGGER {table}_notify")
+        )
+        db.session.commit()
+
+
+def get_outbox_stats(
+    models: Iterable[type[Model]], period: float = 0.0
+) -> dict:
+    """Return the backlog and the throughput for each signal table.
+
+    For each table, "backlog" is the estimated number of pending
+    signals (the number of live rows, as counted by PostgreSQL's
+    statistics collector), and "max_age" is the number of seconds the
+    oldest pending signal has waited (obtained using the index on
+    `inserted_at`). "inserted" and "flushed" are the cumulative
+    numbers of inserted and deleted rows, also as counted by the
+    statistics collector.
+    Because the signals are deleted once they have been sent, these
+    counters include the work done by all flushing processes. When
+    `period` is bigger than zero, the counters are sampled twice,
+    `period` seconds apart, and the "inserted_per_sec" and the
+    "flushed_per_sec" rates are added.
+    """
+
+    models = list(models)
+    tables = [model.__table__.name for model in models]
+    counters = _get_table_counters(tables)
+    if period > 0.0:
+        time.sleep(period)
+        previous_counters = counters
+        counters = _get_table_counters(tables)
+
+    current_ts = datetime.now(tz=timezone.utc)
+    stats = {}
+    for model, table in zip(models, tables):
+        # NOTE: Counting the pending signals would require a full
+        # scan of the table, which can be big when the broker is not
+        # available. Therefore, the backlog is estimated.
+        oldest_inserted_at = db.session.execute(
+            select(func.min(model.inserted_at))
+        ).scalar()
+        inserted, flushed, backlog = counters.get(table, (0, 0, 0))
+        table_stats = stats[table] = {
+            "backlog": backlog,
+            "max_age": (
+                round((current_ts - oldest_inserted_at).total_seconds(), 3)
+                if oldest_inserted_at is not None
+                else 0.0
+            ),
+            "inserted": inserted,
+            "flushed": flushed,
+        }
+        if period > 0.0:
+            previous_inserted, previous_flushed, _ = previous_counters.get(
+                table, (0, 0, 0)
+            )
+            table_stats["inserted_per_sec"] = round(
+                (inserted - previous_inserted) / period, 1
+            )
+            table_stats["flushed_per_sec"] = round(
+                (flushed - previous_flushed) / period, 1
+            )
+
+    db.session.close()
+    return stats
+
+
+def _get_table_counters(tables: list[str]) -> Dict[str, tuple]:
+    # NOTE: The statistics are read in a separate transaction each
+    # time, because PostgreSQL caches them until the end of the
+    # transaction.
+    rows = db.session.execute(GET_TABLE_COUNTERS, {"tables": tables}).all()
+    db.session.close()
+    return {
+        row.relname: (row.n_tup_ins, row.n_tup_del, row.n_live_tup)
+        for row in rows
+    }
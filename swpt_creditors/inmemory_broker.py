@@ -0,0 +1,375 @@
+"""An in-process stand-in for the RabbitMQ message broker.
+
+This allows the whole message processing pipeline (incoming message ->
+database -> outgoing message) to be run and benchmarked on a single
+machine, without a real message broker. `InMemoryPublisher` can be
+used instead of `rabbitmq.Publisher`, and `InMemoryBroker.consume`
+passes queued messages to `rabbitmq.Consumer.process_message`, exactly
+like a real consumer would do. `InMemoryChannel` can be used instead
+of a `pika` channel, to test the declaration of the message routing.
+"""
+
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import (
+    Any, Deque, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+)
+from swpt_pythonlib import rabbitmq
+
+
+class UnroutableMessage(Exception):
+    """A mandatory message could not be routed to any queue."""
+
+
+class ConsumeResult(NamedTuple):
+    acked: int
+    rejected: int
+
+
+class _Binding(NamedTuple):
+    destination: str
+    to_exchange: bool
+    binding_words: Tuple[str, ...]
+    headers: Optional[Tuple[Tuple[str, Any], ...]]
+
+    def matches(self, message: rabbitmq.Message) -> bool:
+        if self.headers is None:
+            words = tuple(message.routing_key.split("."))
+            return _matches(self.binding_words, words)
+
+        arguments = dict(self.headers)
+        match_all = arguments.pop("x-match", "all") == "all"
+        message_headers = message.properties.headers or {}
+        results = (
+            k in message_headers and message_headers[k] == v
+            for k, v in arguments.items()
+        )
+        return all(results) if match_all else any(results)
+
+
+def _create_binding(
+    destination: str,
+    to_exchange: bool,
+    binding_key: Optional[str],
+    arguments: Optional[dict],
+) -> _Binding:
+    return _Binding(
+        destination=destination,
+        to_exchange=to_exchange,
+        binding_words=tuple(
+            ("#" if binding_key is None else binding_key).split(".")
+        ),
+        headers=(
+            tuple(sorted(arguments.items()))
+            if arguments is not None
+            else None
+        ),
+    )
+
+
+def _matches(binding_words: Tuple[str, ...], words: Tuple[str, ...]) -> bool:
+    if not binding_words:
+        return not words
+
+    first, rest = binding_words[0], binding_words[1:]
+    if first == "#":
+        return any(_matches(rest, words[i:]) for i in range(len(words) + 1))
+
+    return (
+        bool(words)
+        and (first == "*" or first == words[0])
+        and _matches(rest, words[1:])
+    )
+
+
+class InMemoryBroker:
+    """Routes messages to in-memory queues.
+
+    Queues and exchanges are bound to exchanges either with
+    topic-exchange binding keys ("*" matches one word, "#" matches
+    zero or more words), or with headers-exchange binding arguments
+    (`arguments`). Like in RabbitMQ, messages that do not match any
+    of an exchange's bindings are passed to the exchange's alternate
+    exchange (if there is one), and the same binding is never created
+    twice. Messages which have been rejected by a consumer are moved
+    to the queue's dead-letter list (see the `dead_letters` method).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues: Dict[str, Deque[rabbitmq.Message]] = {}
+        self._dead_letters: Dict[str, List[rabbitmq.Message]] = {}
+        self._bindings: Dict[str, List[_Binding]] = {}
+        self._alternate_exchanges: Dict[str, str] = {}
+
+    def declare_queue(self, queue: str) -> None:
+        with self._lock:
+            self._queues.setdefault(queue, deque())
+            self._dead_letters.setdefault(queue, [])
+
+    def declare_exchange(
+        self, exchange: str, alternate_exchange: Optional[str] = None
+    ) -> None:
+        with self._lock:
+            if alternate_exchange is None:
+                self._alternate_exchanges.pop(exchange, None)
+            else:
+                self._alternate_exchanges[exchange] = alternate_exchange
+
+    def delete_exchange(self, exchange: str) -> None:
+        """Delete the exchange's alternate exchange, as well as all
+        bindings from and to the exchange.
+        """
+
+        with self._lock:
+            self._alternate_exchanges.pop(exchange, None)
+            self._bindings.pop(exchange, None)
+            for bindings in self._bindings.values():
+                bindings[:] = [
+                    b for b in bindings
+                    if not (b.to_exchange and b.destination == exchange)
+                ]
+
+    def bind(
+        self,
+        queue: str,
+        exchange: str,
+        binding_key: str = "#",
+        arguments: Optional[dict] = None,
+    ) -> None:
+        self.declare_queue(queue)
+        self._add_binding(
+            exchange, _create_binding(queue, False, binding_key, arguments)
+        )
+
+    def unbind(
+        self,
+        queue: str,
+        exchange: str,
+        binding_key: str = "#",
+        arguments: Optional[dict] = None,
+    ) -> None:
+        self._remove_binding(
+            exchange, _create_binding(queue, False, binding_key, arguments)
+        )
+
+    def bind_exchange(
+        self,
+        destination: str,
+        source: str,
+        binding_key: str = "#",
+        arguments: Optional[dict] = None,
+    ) -> None:
+        self._add_binding(
+            source, _create_binding(destination, True, binding_key, arguments)
+        )
+
+    def unbind_exchange(
+        self,
+        destination: str,
+        source: str,
+        binding_key: str = "#",
+        arguments: Optional[dict] = None,
+    ) -> None:
+        self._remove_binding(
+            source, _create_binding(destination, True, binding_key, arguments)
+        )
+
+    def publish(self, message: rabbitmq.Message) -> None:
+        with self._lock:
+            queues = self._route(message.exchange, message, set())
+            if not queues and message.mandatory:
+                raise UnroutableMessage(message)
+
+            for queue in queues:
+                self._queues[queue].append(message)
+
+    def _route(
+        self, exchange: str, message: rabbitmq.Message, visited: Set[str]
+    ) -> Set[str]:
+        if exchange in visited:
+            return set()
+
+        visited.add(exchange)
+        bindings = [
+            b for b in self._bindings.get(exchange, []) if b.matches(message)
+        ]
+        if not bindings:
+            alternate_exchange = self._alternate_exchanges.get(exchange)
+            if alternate_exchange is None:
+                return set()
+            return self._route(alternate_exchange, message, visited)
+
+        queues = set()
+        for b in bindings:
+            if b.to_exchange:
+                queues |= self._route(b.destination, message, visited)
+            else:
+                queues.add(b.destination)
+
+        return queues
+
+    def _add_binding(self, exchange: str, binding: _Binding) -> None:
+        with self._lock:
+            bindings = self._bindings.setdefault(exchange, [])
+            if binding not in bindings:
+                bindings.append(binding)
+
+    def _remove_binding(self, exchange: str, binding: _Binding) -> None:
+        with self._lock:
+            bindings = self._bindings.get(exchange, [])
+            if binding in bindings:
+                bindings.remove(binding)
+
+    def get(self, queue: str) -> Optional[rabbitmq.Message]:
+        with self._lock:
+            q = self._queues[queue]
+            return q.popleft() if q else None
+
+    def requeue(self, queue: str, message: rabbitmq.Message) -> None:
+        with self._lock:
+            self._queues[queue].appendleft(message)
+
+    def reject(self, queue: str, message: rabbitmq.Message) -> None:
+        with self._lock:
+            self._dead_letters[queue].append(message)
+
+    def message_count(self, queue: str) -> int:
+        with self._lock:
+            return len(self._queues[queue])
+
+    def dead_letters(self, queue: str) -> List[rabbitmq.Message]:
+        with self._lock:
+            return list(self._dead_letters[queue])
+
+    def consume(
+        self,
+        consumer: rabbitmq.Consumer,
+        queue: str,
+        *,
+        app,
+        threads: int = 1,
+    ) -> ConsumeResult:
+        """Pass the messages from `queue` to `consumer.process_message`,
+        until the queue gets empty.
+
+        The messages are processed by `threads` parallel threads, with
+        a pushed application context for `app`. If `process_message`
+        raises an exception, the message is returned to the queue, and
+        the exception is re-raised once all threads have stopped.
+        """
+
+        assert threads > 0
+        lock = threading.Lock()
+        counters = {"acked": 0, "rejected": 0}
+        errors: List[BaseException] = []
+
+        def work():
+            with app.app_context():
+                while not errors:
+                    message = self.get(queue)
+                    if message is None:
+                        break
+
+                    try:
+                        ok = consumer.process_message(
+                            message.body, message.properties
+                        )
+                    except BaseException as e:
+                        self.requeue(queue, message)
+                        with lock:
+                            errors.append(e)
+                        break
+
+                    if not ok:
+                        self.reject(queue, message)
+                    with lock:
+                        counters["acked" if ok else "rejected"] += 1
+
+        workers = [threading.Thread(target=work) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if errors:
+            raise errors[0]
+
+        return ConsumeResult(**counters)
+
+
+class InMemoryChannel:
+    """Can be used instead of a `pika` channel, to declare exchanges,
+    queues, and bindings in an `InMemoryBroker`.
+
+    Only the arguments that affect the routing of messages are taken
+    into account. The type of each binding (topic or headers) is
+    determined by whether binding `arguments` are passed or not.
+    """
+
+    def __init__(self, broker: InMemoryBroker):
+        self.broker = broker
+
+    def exchange_declare(
+        self, exchange: str, *args, arguments=None, **kwargs
+    ):
+        self.broker.declare_exchange(
+            exchange, (arguments or {}).get("alternate-exchange")
+        )
+
+    def exchange_delete(self, exchange: str, *args, **kwargs):
+        self.broker.delete_exchange(exchange)
+
+    def exchange_bind(
+        self, destination, source, routing_key=None, arguments=None
+    ):
+        self.broker.bind_exchange(
+            destination, source, routing_key, arguments
+        )
+
+    def exchange_unbind(
+        self, destination, source, routing_key=None, arguments=None
+    ):
+        self.broker.unbind_exchange(
+            destination, source, routing_key, arguments
+        )
+
+    def queue_declare(self, queue: str, *args, **kwargs):
+        self.broker.declare_queue(queue)
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None):
+        self.broker.bind(queue, exchange, routing_key, arguments)
+
+    def queue_unbind(
+        self, queue, exchange, routing_key=None, arguments=None
+    ):
+        self.broker.unbind(queue, exchange, routing_key, arguments)
+
+
+class InMemoryPublisher:
+    """Can be used instead of `rabbitmq.Publisher`."""
+
+    def __init__(self, broker: InMemoryBroker):
+        self.broker = broker
+
+    def init_app(self, app) -> None:
+        pass
+
+    def publish_messages(self, messages: Iterable[rabbitmq.Message]) -> None:
+        for message in messages:
+            self.broker.publish(message)
+
+
+@contextmanager
+def publishing_to(broker: InMemoryBroker):
+    """Send all outgoing signals to `broker`, instead of RabbitMQ."""
+
+    from swpt_creditors.models import common
+
+    original_publisher = common.publisher
+    common.publisher = InMemoryPublisher(broker)
+    try:
+        yield
+    finally:
+        common.publisher = original_publisher
@@ -0,0 +1,268 @@
+"""Recording and replaying of incoming SMP messages.
+
+The recorded messages are stored in gzip-compressed files, containing
+one JSON object per line. Each object contains the message
+properties (including the headers), and the base64-encoded message
+body. The replaying passes the recorded messages to
+`SmpConsumer.process_message`, which allows measuring the consumer's
+throughput without a message broker.
+"""
+
+import gzip
+import json
+import time
+import random
+import logging
+import threading
+import queue
+from base64 import b64encode, b64decode
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, NamedTuple, Optional, Dict
+from sqlalchemy import select
+from swpt_pythonlib.rabbitmq import MessageProperties
+from swpt_creditors.extensions import db
+from swpt_creditors.models import AccountData
+from swpt_creditors.consumer_utils import LatencyHistogram
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class CapturedMessage(NamedTuple):
+    type: Optional[str]
+    content_type: Optional[str]
+    body: bytes
+    headers: Optional[dict] = None
+    content_encoding: Optional[str] = None
+    delivery_mode: Optional[int] = None
+    priority: Optional[int] = None
+    correlation_id: Optional[str] = None
+    reply_to: Optional[str] = None
+    expiration: Optional[str] = None
+    message_id: Optional[str] = None
+    timestamp: Optional[int] = None
+    user_id: Optional[str] = None
+    app_id: Optional[str] = None
+
+    @classmethod
+    def from_properties(cls, properties, body: bytes) -> "CapturedMessage":
+        """Create a captured message from the properties (for example,
+        `MessageProperties`) and the body of a received message.
+        """
+
+        return cls(
+            body=body,
+            **{
+                field: getattr(properties, field, None)
+                for field in _PROPERTY_FIELDS
+            },
+        )
+
+    def get_properties(self) -> MessageProperties:
+        """Return the properties of the captured message."""
+
+        return MessageProperties(
+            **{field: getattr(self, field) for field in _PROPERTY_FIELDS}
+        )
+
+
+_PROPERTY_FIELDS = tuple(
+    field for field in CapturedMessage._fields if field != "body"
+)
+
+
+def write_messages(
+    filename: str, messages: Iterable[CapturedMessage]
+) -> int:
+    """Write messages to a file, and return the number of messages.
+
+    The message properties whose values are `None` are not written.
+    """
+
+    count = 0
+    with gzip.open(filename, "wt", encoding="utf8") as f:
+        for m in messages:
+            obj = {}
+            for field in _PROPERTY_FIELDS:
+                value = getattr(m, field)
+                if value is not None:
+                    obj[field] = value
+
+            obj["body"] = b64encode(m.body).decode("ascii")
+            f.write(json.dumps(obj, separators=(",", ":")))
+            f.write("\n")
+            count += 1
+
+    return count
+
+
+def read_messages(filename: str) -> Iterator[CapturedMessage]:
+    """Read the messages from a file written by `write_messages`."""
+
+    with gzip.open(filename, "rt", encoding="utf8") as f:
+        for line in f:
+            obj = json.loads(line)
+            yield CapturedMessage(
+                body=b64decode(obj["body"]),
+                **{field: obj.get(field) for field in _PROPERTY_FIELDS},
+            )
+
+
+def generate_heartbeats(
+    count: int, accounts: int
+) -> Iterator[CapturedMessage]:
+    """Generate `AccountUpdate` heartbeat messages.
+
+    Up to `accounts` accounts are read from the database, and `count`
+    messages are generated, each one repeating the current state of
+    a randomly chosen account. Heartbeats are the most frequent
+    incoming messages.
+    """
+
+    rows = db.session.execute(
+        select(AccountData).where(AccountData.has_server_account).limit(
+            accounts
+        )
+    ).scalars().all()
+    if not rows:
+        return
+
+    for _ in range(count):
+        data = random.choice(rows)
+        content = {
+            "type": "AccountUpdate",
+            "debtor_id": data.debtor_id,
+            "creditor_id": data.creditor_id,
+            "creation_date": data.creation_date.isoformat(),
+            "last_change_ts": data.last_change_ts.isoformat(),
+            "last_change_seqnum": data.last_change_seqnum,
+            "principal": data.principal,
+            "interest": data.interest,
+            "interest_rate": data.interest_rate,
+            "last_interest_rate_change_ts": (
+                data.last_interest_rate_change_ts.isoformat()
+            ),
+            "last_config_ts": data.last_config_ts.isoformat(),
+            "last_config_seqnum": data.last_config_seqnum,
+            "negligible_amount": data.negligible_amount,
+            "config_flags": data.config_flags,
+            "config_data": data.config_data,
+            "account_id": data.account_id,
+            "debtor_info_iri": data.debtor_info_iri or "",
+            "debtor_info_content_type": data.debtor_info_content_type or "",
+            "debtor_info_sha256": (
+                (data.debtor_info_sha256 or b"").hex().upper()
+            ),
+            "last_transfer_number": data.last_transfer_number,
+            "last_transfer_committed_at": (
+                data.last_transfer_committed_at.isoformat()
+            ),
+            "demurrage_rate": -50.0,
+            "commit_period": 1000000,
+            "transfer_note_max_bytes": data.transfer_note_max_bytes,
+            "ts": datetime.now(tz=timezone.utc).isoformat(),
+            "ttl": 1000000000,
+        }
+        yield CapturedMessage(
+            type="AccountUpdate",
+            content_type="application/json",
+            body=json.dumps(content).encode("utf8"),
+            headers={
+                "message-type": "AccountUpdate",
+                "debtor-id": data.debtor_id,
+                "creditor-id": data.creditor_id,
+            },
+            delivery_mode=2,
+        )
+
+
+class ReplayReport:
+    """Collects the outcomes and latencies of replayed messages."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.finished_at = self.started_at
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self.latencies: Dict[str, LatencyHistogram] = {}
+
+    def add(self, message_type: str, outcome: str, seconds: float) -> None:
+        with self._lock:
+            counters = self.counters.setdefault(message_type, {})
+            counters[outcome] = counters.get(outcome, 0) + 1
+            histogram = self.latencies.get(message_type)
+            if histogram is None:
+                histogram = self.latencies[message_type] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def finish(self) -> None:
+        self.finished_at = time.monotonic()
+
+    def as_dict(self) -> dict:
+        seconds = max(self.finished_at - self.started_at, 1e-9)
+        total = sum(sum(c.values()) for c in self.counters.values())
+        types = {}
+        for message_type, counters in self.counters.items():
+            count = sum(counters.values())
+            types[message_type] = {
+                **counters,
+                "msg_per_sec": round(count / seconds, 1),
+                "latency": self.latencies[message_type].summary(),
+            }
+
+        return {
+            "messages": total,
+            "seconds": round(seconds, 3),
+            "msg_per_sec": round(total / seconds, 1),
+            "types": types,
+        }
+
+
+def replay_messages(
+    app,
+    consumer,
+    messages: Iterable[CapturedMessage],
+    threads: int = 1,
+) -> ReplayReport:
+    """Pass the messages to `consumer.process_message` from `threads`
+    parallel threads, and return a report.
+    """
+
+    assert threads > 0
+    report = ReplayReport()
+    q: queue.Queue = queue.Queue(maxsize=10 * threads)
+
+    def work():
+        with app.app_context():
+            while True:
+                m = q.get()
+                if m is None:
+                    break
+                properties = m.get_properties()
+                started_at = time.monotonic()
+                try:
+                    ok = consumer.process_message(m.body, properties)
+                except Exception:
+                    _LOGGER.exception(
+                        "Caught error while replaying a message."
+                    )
+                    outcome = "failed"
+                else:
+                    outcome = "processed" if ok else "rejected"
+                report.add(
+                    m.type or "UNKNOWN", outcome, time.monotonic() - started_at
+                )
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    try:
+        for m in messages:
+            q.put(m)
+    finally:
+        for _ in workers:
+            q.put(None)
+        for worker in workers:
+            worker.join()
+
+    report.finish()
+    return report
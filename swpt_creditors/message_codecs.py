@@ -0,0 +1,399 @@
+"""Encoding and fast decoding of SMP messages.
+
+The `parse_json` and `compile_schema` functions produce exactly the
+same results as `json.loads` followed by `schema.load`, but do it
+faster. Whenever the fast path can not guarantee an identical result
+(the message is invalid, or contains something unusual), the decoding
+is delegated to the standard implementation, so that the accepted and
+rejected messages, as well as the raised errors, are exactly the same.
+Similarly, the `compile_dump_schema` function produces exactly the
+same results as `schema.dump`, and is used to serialize outgoing
+messages.
+
+In addition to JSON, messages can be encoded with MessagePack or
+CBOR, if the `msgpack` or the `cbor2` package is installed. The
+binary encodings represent the same objects that would be encoded in
+JSON, and therefore, the same schemas are used to validate them.
+"""
+
+import re
+import json
+from typing import Any, Callable, Optional, List, Tuple
+from marshmallow import Schema, fields, missing, RAISE, EXCLUDE
+from marshmallow.decorators import (
+    PRE_LOAD,
+    POST_LOAD,
+    VALIDATES,
+    PRE_DUMP,
+    POST_DUMP,
+)
+from marshmallow.error_store import ErrorStore
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover
+    cbor2 = None
+
+CT_JSON = "application/json"
+CT_MSGPACK = "application/msgpack"
+CT_CBOR = "application/cbor"
+
+_INTEGER = 1
+_FLOAT = 2
+_STRING = 3
+_OTHER = 4
+_CONSTANT = 5
+
+_FieldSpec = Tuple[str, str, int, fields.Field]
+
+# NOTE: `orjson` converts integers that do not fit in 64 bits to
+# floats. Such integers have at least 19 digits.
+_LONG_DIGITS_SEQUENCE = re.compile(rb"[0-9]{19}")
+
+# Fields of these types are deserialized by calling their
+# `deserialize` method. Schemas containing fields of other types
+# (nested schemas, for example) will not be compiled.
+_OTHER_FIELD_TYPES = (
+    fields.DateTime,
+    fields.Date,
+    fields.Boolean,
+    fields.Constant,
+)
+
+_JSON_ENCODER = json.JSONEncoder(
+    ensure_ascii=False,
+    check_circular=False,
+    allow_nan=False,
+    separators=(",", ":"),
+)
+
+
+def parse_json(body: bytes) -> Any:
+    """Parse an UTF-8 encoded JSON document.
+
+    Raises `json.JSONDecodeError` or `UnicodeError` if the document
+    is invalid, exactly like `json.loads(body.decode("utf8"))`.
+    """
+
+    if orjson is not None and not _LONG_DIGITS_SEQUENCE.search(body):
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # NOTE: `orjson` is stricter than the standard library
+            # (for example, it rejects "NaN"). To guarantee identical
+            # results, the standard JSON parser decides what to do
+            # with the document.
+            pass
+
+    return json.loads(body.decode("utf8"))
+
+
+def get_body_parser(
+    content_type: Optional[str], fast: bool = False
+) -> Optional[Callable[[bytes], Any]]:
+    """Return a function that parses message bodies of the given
+    content type.
+
+    The returned function raises `ValueError` if the message body is
+    invalid. Returns `None` if the content type is not supported.
+    """
+
+    if content_type == CT_JSON:
+        return parse_json if fast else _parse_json
+    if content_type == CT_MSGPACK and msgpack is not None:
+        return _parse_msgpack
+    if content_type == CT_CBOR and cbor2 is not None:
+        return _parse_cbor
+    return None
+
+
+def is_supported_content_type(content_type: str) -> bool:
+    """Check if messages can be encoded and decoded with the given
+    content type.
+    """
+
+    return (
+        content_type == CT_JSON
+        or (content_type == CT_MSGPACK and msgpack is not None)
+        or (content_type == CT_CBOR and cbor2 is not None)
+    )
+
+
+def encode_body(data: dict, content_type: str) -> bytes:
+    """Encode the message data with the given content type.
+
+    Raises `RuntimeError` if the content type is not supported.
+    """
+
+    if content_type == CT_JSON:
+        # NOTE: This gives the same result as `json.dumps(data,
+        # ensure_ascii=False, check_circular=False, allow_nan=False,
+        # separators=(",", ":"))`, but avoids creating a new encoder
+        # for each message.
+        return _JSON_ENCODER.encode(data).encode("utf8")
+    if content_type == CT_MSGPACK and msgpack is not None:
+        return msgpack.packb(data, use_bin_type=True)
+    if content_type == CT_CBOR and cbor2 is not None:
+        return cbor2.dumps(data)
+
+    raise RuntimeError(f'Unsupported content type: "{content_type}"')
+
+
+def _parse_json(body: bytes) -> Any:
+    return json.loads(body.decode("utf8"))
+
+
+def _parse_msgpack(body: bytes) -> Any:
+    try:
+        return msgpack.unpackb(body, raw=False)
+    except Exception as e:
+        raise ValueError("Invalid MessagePack document.") from e
+
+
+def _parse_cbor(body: bytes) -> Any:
+    try:
+        return cbor2.loads(body)
+    except Exception as e:
+        raise ValueError("Invalid CBOR document.") from e
+
+
+def compile_schema(schema: Schema) -> Callable[[Any], dict]:
+    """Return a function that does the same as `schema.load`.
+
+    The returned function deserializes the most common field types
+    inline, and invokes the schema's validators and post-load
+    processors directly, avoiding most of marshmallow's overhead.
+    """
+
+    if not _is_compilable(schema):
+        return schema.load
+
+    specs: List[_FieldSpec] = []
+    for field_name, field_obj in schema.load_fields.items():
+        attr_name = field_obj.attribute or field_name
+        if "." in attr_name:
+            return schema.load
+
+        if type(field_obj) is fields.Integer:
+            kind = _INTEGER
+        elif type(field_obj) is fields.Float:
+            kind = _FLOAT
+        elif type(field_obj) is fields.String:
+            kind = _STRING
+        elif type(field_obj) in _OTHER_FIELD_TYPES:
+            kind = _OTHER
+        else:
+            return schema.load
+
+        data_key = (
+            field_obj.data_key
+            if field_obj.data_key is not None
+            else field_name
+        )
+        specs.append((data_key, attr_name, kind, field_obj))
+
+    known_keys = frozenset(spec[0] for spec in specs)
+    raise_on_unknown = schema.unknown == RAISE
+    has_field_validators = bool(schema._hooks[VALIDATES])
+    has_post_load = bool(schema._hooks[POST_LOAD])
+
+    def fast_load(data: Any) -> Optional[dict]:
+        if type(data) is not dict:
+            return None
+
+        if raise_on_unknown and not known_keys.issuperset(data):
+            return None
+
+        result = {}
+        for data_key, attr_name, kind, field_obj in specs:
+            try:
+                value = data[data_key]
+            except KeyError:
+                if (
+                        field_obj.required
+                        or field_obj.load_default is not missing
+                ):
+                    return None
+                continue
+
+            if value is None:
+                return None
+
+            if (
+                    kind == _INTEGER and type(value) is int
+                    or kind == _STRING and type(value) is str
+            ):
+                if field_obj.validators:
+                    field_obj._validate(value)
+            elif kind == _FLOAT and type(value) in (float, int):
+                value = float(value)
+                if value - value != 0.0:
+                    return None  # NaN or infinity
+                if field_obj.validators:
+                    field_obj._validate(value)
+            else:
+                # NOTE: This also runs the field validators.
+                value = field_obj.deserialize(value, data_key, data)
+
+            result[attr_name] = value
+
+        error_store = ErrorStore()
+        if has_field_validators:
+            schema._invoke_field_validators(
+                error_store=error_store, data=result, many=False
+            )
+
+        field_errors = bool(error_store.errors)
+        for pass_many in (True, False):
+            schema._invoke_schema_validators(
+                error_store=error_store,
+                pass_many=pass_many,
+                data=result,
+                original_data=data,
+                many=False,
+                partial=None,
+                field_errors=field_errors,
+            )
+
+        if error_store.errors:
+            return None
+
+        if has_post_load:
+            result = schema._invoke_load_processors(
+                POST_LOAD,
+                result,
+                many=False,
+                original_data=data,
+                partial=None,
+            )
+
+        return result
+
+    def load(data: Any) -> dict:
+        try:
+            result = fast_load(data)
+        except Exception:
+            # The slow path will raise the proper error (or, in the
+            # unlikely case the fast path has missed something, will
+            # successfully load the data).
+            result = None
+
+        return schema.load(data) if result is None else result
+
+    return load
+
+
+def compile_dump_schema(schema: Schema) -> Callable[[Any], dict]:
+    """Return a function that does the same as `schema.dump`.
+
+    The returned function reads the object's attributes directly, and
+    serializes the most common field types inline, avoiding most of
+    marshmallow's overhead. Fields of other types are serialized by
+    calling their `_serialize` method.
+    """
+
+    if not _is_dump_compilable(schema):
+        return schema.dump
+
+    specs: List[_FieldSpec] = []
+    for field_name, field_obj in schema.dump_fields.items():
+        attr_name = field_obj.attribute or field_name
+        if "." in attr_name:
+            return schema.dump
+
+        if type(field_obj) is fields.Constant:
+            kind = _CONSTANT
+        elif type(field_obj) is fields.Integer and not field_obj.as_string:
+            kind = _INTEGER
+        elif type(field_obj) is fields.Float and not field_obj.as_string:
+            kind = _FLOAT
+        elif type(field_obj) is fields.String:
+            kind = _STRING
+        elif type(field_obj) in _OTHER_FIELD_TYPES:
+            kind = _OTHER
+        else:
+            return schema.dump
+
+        data_key = (
+            field_obj.data_key
+            if field_obj.data_key is not None
+            else field_name
+        )
+        specs.append((data_key, attr_name, kind, field_obj))
+
+    def fast_dump(obj: Any) -> Optional[dict]:
+        if hasattr(obj, "__getitem__"):
+            return None
+
+        result = {}
+        for data_key, attr_name, kind, field_obj in specs:
+            if kind == _CONSTANT:
+                result[data_key] = field_obj.constant
+                continue
+
+            value = getattr(obj, attr_name, missing)
+            if value is missing:
+                return None
+
+            if value is None:
+                pass
+            elif kind == _INTEGER and type(value) is int:
+                pass
+            elif kind == _FLOAT and type(value) is float:
+                pass
+            elif kind == _STRING and type(value) is str:
+                pass
+            else:
+                value = field_obj._serialize(value, attr_name, obj)
+
+            result[data_key] = value
+
+        return result
+
+    def dump(obj: Any) -> dict:
+        try:
+            result = fast_dump(obj)
+        except Exception:
+            # The slow path will raise the proper error.
+            result = None
+
+        return schema.dump(obj) if result is None else result
+
+    return dump
+
+
+def _is_dump_compilable(schema: Schema) -> bool:
+    return (
+        not schema.many
+        and type(schema).get_attribute is Schema.get_attribute
+        and schema.dict_class is dict
+        and not schema._hooks[PRE_DUMP]
+        and not schema._hooks[POST_DUMP]
+    )
+
+
+def _is_compilable(schema: Schema) -> bool:
+    return (
+        not schema.many
+        and not schema.partial
+        and schema.unknown in (RAISE, EXCLUDE)
+        and not schema._hooks[PRE_LOAD]
+        and all(
+            hasattr(schema, method_name)
+            for method_name in [
+                "_invoke_field_validators",
+                "_invoke_schema_validators",
+                "_invoke_load_processors",
+            ]
+        )
+    )
@@ -1,11 +1,14 @@
 from __future__ import annotations
-import json
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from typing import Any, Callable
 from flask import current_app
 from sqlalchemy import text
 from sqlalchemy.inspection import inspect
 from swpt_creditors.extensions import db, publisher
 from swpt_pythonlib import rabbitmq
+from swpt_creditors.message_codecs import encode_body, compile_dump_schema
 
 MIN_INT16 = -1 << 15
 MAX_INT16 = (1 << 15) - 1
@@ -29,6 +32,9 @@ DISCARD_PLANS = text("DISCARD PLANS")
 
 CT_DIRECT = "direct"
 
+_compiled_dump_functions: dict[type, Callable[[Any], dict]] = {}
+_publishing_executors: dict[int, ThreadPoolExecutor] = {}
+
 
 def get_now_utc():
     return datetime.now(tz=timezone.utc)
@@ -44,6 +50,61 @@ def is_valid_creditor_id(creditor_id: int, match_parent=False) -> bool:
     )
 
 
+def publish_messages(messages: list[rabbitmq.Message]) -> None:
+    """Publish the messages, and wait for the publisher confirms.
+
+    When the "FLUSH_PUBLISHING_CHANNELS" setting is bigger than one,
+    the messages are divided into several chunks, which are published
+    in parallel over separate AMQP channels (one channel per thread),
+    so that the publisher confirms for the different chunks arrive in
+    a pipelined manner. Messages with the same routing key always go
+    to the same chunk, so that their order is preserved.
+    """
+
+    channels = current_app.config["FLUSH_PUBLISHING_CHANNELS"]
+    if channels <= 1 or len(messages) <= 1:
+        publisher.publish_messages(messages)
+        return
+
+    chunks: list[list[rabbitmq.Message]] = [[] for _ in range(channels)]
+    for message in messages:
+        key = zlib.crc32(message.routing_key.encode("utf8"))
+        chunks[key % channels].append(message)
+
+    chunks = [chunk for chunk in chunks if chunk]
+    executor = _get_publishing_executor(channels - 1)
+    app = current_app._get_current_object()
+    futures = [
+        executor.submit(_publish_chunk, app, chunk) for chunk in chunks[1:]
+    ]
+    try:
+        # The first chunk is published by the current thread.
+        publisher.publish_messages(chunks[0])
+    finally:
+        for future in futures:
+            future.exception()
+
+    for future in futures:
+        future.result()
+
+
+def _publish_chunk(app, messages: list[rabbitmq.Message]) -> None:
+    with app.app_context():
+        publisher.publish_messages(messages)
+
+
+def _get_publishing_executor(max_workers: int) -> ThreadPoolExecutor:
+    # NOTE: The executor's threads are reused, because the publisher
+    # keeps a separate connection and channel for each thread.
+    executor = _publishing_executors.get(max_workers)
+    if executor is None:
+        executor = _publishing_executors[max_workers] = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="publisher"
+        )
+
+    return executor
+
+
 class ChooseRowsMixin:
     @classmethod
     def choose_rows(cls, primary_keys: list[tuple], name: str = "chosen"):
@@ -63,16 +124,29 @@ class Signal(db.Model, ChooseRowsMixin):
     @classmethod
     def send_signalbus_messages(cls, objects):  # pragma: no cover
         create_message = cls._create_message
-        messages = (create_message(obj) for obj in objects)
-        publisher.publish_messages([m for m in messages if m is not None])
+        messages = (
+            create_message(obj) for obj in cls._exclude_superseded(objects)
+        )
+        publish_messages([m for m in messages if m is not None])
 
     @classmethod
     def send_signalbus_message(cls, obj):  # pragma: no cover
         cls.send_signalbus_messages([obj])
 
+    @classmethod
+    def _exclude_superseded(cls, objects: list) -> list:
+        """Return the objects which should be sent.
+
+        All passed objects will be deleted after the sending, but
+        subclasses may choose not to send the ones which have been
+        superseded by other objects from the same burst.
+        """
+
+        return objects
+
     @classmethod
     def _create_message(cls, obj):  # pragma: no cover
-        data = cls.__marshmallow_schema__.dump(obj)
+        data = cls._get_dump_function()(obj)
         message_type = data["type"]
         creditor_id = data["creditor_id"]
         debtor_id = data["debtor_id"]
@@ -101,20 +175,15 @@ class Signal(db.Model, ChooseRowsMixin):
             headers["coordinator-id"] = data["coordinator_id"]
             headers["coordinator-type"] = data["coordinator_type"]
 
+        content_type = current_app.config["PROTOCOL_BROKER_CONTENT_TYPE"]
         properties = rabbitmq.MessageProperties(
             delivery_mode=2,
             app_id="swpt_creditors",
-            content_type="application/json",
+            content_type=content_type,
             type=message_type,
             headers=headers,
         )
-        body = json.dumps(
-            data,
-            ensure_ascii=False,
-            check_circular=False,
-            allow_nan=False,
-            separators=(",", ":"),
-        ).encode("utf8")
+        body = encode_body(data, content_type)
 
         return rabbitmq.Message(
             exchange=cls.exchange_name,
@@ -124,6 +193,22 @@ class Signal(db.Model, ChooseRowsMixin):
             mandatory=message_type == "FinalizeTransfer",
         )
 
+    @classmethod
+    def _get_dump_function(cls) -> Callable[[Any], dict]:
+        """Return a function that does the same as
+        `cls.__marshmallow_schema__.dump`, but faster.
+        """
+
+        dump = _compiled_dump_functions.get(cls)
+        if dump is None:
+            dump = compile_dump_schema(cls.__marshmallow_schema__)
+            _compiled_dump_functions[cls] = dump
+
+        return dump
+
     inserted_at = db.Column(
-        db.TIMESTAMP(timezone=True), nullable=False, default=get_now_utc
+        db.TIMESTAMP(timezone=True),
+        nullable=False,
+        default=get_now_utc,
+        index=True,
     )
@@ -1,7 +1,11 @@
 from __future__ import annotations
 from flask import current_app
 from marshmallow import Schema, fields
-from swpt_pythonlib.utils import i64_to_hex_routing_key, calc_bin_routing_key
+from swpt_pythonlib.utils import (
+    i64_to_hex_routing_key,
+    calc_bin_routing_key,
+    Seqnum,
+)
 from swpt_creditors.extensions import (
     db,
     CREDITORS_OUT_EXCHANGE,
@@ -19,6 +23,31 @@ class classproperty(object):
         return self.f(owner)
 
 
+def _get_latest_per_account(objects: list, get_order) -> list:
+    latest = {}
+    for obj in objects:
+        key = (obj.creditor_id, obj.debtor_id)
+        current = latest.get(key)
+        if current is None or get_order(current) < get_order(obj):
+            latest[key] = obj
+
+    return list(latest.values())
+
+
+class LatestUpdateOnlyMixin:
+    """Excludes signals superseded by a signal with a bigger
+    `update_id` for the same account, when
+    APP_FLUSH_LATEST_TRADE_SIGNALS_ONLY is true.
+    """
+
+    @classmethod
+    def _exclude_superseded(cls, objects: list) -> list:
+        if not current_app.config["APP_FLUSH_LATEST_TRADE_SIGNALS_ONLY"]:
+            return objects
+
+        return _get_latest_per_account(objects, lambda obj: obj.update_id)
+
+
 class ConfigureAccountSignal(Signal):
     exchange_name = CREDITORS_OUT_EXCHANGE
 
@@ -50,6 +79,23 @@ class ConfigureAccountSignal(Signal):
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_CONFIGURE_ACCOUNTS_BURST_COUNT"]
 
+    @classproperty
+    def signalbus_flush_period(self):
+        return current_app.config["APP_FLUSH_CONFIGURE_ACCOUNTS_PERIOD"]
+
+    @classmethod
+    def _exclude_superseded(cls, objects: list) -> list:
+        # NOTE: The accounting authority applies only the newest
+        # configuration, and older configurations are ignored.
+        # Therefore, when APP_FLUSH_LATEST_CONFIGS_ONLY is true, only
+        # the newest configuration for each account is sent.
+        if not current_app.config["APP_FLUSH_LATEST_CONFIGS_ONLY"]:
+            return objects
+
+        return _get_latest_per_account(
+            objects, lambda obj: (obj.ts, Seqnum(obj.seqnum))
+        )
+
 
 class PrepareTransferSignal(Signal):
     exchange_name = CREDITORS_OUT_EXCHANGE
@@ -94,6 +140,10 @@ class PrepareTransferSignal(Signal):
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_PREPARE_TRANSFERS_BURST_COUNT"]
 
+    @classproperty
+    def signalbus_flush_period(self):
+        return current_app.config["APP_FLUSH_PREPARE_TRANSFERS_PERIOD"]
+
 
 class FinalizeTransferSignal(Signal):
     exchange_name = CREDITORS_OUT_EXCHANGE
@@ -131,8 +181,12 @@ class FinalizeTransferSignal(Signal):
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_FINALIZE_TRANSFERS_BURST_COUNT"]
 
+    @classproperty
+    def signalbus_flush_period(self):
+        return current_app.config["APP_FLUSH_FINALIZE_TRANSFERS_PERIOD"]
+
 
-class UpdatedLedgerSignal(Signal):
+class UpdatedLedgerSignal(LatestUpdateOnlyMixin, Signal):
     """Notifies about a change in account's principal balance.
 
     In addition to the new principal balance, the notification contains the
@@ -174,8 +228,12 @@ class UpdatedLedgerSignal(Signal):
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_UPDATED_LEDGER_BURST_COUNT"]
 
+    @classproperty
+    def signalbus_flush_period(self):
+        return current_app.config["APP_FLUSH_UPDATED_LEDGER_PERIOD"]
+
 
-class UpdatedPolicySignal(Signal):
+class UpdatedPolicySignal(LatestUpdateOnlyMixin, Signal):
     """Notifies about a change in account's automatic exchange policy.
 
     The subsystem that performs automatic circular trades needs this
@@ -216,8 +274,12 @@ class UpdatedPolicySignal(Signal):
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_UPDATED_POLICY_BURST_COUNT"]
 
+    @classproperty
+    def signalbus_flush_period(self):
+        return current_app.config["APP_FLUSH_UPDATED_POLICY_PERIOD"]
+
 
-class UpdatedFlagsSignal(Signal):
+class UpdatedFlagsSignal(LatestUpdateOnlyMixin, Signal):
     """Notifies about a change in account's configuration flags.
 
     The subsystem that performs automatic circular trades needs this
@@ -250,6 +312,10 @@ class UpdatedFlagsSignal(Signal):
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_UPDATED_FLAGS_BURST_COUNT"]
 
+    @classproperty
+    def signalbus_flush_period(self):
+        return current_app.config["APP_FLUSH_UPDATED_FLAGS_PERIOD"]
+
 
 class RejectedConfigSignal(Signal):
     """NOTE: For `ConfigureAccount` messages that can not be routed to
@@ -294,3 +360,7 @@ class RejectedConfigSignal(Signal):
     @classproperty
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_REJECTED_CONFIGS_BURST_COUNT"]
+
+    @classproperty
+    def signalbus_flush_period(self):
+        return current_app.config["APP_FLUSH_REJECTED_CONFIGS_PERIOD"]
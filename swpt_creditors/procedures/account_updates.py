@@ -1,8 +1,8 @@
 from datetime import datetime, date, timezone, timedelta
 from typing import TypeVar, Callable, Iterable, Tuple, List, Optional
 from flask import current_app
-from sqlalchemy import select
-from sqlalchemy.sql.expression import func, text
+from sqlalchemy import select, update
+from sqlalchemy.sql.expression import func, text, or_, and_
 from sqlalchemy.orm import load_only
 from swpt_pythonlib.utils import Seqnum
 from swpt_creditors.extensions import db
@@ -26,7 +26,7 @@ from .common import (
     LOAD_ONLY_INFO_RELATED_COLUMNS,
     LOAD_ONLY_LEDGER_RELATED_COLUMNS
 )
-from .common import contain_principal_overflow
+from .common import contain_principal_overflow, get_paths_and_types
 from .accounts import _insert_info_update_pending_log_entry
 from .transfers import ensure_pending_ledger_update
 
@@ -36,12 +36,37 @@ atomic: Callable[[T], T] = db.atomic
 EPS = 1e-5
 HUGE_INTERVAL = timedelta(days=500000)
 
+CALL_PROCESS_ACCOUNT_UPDATE_SIGNAL = text(
+    "SELECT process_account_update_signal(:debtor_id, :creditor_id, "
+    ":creation_date, :last_change_ts, :last_change_seqnum, :principal, "
+    ":interest, :interest_rate, :last_interest_rate_change_ts, "
+    ":transfer_note_max_bytes, :last_config_ts, :last_config_seqnum, "
+    ":negligible_amount, :config_flags, :config_data, :account_id, "
+    ":debtor_info_iri, :debtor_info_content_type, :debtor_info_sha256, "
+    ":last_transfer_number, :last_transfer_committed_at, :ts, :ttl, "
+    ":account_info_object_type, :account_info_object_uri)"
+)
 CALL_PROCESS_PENDING_LEDGER_UPDATE = text(
     "SELECT process_pending_ledger_update(:creditor_id, :debtor_id, "
     ":max_delay)"
 )
 
 
+def get_account_update_signal_params(kwargs: dict) -> dict:
+    """Return the parameters for CALL_PROCESS_ACCOUNT_UPDATE_SIGNAL,
+    given the arguments for `process_account_update_signal`.
+    """
+
+    paths, types = get_paths_and_types()
+    return {
+        **kwargs,
+        "account_info_object_type": types.account_info,
+        "account_info_object_uri": paths.account_info(
+            creditorId=kwargs["creditor_id"], debtorId=kwargs["debtor_id"]
+        ),
+    }
+
+
 @atomic
 def process_rejected_config_signal(
     *,
@@ -112,6 +137,48 @@ def process_account_update_signal(
     if (current_ts - ts).total_seconds() > ttl:
         return
 
+    if current_app.config["APP_USE_PGPLSQL_FUNCTIONS"]:  # pragma: no cover
+        db.session.execute(
+            CALL_PROCESS_ACCOUNT_UPDATE_SIGNAL,
+            get_account_update_signal_params({
+                "debtor_id": debtor_id,
+                "creditor_id": creditor_id,
+                "creation_date": creation_date,
+                "last_change_ts": last_change_ts,
+                "last_change_seqnum": last_change_seqnum,
+                "principal": principal,
+                "interest": interest,
+                "interest_rate": interest_rate,
+                "last_interest_rate_change_ts": last_interest_rate_change_ts,
+                "transfer_note_max_bytes": transfer_note_max_bytes,
+                "last_config_ts": last_config_ts,
+                "last_config_seqnum": last_config_seqnum,
+                "negligible_amount": negligible_amount,
+                "config_flags": config_flags,
+                "config_data": config_data,
+                "account_id": account_id,
+                "debtor_info_iri": debtor_info_iri,
+                "debtor_info_content_type": debtor_info_content_type,
+                "debtor_info_sha256": debtor_info_sha256,
+                "last_transfer_number": last_transfer_number,
+                "last_transfer_committed_at": last_transfer_committed_at,
+                "ts": ts,
+                "ttl": ttl,
+            }),
+        )
+        return
+
+    if _process_heartbeat(
+        creditor_id=creditor_id,
+        debtor_id=debtor_id,
+        creation_date=creation_date,
+        last_change_ts=last_change_ts,
+        last_change_seqnum=last_change_seqnum,
+        ts=ts,
+        current_ts=current_ts,
+    ):
+        return
+
     data = (
         AccountData.query
         .filter_by(
@@ -374,6 +441,73 @@ def process_pending_ledger_update(
     return is_done
 
 
+def _process_heartbeat(
+    *,
+    creditor_id: int,
+    debtor_id: int,
+    creation_date: date,
+    last_change_ts: datetime,
+    last_change_seqnum: int,
+    ts: datetime,
+    current_ts: datetime,
+) -> bool:
+    """Try to process an `AccountUpdate` message as a pure heartbeat.
+
+    This is a fast path for the most common case, in which the
+    message does not bring any new information, except (possibly) a
+    newer heartbeat timestamp. The heartbeat timestamp is updated with
+    a single statement, without loading the account's data. Stale
+    heartbeats are recognized by the same statement, and do not cause
+    any writes.
+
+    Returns `True` if the message has been fully processed. Returns
+    `False` if the message must be processed in full. Note that, to
+    avoid re-implementing the `Seqnum` comparison in SQL, only events
+    that are equal to the stored event, or are older than it by
+    `creation_date` or `last_change_ts`, are recognized here.
+    """
+
+    is_old_event = or_(
+        AccountData.creation_date > creation_date,
+        and_(
+            AccountData.creation_date == creation_date,
+            or_(
+                AccountData.last_change_ts > last_change_ts,
+                and_(
+                    AccountData.last_change_ts == last_change_ts,
+                    AccountData.last_change_seqnum == last_change_seqnum,
+                ),
+            ),
+        ),
+    )
+    is_this_account = and_(
+        AccountData.creditor_id == creditor_id,
+        AccountData.debtor_id == debtor_id,
+    )
+    heartbeat_update = (
+        update(AccountData)
+        .where(
+            is_this_account,
+            AccountData.last_heartbeat_ts < ts,
+            is_old_event,
+        )
+        .values(last_heartbeat_ts=min(ts, current_ts))
+        .returning(AccountData.creditor_id)
+        .cte("heartbeat_update")
+    )
+
+    # NOTE: The main query sees the account's data as it was before
+    # the heartbeat update. This is not a problem, because the
+    # account's last event never gets older.
+    matching_rows = db.session.scalar(
+        select(func.count())
+        .select_from(AccountData)
+        .where(is_this_account, is_old_event)
+        .add_cte(heartbeat_update)
+    )
+    return matching_rows > 0
+
+
 def _get_sorted_pending_transfers(
     data: AccountData, max_count: int
 ) -> List[Tuple]:
@@ -2,7 +2,9 @@ from uuid import UUID
 from math import floor
 from datetime import datetime, timezone, date, timedelta
 from typing import TypeVar, Callable, Optional, List
+from flask import current_app
 from sqlalchemy import select
+from sqlalchemy.sql.expression import text
 from sqlalchemy.orm import exc, defer
 from sqlalchemy.dialects import postgresql
 from swpt_creditors.extensions import db
@@ -32,6 +34,28 @@ DEFER_RUNNING_TRANSFER_TOASTED_COLUMNS = [defer(RunningTransfer.transfer_note)]
 ENSURE_PENDING_LEDGER_UPDATE_STATEMENT = postgresql.insert(
     PendingLedgerUpdate.__table__
 ).on_conflict_do_nothing()
+CALL_PROCESS_ACCOUNT_TRANSFER_SIGNAL = text(
+    "SELECT process_account_transfer_signal(:debtor_id, :creditor_id, "
+    ":creation_date, :transfer_number, :coordinator_type, :sender, "
+    ":recipient, :acquired_amount, :transfer_note_format, :transfer_note, "
+    ":committed_at, :principal, :ts, :previous_transfer_number, "
+    ":retention_interval)"
+)
+CALL_PROCESS_REJECTED_DIRECT_TRANSFER_SIGNAL = text(
+    "SELECT process_rejected_direct_transfer_signal(:coordinator_id, "
+    ":coordinator_request_id, :status_code, :total_locked_amount, "
+    ":debtor_id, :creditor_id)"
+)
+CALL_PROCESS_PREPARED_DIRECT_TRANSFER_SIGNAL = text(
+    "SELECT process_prepared_direct_transfer_signal(:debtor_id, "
+    ":creditor_id, :transfer_id, :coordinator_id, :coordinator_request_id, "
+    ":locked_amount, :recipient)"
+)
+CALL_PROCESS_FINALIZED_DIRECT_TRANSFER_SIGNAL = text(
+    "SELECT process_finalized_direct_transfer_signal(:debtor_id, "
+    ":creditor_id, :transfer_id, :coordinator_id, :coordinator_request_id, "
+    ":committed_amount, :status_code, :total_locked_amount)"
+)
 
 
 @atomic
@@ -226,6 +250,29 @@ def process_account_transfer_signal(
     if (current_ts - min(ts, committed_at)) > retention_interval:
         return
 
+    if current_app.config["APP_USE_PGPLSQL_FUNCTIONS"]:  # pragma: no cover
+        db.session.execute(
+            CALL_PROCESS_ACCOUNT_TRANSFER_SIGNAL,
+            {
+                "debtor_id": debtor_id,
+                "creditor_id": creditor_id,
+                "creation_date": creation_date,
+                "transfer_number": transfer_number,
+                "coordinator_type": coordinator_type,
+                "sender": sender,
+                "recipient": recipient,
+                "acquired_amount": acquired_amount,
+                "transfer_note_format": transfer_note_format,
+                "transfer_note": transfer_note,
+                "committed_at": committed_at,
+                "principal": principal,
+                "ts": ts,
+                "previous_transfer_number": previous_transfer_number,
+                "retention_interval": retention_interval,
+            },
+        )
+        return
+
     committed_transfer_query = CommittedTransfer.query.filter_by(
         debtor_id=debtor_id,
         creditor_id=creditor_id,
@@ -303,6 +350,20 @@ def process_rejected_direct_transfer_signal(
     debtor_id: int,
     creditor_id: int
 ) -> None:
+    if current_app.config["APP_USE_PGPLSQL_FUNCTIONS"]:  # pragma: no cover
+        db.session.execute(
+            CALL_PROCESS_REJECTED_DIRECT_TRANSFER_SIGNAL,
+            {
+                "coordinator_id": coordinator_id,
+                "coordinator_request_id": coordinator_request_id,
+                "status_code": status_code,
+                "total_locked_amount": total_locked_amount,
+                "debtor_id": debtor_id,
+                "creditor_id": creditor_id,
+            },
+        )
+        return
+
     rt = _find_running_transfer(
         coordinator_id, coordinator_request_id, defer_toasted=True
     )
@@ -332,6 +393,21 @@ def process_prepared_direct_transfer_signal(
     locked_amount: int,
     recipient: str
 ) -> None:
+    if current_app.config["APP_USE_PGPLSQL_FUNCTIONS"]:  # pragma: no cover
+        db.session.execute(
+            CALL_PROCESS_PREPARED_DIRECT_TRANSFER_SIGNAL,
+            {
+                "debtor_id": debtor_id,
+                "creditor_id": creditor_id,
+                "transfer_id": transfer_id,
+                "coordinator_id": coordinator_id,
+                "coordinator_request_id": coordinator_request_id,
+                "locked_amount": locked_amount,
+                "recipient": recipient,
+            },
+        )
+        return
+
     def dismiss_prepared_transfer():
         db.session.add(
             FinalizeTransferSignal(
@@ -391,6 +467,22 @@ def process_finalized_direct_transfer_signal(
     status_code: str,
     total_locked_amount: int
 ) -> None:
+    if current_app.config["APP_USE_PGPLSQL_FUNCTIONS"]:  # pragma: no cover
+        db.session.execute(
+            CALL_PROCESS_FINALIZED_DIRECT_TRANSFER_SIGNAL,
+            {
+                "debtor_id": debtor_id,
+                "creditor_id": creditor_id,
+                "transfer_id": transfer_id,
+                "coordinator_id": coordinator_id,
+                "coordinator_request_id": coordinator_request_id,
+                "committed_amount": committed_amount,
+                "status_code": status_code,
+                "total_locked_amount": total_locked_amount,
+            },
+        )
+        return
+
     rt = _find_running_transfer(
         coordinator_id, coordinator_request_id, defer_toasted=True
     )
@@ -0,0 +1,128 @@
+"""Valid SMP messages of each type, shared by several test modules."""
+
+C_ID = 4294967296
+TS = "2019-10-01T00:00:00+00:00"
+
+VALID_MESSAGES = {
+    "RejectedConfig": {
+        "type": "RejectedConfig",
+        "debtor_id": -1,
+        "creditor_id": C_ID,
+        "config_ts": TS,
+        "config_seqnum": 123,
+        "negligible_amount": 100.0,
+        "config_data": "",
+        "config_flags": 0,
+        "rejection_code": "TEST_REJECTION",
+        "ts": TS,
+    },
+    "AccountUpdate": {
+        "type": "AccountUpdate",
+        "debtor_id": -1,
+        "creditor_id": C_ID,
+        "creation_date": "2019-01-01",
+        "last_change_ts": TS,
+        "last_change_seqnum": 1,
+        "principal": 1000,
+        "interest": 123.0,
+        "interest_rate": 7.5,
+        "last_interest_rate_change_ts": TS,
+        "last_config_ts": TS,
+        "last_config_seqnum": 1,
+        "negligible_amount": 100.0,
+        "config_flags": 0,
+        "config_data": "",
+        "account_id": str(C_ID),
+        "debtor_info_iri": "http://example.com",
+        "debtor_info_content_type": "text/plain",
+        "debtor_info_sha256": 32 * "FF",
+        "last_transfer_number": 5,
+        "last_transfer_committed_at": TS,
+        "demurrage_rate": -50.0,
+        "commit_period": 100000,
+        "transfer_note_max_bytes": 500,
+        "ts": TS,
+        "ttl": 10000,
+    },
+    "AccountPurge": {
+        "type": "AccountPurge",
+        "debtor_id": -1,
+        "creditor_id": C_ID,
+        "creation_date": "2001-01-01",
+        "ts": TS,
+    },
+    "AccountTransfer": {
+        "type": "AccountTransfer",
+        "debtor_id": -1,
+        "creditor_id": C_ID,
+        "creation_date": "2020-01-02",
+        "transfer_number": 1,
+        "coordinator_type": "direct",
+        "sender": "666",
+        "recipient": str(C_ID),
+        "acquired_amount": 1000,
+        "transfer_note_format": "json",
+        "transfer_note": '{"message": "test"}',
+        "committed_at": TS,
+        "principal": 1000,
+        "ts": TS,
+        "previous_transfer_number": 0,
+    },
+    "RejectedTransfer": {
+        "type": "RejectedTransfer",
+        "debtor_id": -1,
+        "creditor_id": C_ID,
+        "coordinator_type": "direct",
+        "coordinator_id": C_ID,
+        "coordinator_request_id": 1,
+        "status_code": "TEST",
+        "total_locked_amount": 0,
+        "ts": TS,
+    },
+    "PreparedTransfer": {
+        "type": "PreparedTransfer",
+        "debtor_id": -1,
+        "creditor_id": C_ID,
+        "transfer_id": 1,
+        "coordinator_type": "direct",
+        "coordinator_id": C_ID,
+        "coordinator_request_id": 1,
+        "locked_amount": 1000,
+        "recipient": "1111",
+        "prepared_at": TS,
+        "demurrage_rate": -50.0,
+        "deadline": TS,
+        "final_interest_rate_ts": TS,
+        "ts": TS,
+    },
+    "FinalizedTransfer": {
+        "type": "FinalizedTransfer",
+        "debtor_id": -1,
+        "creditor_id": C_ID,
+        "transfer_id": 123,
+        "coordinator_type": "direct",
+        "coordinator_id": C_ID,
+        "coordinator_request_id": 1,
+        "committed_amount": 100,
+        "status_code": "OK",
+        "total_locked_amount": 0,
+        "prepared_at": TS,
+        "ts": TS,
+    },
+    "ActivateCreditor": {
+        "type": "ActivateCreditor",
+        "creditor_id": C_ID,
+        "reservation_id": "test_id",
+        "ts": TS,
+    },
+    "ConfigureAccount": {
+        "type": "ConfigureAccount",
+        "debtor_id": -1,
+        "creditor_id": C_ID,
+        "ts": TS,
+        "seqnum": 123,
+        "negligible_amount": 3.14,
+        "config_flags": 3,
+        "config_data": "test",
+    },
+}
@@ -1,3 +1,4 @@
+import time
 from datetime import datetime, date, timezone
 import pytest
 from swpt_pythonlib.rabbitmq import MessageProperties
@@ -211,3 +212,442 @@ def test_consumer(db_session, actors):
         )
         is True
     )
+
+
+def _run_in_threads(app, target, args_list):
+    import threading
+
+    errors = []
+
+    def work(*args):
+        with app.app_context():
+            try:
+                target(*args)
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+
+    threads = [
+        threading.Thread(target=work, args=args, name=f"t{i}")
+        for i, args in enumerate(args_list)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+def test_consumer_batching(app, db_session, actors):
+    consumer = actors.SmpConsumer(batch_size=2, batch_wait=10.0)
+    props = MessageProperties(
+        content_type="application/json", type="AccountPurge"
+    )
+    body_template = """
+    {
+      "type": "AccountPurge",
+      "debtor_id": %i,
+      "creditor_id": 4294967296,
+      "creation_date": "2098-12-31",
+      "ts": "2099-12-31T00:00:00+00:00"
+    }
+    """
+    results = []
+
+    def process(debtor_id):
+        body = (body_template % debtor_id).encode("ascii")
+        results.append(consumer.process_message(body, props))
+
+    # The batch gets closed before `batch_wait` expires only when it
+    # is full, that is, when both messages have joined it.
+    started_at = time.monotonic()
+    _run_in_threads(app, process, [(1,), (2,)])
+    assert time.monotonic() - started_at < 5.0
+    assert results == [True, True]
+    stats = consumer.stats.snapshot()["types"]["AccountPurge"]
+    assert stats["processed"] == 2
+
+
+def test_actor_batcher(app, db_session):
+    import threading
+    from sqlalchemy import text
+    from swpt_creditors.extensions import db
+    from swpt_creditors.consumer_utils import ActorBatcher
+
+    lock = threading.Lock()
+    calls = []
+    failures = []
+
+    def actor(n, fail=False):
+        txid = db.session.execute(text("SELECT txid_current()")).scalar()
+        with lock:
+            calls.append((n, txid, threading.current_thread().name))
+            if fail and not failures:
+                failures.append(n)
+                raise RuntimeError
+
+    def run(n, fail=False):
+        try:
+            batcher.run(actor, {"n": n, "fail": fail})
+        finally:
+            db.session.remove()
+
+    batcher = ActorBatcher(max_size=2, max_wait=10.0)
+
+    # Both actors are executed in the same transaction.
+    _run_in_threads(app, run, [(0,), (1,)])
+    assert sorted(n for n, _, _ in calls) == [0, 1]
+    assert len({txid for _, txid, _ in calls}) == 1
+
+    # When the batch fails, each actor is replayed in a separate
+    # transaction, by the thread that has submitted it.
+    calls.clear()
+    _run_in_threads(app, run, [(0, True), (1, True)])
+    assert failures
+    assert len(calls) == 3
+    replays = calls[-2:]
+    assert sorted(n for n, _, _ in replays) == [0, 1]
+    assert all(name == f"t{n}" for n, _, name in replays)
+    assert replays[0][1] != replays[1][1]
+    assert {txid for _, txid, _ in replays}.isdisjoint(
+        txid for _, txid, _ in calls[:-2]
+    )
+
+
+def test_consumer_stats(db_session, actors):
+    consumer = actors.SmpConsumer(stats_period=0.0)
+    props = MessageProperties(
+        content_type="application/json", type="AccountPurge"
+    )
+    body = b"""
+    {
+      "type": "AccountPurge",
+      "debtor_id": 1,
+      "creditor_id": 4294967296,
+      "creation_date": "2098-12-31",
+      "ts": "2099-12-31T00:00:00+00:00"
+    }
+    """
+    assert consumer.process_message(body, props) is True
+    assert consumer.process_message(b"INVALID", props) is False
+    assert consumer.process_message(body, MessageProperties(
+        content_type="application/json", type="WrongType"
+    )) is False
+
+    snapshot = consumer.stats.snapshot()
+    stats = snapshot["types"]["AccountPurge"]
+    assert stats["processed"] == 1
+    assert stats["rejected"] == 1
+    assert stats["decode"]["count"] == 1
+    assert stats["validate"]["count"] == 1
+    assert stats["actor"]["count"] == 1
+    assert snapshot["types"]["UNKNOWN"]["rejected"] == 1
+
+
+def test_latency_histogram():
+    from swpt_creditors.consumer_utils import LatencyHistogram
+
+    h = LatencyHistogram()
+    assert h.percentile(99) == 0.0
+    for _ in range(98):
+        h.observe(0.003)
+    h.observe(0.2)
+    h.observe(20.0)
+
+    assert h.count == 100
+    assert h.percentile(50) == 0.005
+    assert h.percentile(99) == 0.25
+    assert h.percentile(100) == 20.0
+    summary = h.summary()
+    assert summary["count"] == 100
+    assert summary["max_ms"] == 20000.0
+
+
+def test_consumer_dispatching(db_session, actors, monkeypatch):
+    import threading
+
+    schema = actors._MESSAGE_TYPES["AccountPurge"][0]
+    threads = {}
+
+    def record_thread(debtor_id, creditor_id, **kwargs):
+        threads.setdefault(debtor_id, set()).add(threading.current_thread())
+
+    monkeypatch.setitem(
+        actors._MESSAGE_TYPES, "AccountPurge", (schema, record_thread)
+    )
+    consumer = actors.SmpConsumer(dispatch_threads=2)
+    props = MessageProperties(
+        content_type="application/json", type="AccountPurge"
+    )
+
+    # Choose two accounts that are assigned to different threads.
+    d1 = 1
+    d2 = next(
+        d for d in range(2, 100)
+        if hash((C_ID, d)) % 2 != hash((C_ID, d1)) % 2
+    )
+    for debtor_id in [d1, d2, d1, d2, d1]:
+        body = f"""
+        {{
+          "type": "AccountPurge",
+          "debtor_id": {debtor_id},
+          "creditor_id": {C_ID},
+          "creation_date": "2098-12-31",
+          "ts": "2099-12-31T00:00:00+00:00"
+        }}
+        """.encode("ascii")
+        assert consumer.process_message(body, props) is True
+
+    assert len(threads[d1]) == 1
+    assert len(threads[d2]) == 1
+    assert threads[d1] != threads[d2]
+    assert threading.current_thread() not in threads[d1] | threads[d2]
+
+
+def test_keyed_dispatcher(app):
+    import threading
+    from swpt_creditors.consumer_utils import KeyedDispatcher
+
+    def get_thread():
+        return threading.current_thread()
+
+    def fail():
+        raise ValueError
+
+    dispatcher = KeyedDispatcher(3, app)
+    thread = dispatcher.run((1, 2), get_thread)
+    assert thread is not threading.current_thread()
+    assert all(dispatcher.run((1, 2), get_thread) is thread for _ in range(5))
+    assert dispatcher.run((1, 2), lambda x, y=0: x + y, 1, y=2) == 3
+
+    with pytest.raises(ValueError):
+        dispatcher.run((1, 2), fail)
+
+
+def test_adaptive_concurrency_limiter():
+    from swpt_creditors.consumer_utils import AdaptiveConcurrencyLimiter
+
+    saturated = False
+    limiter = AdaptiveConcurrencyLimiter(
+        10, 0.5, period=1000.0, is_saturated=lambda: saturated
+    )
+    assert limiter.limit == 10
+    assert limiter.run(lambda x, y=0: x + y, 1, y=2) == 3
+
+    def adjust(avg_latency, peak):
+        limiter._window_count = 10
+        limiter._window_latency = 10 * avg_latency
+        limiter._window_peak = peak
+        limiter._adjust_limit()
+        return limiter.limit
+
+    assert adjust(0.01, 10) == 10
+    assert adjust(0.03, 10) == 7
+    assert adjust(0.015, 3) == 7
+    assert adjust(0.015, 7) == 8
+    saturated = True
+    assert adjust(0.01, 8) == 6
+    saturated = False
+    assert adjust(1.0, 6) == 4
+    assert adjust(1.0, 4) == 3
+    assert adjust(1.0, 3) == 2
+    assert adjust(1.0, 2) == 1
+    assert adjust(1.0, 1) == 1
+
+    with pytest.raises(ValueError):
+        limiter.run(_raise_value_error)
+    assert limiter._active == 0
+
+
+def _raise_value_error():
+    raise ValueError
+
+
+def test_superseded_filter():
+    from swpt_creditors.consumer_utils import SupersededFilter
+
+    f = SupersededFilter()
+    f.register("a", 1)
+    assert not f.is_superseded("a", 1)
+    f.register("a", 3)
+    f.register("a", 2)
+    assert f.is_superseded("a", 1)
+    assert f.is_superseded("a", 2)
+    assert not f.is_superseded("a", 3)
+    assert not f.is_superseded("b", 1)
+
+    f.release("a")
+    f.release("a")
+    assert f.is_superseded("a", 1)
+    f.release("a")
+    assert not f.is_superseded("a", 1)
+
+
+def test_skip_cache():
+    from swpt_creditors.consumer_utils import SkipCache
+
+    c = SkipCache(2)
+    c.add("a")
+    c.add("b")
+    assert "a" in c
+    c.add("c")
+    assert len(c) == 2
+    assert "a" in c
+    assert "b" not in c
+    assert "c" in c
+
+
+def test_get_skip_key(actors):
+    key = actors._get_skip_key(
+        "AccountTransfer",
+        {
+            "creditor_id": C_ID,
+            "debtor_id": D_ID,
+            "creation_date": date(2020, 1, 1),
+            "transfer_number": 1,
+            "ts": datetime(2020, 1, 1, tzinfo=timezone.utc),
+        },
+    )
+    assert key == ("AccountTransfer", C_ID, D_ID, date(2020, 1, 1), 1)
+    assert actors._get_skip_key("PreparedTransfer", {}) is None
+
+
+def test_consumer_skips_duplicates(db_session, actors):
+    import json
+    from tests.smp_messages import VALID_MESSAGES
+
+    consumer = actors.SmpConsumer(skip_cache_size=10)
+    props = MessageProperties(
+        content_type="application/json", type="RejectedTransfer"
+    )
+    body = json.dumps(VALID_MESSAGES["RejectedTransfer"]).encode("utf8")
+    assert consumer.process_message(body, props) is True
+    assert consumer.process_message(body, props) is True
+
+    stats = consumer.stats.snapshot()["types"]["RejectedTransfer"]
+    assert stats["processed"] == 1
+    assert stats["duplicate"] == 1
+    assert stats["validate"]["count"] == 2
+
+    # Invalid messages are rejected, even if they look like duplicates.
+    body = json.dumps(
+        {**VALID_MESSAGES["RejectedTransfer"], "status_code": None}
+    ).encode("utf8")
+    assert consumer.process_message(body, props) is False
+    stats = consumer.stats.snapshot()["types"]["RejectedTransfer"]
+    assert stats["duplicate"] == 1
+    assert stats["rejected"] == 1
+
+
+def test_consumer_drops_superseded_updates(db_session, actors):
+    consumer = actors.SmpConsumer(
+        drop_superseded=True, batch_size=2, batch_wait=0.0
+    )
+    calls = []
+    order = actors._get_account_update_order(
+        {
+            "creation_date": date(2020, 1, 1),
+            "last_change_ts": datetime(2020, 1, 1, tzinfo=timezone.utc),
+            "last_change_seqnum": 1,
+            "ts": datetime(2020, 1, 1, tzinfo=timezone.utc),
+        }
+    )
+    newer_order = actors._get_account_update_order(
+        {
+            "creation_date": date(2020, 1, 1),
+            "last_change_ts": datetime(2020, 1, 1, tzinfo=timezone.utc),
+            "last_change_seqnum": 2,
+            "ts": datetime(2020, 1, 1, tzinfo=timezone.utc),
+        }
+    )
+    assert consumer.stats is not None
+    superseded_filter = consumer._superseded_filter
+    superseded_filter.register((C_ID, D_ID), order)
+    actor = consumer._skip_if_superseded(
+        lambda **kwargs: calls.append(kwargs), (C_ID, D_ID), order
+    )
+    actor(x=1)
+    assert calls == [{"x": 1}]
+
+    superseded_filter.register((C_ID, D_ID), newer_order)
+    actor(x=2)
+    assert calls == [{"x": 1}]
+    assert consumer.stats.snapshot()["types"]["AccountUpdate"][
+        "superseded"
+    ] == 1
+
+
+def test_consumer_counts_superseded_updates(db_session, actors):
+    import json
+    from tests.smp_messages import VALID_MESSAGES
+
+    consumer = actors.SmpConsumer(drop_superseded=True)
+    assert consumer.stats is not None
+    assert consumer._superseded_filter is None
+
+    consumer = actors.SmpConsumer(drop_superseded=True, dispatch_threads=1)
+    assert consumer.stats is not None
+    message = {
+        **VALID_MESSAGES["AccountUpdate"],
+        "ts": datetime.now(tz=timezone.utc).isoformat(),
+    }
+    newer_order = actors._get_account_update_order(
+        {
+            "creation_date": date(2099, 1, 1),
+            "last_change_ts": datetime(2099, 1, 1, tzinfo=timezone.utc),
+            "last_change_seqnum": 1,
+            "ts": datetime(2099, 1, 1, tzinfo=timezone.utc),
+        }
+    )
+    account_key = (message["creditor_id"], message["debtor_id"])
+    consumer._superseded_filter.register(account_key, newer_order)
+    props = MessageProperties(
+        content_type="application/json", type="AccountUpdate"
+    )
+    body = json.dumps(message).encode("utf8")
+    assert consumer.process_message(body, props) is True
+
+    stats = consumer.stats.snapshot()["types"]["AccountUpdate"]
+    assert stats["superseded"] == 1
+    assert "processed" not in stats
+    assert "actor" not in stats
+
+
+def test_consumer_drops_expired_messages(db_session, actors):
+    import json
+    from tests.smp_messages import VALID_MESSAGES
+
+    consumer = actors.SmpConsumer()
+    props = MessageProperties(
+        content_type="application/json", type="AccountTransfer"
+    )
+
+    # This message is expired, and will be dropped after the
+    # validation, without calling the actor.
+    body = json.dumps(VALID_MESSAGES["AccountTransfer"]).encode("utf8")
+    assert consumer.process_message(body, props) is True
+    stats = consumer.stats.snapshot()["types"]["AccountTransfer"]
+    assert stats["expired"] == 1
+    assert stats["validate"]["count"] == 1
+    assert "actor" not in stats
+
+    # This message looks expired, but is invalid, and will be
+    # rejected.
+    body = json.dumps(
+        {**VALID_MESSAGES["AccountTransfer"], "principal": "INVALID"}
+    ).encode("utf8")
+    assert consumer.process_message(body, props) is False
+    stats = consumer.stats.snapshot()["types"]["AccountTransfer"]
+    assert stats["expired"] == 1
+    assert stats["rejected"] == 1
+
+
+def test_expiration_checks(app, actors):
+    now = datetime.now(tz=timezone.utc)
+    old = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    is_update_expired = actors._is_account_update_expired
+    is_transfer_expired = actors._is_account_transfer_expired
+
+    assert is_update_expired({"ts": old, "ttl": 1})
+    assert not is_update_expired({"ts": now, "ttl": 10000})
+    assert is_transfer_expired({"ts": now, "committed_at": old})
+    assert not is_transfer_expired({"ts": now, "committed_at": now})
@@ -0,0 +1,160 @@
+import json
+import asyncio
+import pytest
+import psycopg.errors
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from swpt_creditors.actors import _MESSAGE_TYPES
+from swpt_creditors.async_consumer import (
+    _STORED_PROCEDURE_CALLS,
+    AsyncSmpConsumer,
+    MAX_RETRIES,
+)
+from tests.smp_messages import VALID_MESSAGES
+
+
+class _Message:
+    """Imitates an incoming `aio_pika` message."""
+
+    def __init__(self, data: dict):
+        self.type = data["type"]
+        self.content_type = "application/json"
+        self.body = json.dumps(data).encode("utf8")
+        self.outcome = None
+
+    async def ack(self):
+        self.outcome = "ack"
+
+    async def reject(self, requeue):
+        self.outcome = "requeue" if requeue else "reject"
+
+    async def nack(self, requeue):
+        self.outcome = "requeue" if requeue else "reject"
+
+
+class _Connection:
+    def __init__(self):
+        self.statements = []
+
+    async def execute(self, statement, params):
+        self.statements.append((statement, params))
+
+
+class _Engine:
+    """Imitates an async engine, which fails `failures` times."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.transactions = 0
+        self.connection = _Connection()
+
+    @asynccontextmanager
+    async def begin(self):
+        self.transactions += 1
+        if self.failures > 0:
+            self.failures -= 1
+            raise OperationalError(
+                "SELECT", {}, psycopg.errors.SerializationFailure()
+            )
+        yield self.connection
+
+
+def _create_consumer(app):
+    consumer = AsyncSmpConsumer(
+        app,
+        url="amqp://localhost",
+        queue="test",
+        prefetch_count=1,
+        threads=1,
+        db_connections=1,
+    )
+    consumer._executor = ThreadPoolExecutor(max_workers=1)
+    return consumer
+
+
+@pytest.mark.parametrize("message_type", list(_STORED_PROCEDURE_CALLS))
+def test_stored_procedure_params(app, message_type):
+    statement, get_params = _STORED_PROCEDURE_CALLS[message_type]
+    schema = _MESSAGE_TYPES[message_type][0]
+    content = schema.load(VALID_MESSAGES[message_type])
+    params = get_params(content, app.config)
+    assert set(params) == set(statement._bindparams)
+    for name, value in params.items():
+        if name in content and name not in [
+                "debtor_info_iri",
+                "debtor_info_content_type",
+                "debtor_info_sha256",
+        ]:
+            assert value == content[name]
+
+
+def test_process_message(app, db_session):
+    consumer = _create_consumer(app)
+    try:
+        purge = _Message(
+            {
+                "type": "AccountPurge",
+                "debtor_id": 1,
+                "creditor_id": 4294967296,
+                "creation_date": "2098-12-31",
+                "ts": "2099-12-31T00:00:00+00:00",
+            }
+        )
+        asyncio.run(consumer._process_message(purge))
+        assert purge.outcome == "ack"
+
+        invalid = _Message({"type": "AccountPurge"})
+        asyncio.run(consumer._process_message(invalid))
+        assert invalid.outcome == "reject"
+        assert not consumer._failed
+
+        # The agent is not responsible for this creditor.
+        alien = _Message(
+            {**VALID_MESSAGES["RejectedTransfer"], "creditor_id": 1}
+        )
+        asyncio.run(consumer._process_message(alien))
+        assert alien.outcome == "requeue"
+        assert consumer._failed
+    finally:
+        consumer._executor.shutdown()
+
+    stats = consumer.stats.snapshot()["types"]["AccountPurge"]
+    assert stats["processed"] == 1
+    assert stats["rejected"] == 1
+
+
+def test_process_message_with_stored_procedure(app):
+    consumer = _create_consumer(app)
+    consumer._stored_procedure_calls = _STORED_PROCEDURE_CALLS
+    consumer._engine = _Engine(failures=1)
+    try:
+        message = _Message(VALID_MESSAGES["RejectedTransfer"])
+        asyncio.run(consumer._process_message(message))
+    finally:
+        consumer._executor.shutdown()
+
+    assert message.outcome == "ack"
+    assert consumer._engine.transactions == 2
+    [(statement, params)] = consumer._engine.connection.statements
+    assert statement is _STORED_PROCEDURE_CALLS["RejectedTransfer"][0]
+    assert params["coordinator_request_id"] == (
+        VALID_MESSAGES["RejectedTransfer"]["coordinator_request_id"]
+    )
+    stats = consumer.stats.snapshot()["types"]["RejectedTransfer"]
+    assert stats["processed"] == 1
+
+
+def test_call_stored_procedure_gives_up(app):
+    consumer = _create_consumer(app)
+    consumer._engine = _Engine(failures=MAX_RETRIES + 1)
+    try:
+        with pytest.raises(OperationalError):
+            asyncio.run(
+                consumer._call_stored_procedure(text("SELECT 1"), {})
+            )
+    finally:
+        consumer._executor.shutdown()
+
+    assert consumer._engine.transactions == MAX_RETRIES + 1
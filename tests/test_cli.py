@@ -1,3 +1,4 @@
+import json
 import pytest
 import sqlalchemy
 from unittest.mock import Mock
@@ -6,6 +7,7 @@ from swpt_creditors.extensions import db
 from swpt_creditors import procedures as p
 from swpt_creditors import models as m
 from swpt_pythonlib.utils import ShardingRealm
+from swpt_creditors.message_capture import read_messages
 
 D_ID = -1
 C_ID = 4294967296
@@ -129,6 +131,79 @@ def test_consume_messages(app):
     )
     assert result.exit_code == 1
 
+    result = runner.invoke(
+        args=["swpt_creditors", "consume_messages", "--transfers"]
+    )
+    assert result.exit_code == 2
+
+
+def test_record_and_replay_messages(app, db_session, current_ts, tmp_path):
+    _create_new_creditor(C_ID, activate=True)
+    p.create_new_account(C_ID, D_ID)
+    p.process_account_update_signal(
+        debtor_id=D_ID,
+        creditor_id=C_ID,
+        creation_date=date(2020, 1, 1),
+        last_change_ts=current_ts,
+        last_change_seqnum=1,
+        principal=1000,
+        interest=0.0,
+        interest_rate=5.0,
+        last_interest_rate_change_ts=current_ts,
+        transfer_note_max_bytes=500,
+        last_config_ts=current_ts,
+        last_config_seqnum=1,
+        negligible_amount=0.0,
+        config_flags=0,
+        config_data="",
+        account_id=str(C_ID),
+        debtor_info_iri="http://example.com",
+        debtor_info_content_type=None,
+        debtor_info_sha256=None,
+        last_transfer_number=0,
+        last_transfer_committed_at=current_ts,
+        ts=current_ts,
+        ttl=100000,
+    )
+    db_session.commit()
+
+    filename = str(tmp_path / "messages.gz")
+    runner = app.test_cli_runner()
+    result = runner.invoke(
+        args=["swpt_creditors", "record_messages", "--count=5", filename]
+    )
+    assert result.exit_code != 0
+
+    result = runner.invoke(
+        args=[
+            "swpt_creditors",
+            "record_messages",
+            "--synthetic",
+            "--count=5",
+            filename,
+        ]
+    )
+    assert result.exit_code == 0
+    assert "5 messages" in result.output
+    messages = list(read_messages(filename))
+    assert len(messages) == 5
+    assert messages[0].headers == {
+        "message-type": "AccountUpdate",
+        "debtor-id": D_ID,
+        "creditor-id": C_ID,
+    }
+    assert messages[0].delivery_mode == 2
+
+    result = runner.invoke(
+        args=["swpt_creditors", "replay_messages", "--threads=2", filename]
+    )
+    assert result.exit_code == 0
+    report = json.loads(result.output)
+    assert report["messages"] == 5
+    stats = report["types"]["AccountUpdate"]
+    assert stats["processed"] == 5
+    assert stats["latency"]["count"] == 5
+
 
 def test_scan_creditors(app, db_session, current_ts):
     _create_new_creditor(C_ID + 1, activate=False)
@@ -522,6 +597,77 @@ def test_flush_messages(mocker, app, db_session):
     assert len(m.FinalizeTransferSignal.query.all()) == 0
 
 
+def test_flush_messages_invalid_worker_index(app):
+    runner = app.test_cli_runner()
+    result = runner.invoke(
+        args=[
+            "swpt_creditors",
+            "flush_messages",
+            "--worker-count",
+            "2",
+            "--worker-index",
+            "2",
+        ]
+    )
+    assert result.exit_code == 2
+
+
+def test_notify_triggers(app, db_session):
+    def get_trigger_state():
+        state = db.session.execute(
+            sqlalchemy.text(
+                "SELECT tgenabled FROM pg_trigger "
+                "WHERE tgname = 'finalize_transfer_signal_notify'"
+            )
+        ).scalar()
+        db.session.commit()
+        return state
+
+    orig_state = get_trigger_state()
+    runner = app.test_cli_runner()
+    try:
+        result = runner.invoke(
+            args=[
+                "swpt_creditors",
+                "notify_triggers",
+                "FinalizeTransferSignal",
+            ]
+        )
+        assert result.exit_code == 0
+        assert get_trigger_state() == "O"
+
+        result = runner.invoke(
+            args=[
+                "swpt_creditors",
+                "notify_triggers",
+                "--disable",
+                "FinalizeTransferSignal",
+            ]
+        )
+        assert result.exit_code == 0
+        assert get_trigger_state() == "D"
+    finally:
+        runner.invoke(
+            args=[
+                "swpt_creditors",
+                "notify_triggers",
+                "--enable" if orig_state != "D" else "--disable",
+                "FinalizeTransferSignal",
+            ]
+        )
+
+
+def test_outbox_stats(app, db_session):
+    runner = app.test_cli_runner()
+    result = runner.invoke(
+        args=["swpt_creditors", "outbox_stats", "FinalizeTransferSignal"]
+    )
+    assert result.exit_code == 0
+    stats = json.loads(result.output)
+    assert stats["finalize_transfer_signal"]["backlog"] >= 0
+    assert stats["finalize_transfer_signal"]["max_age"] == 0.0
+
+
 @pytest.mark.parametrize("realm", ["0.#", "1.#"])
 def test_verify_shard_content(app, db_session, realm):
     orig_sharding_realm = app.config["SHARDING_REALM"]
@@ -548,3 +694,77 @@ def test_alembic_current_head(app, request, capfd):
     assert result.exit_code == 0
     captured = capfd.readouterr()
     assert captured.out.strip().endswith(" (head)")
+
+
+def test_transfers_split_routing():
+    from swpt_pythonlib import rabbitmq
+    from swpt_creditors import cli
+    from swpt_creditors.extensions import (
+        CREDITORS_IN_EXCHANGE,
+        CA_CREDITORS_EXCHANGE,
+    )
+    from swpt_creditors.inmemory_broker import InMemoryBroker, InMemoryChannel
+
+    broker = InMemoryBroker()
+    channel = InMemoryChannel(broker)
+
+    # Shard "a" has a separate queue for transfer messages, but shard
+    # "b" does not.
+    cli._bind_queue(channel, CA_CREDITORS_EXCHANGE, "a", "0.#")
+    cli._bind_queue(channel, CA_CREDITORS_EXCHANGE, "b", "1.#")
+    cli._route_directly(channel)
+    cli._route_through_split_exchange(channel)
+    cli._bind_queue(channel, cli.CA_TRANSFERS_EXCHANGE, "a.transfers", "0.#")
+
+    def publish_messages():
+        for routing_key in ["0.1", "1.1"]:
+            for message_type in ["AccountUpdate", "FinalizedTransfer"]:
+                broker.publish(
+                    rabbitmq.Message(
+                        exchange=CREDITORS_IN_EXCHANGE,
+                        routing_key=routing_key,
+                        body=b"{}",
+                        properties=rabbitmq.MessageProperties(
+                            type=message_type,
+                            headers={
+                                "message-type": message_type,
+                                "ca-creditors": True,
+                            },
+                        ),
+                    )
+                )
+
+    def get_received_types():
+        return {
+            queue: sorted(
+                broker.get(queue).properties.type
+                for _ in range(broker.message_count(queue))
+            )
+            for queue in ["a", "a.transfers", "b"]
+        }
+
+    publish_messages()
+    assert get_received_types() == {
+        "a": ["AccountUpdate"],
+        "a.transfers": ["FinalizedTransfer"],
+        "b": ["AccountUpdate", "FinalizedTransfer"],
+    }
+
+    # Subscribing again does not cause duplicated messages.
+    cli._route_through_split_exchange(channel)
+    publish_messages()
+    assert get_received_types() == {
+        "a": ["AccountUpdate"],
+        "a.transfers": ["FinalizedTransfer"],
+        "b": ["AccountUpdate", "FinalizedTransfer"],
+    }
+
+    # Unsubscribing the transfers queue restores the direct routing.
+    broker.unbind("a.transfers", cli.CA_TRANSFERS_EXCHANGE, "0.#")
+    cli._route_directly(channel, delete_split_exchange=True)
+    publish_messages()
+    assert get_received_types() == {
+        "a": ["AccountUpdate", "FinalizedTransfer"],
+        "a.transfers": [],
+        "b": ["AccountUpdate", "FinalizedTransfer"],
+    }
@@ -0,0 +1,161 @@
+import logging
+import pytest
+from datetime import datetime, timezone
+from sqlalchemy import text
+from swpt_creditors import models as m
+from swpt_creditors.extensions import db
+from swpt_creditors.flush_utils import (
+    SignalListener,
+    FlushStats,
+    flush_signals,
+    get_outbox_stats,
+    set_notify_triggers,
+)
+
+D_ID = -1
+C_ID = 4294967296
+
+
+def get_trigger_state(table):
+    state = db.session.execute(
+        text("SELECT tgenabled FROM pg_trigger WHERE tgname = :tgname"),
+        {"tgname": f"{table}_notify"},
+    ).scalar()
+    db.session.commit()
+    return state
+
+
+@pytest.fixture
+def notify_trigger(db_session):
+    table = "configure_account_signal"
+    enabled = get_trigger_state(table) != "D"
+    yield table
+    set_notify_triggers([table], enabled)
+
+
+def test_set_notify_triggers(notify_trigger):
+    set_notify_triggers([notify_trigger], True)
+    assert get_trigger_state(notify_trigger) == "O"
+    set_notify_triggers([notify_trigger], False)
+    assert get_trigger_state(notify_trigger) == "D"
+
+
+def test_signal_listener_warns_about_disabled_trigger(
+    notify_trigger, caplog
+):
+    set_notify_triggers([notify_trigger], False)
+    listener = SignalListener(db.engine, [notify_trigger])
+    try:
+        with caplog.at_level(logging.WARNING):
+            assert listener.wait(0.0) == {notify_trigger}
+        assert f'"{notify_trigger}_notify" trigger is disabled' in caplog.text
+    finally:
+        listener.close()
+
+
+def test_signal_listener(notify_trigger):
+    set_notify_triggers([notify_trigger], True)
+    listener = SignalListener(db.engine, [notify_trigger])
+    try:
+        assert listener.wait(0.0) == {"configure_account_signal"}
+        assert listener.wait(0.0) == set()
+
+        db.session.add(
+            m.ConfigureAccountSignal(
+                creditor_id=C_ID,
+                debtor_id=D_ID,
+                ts=datetime.now(tz=timezone.utc),
+                seqnum=0,
+                negligible_amount=0.0,
+                config_flags=0,
+            )
+        )
+        db.session.commit()
+        notified = listener.wait(5.0, debounce=0.01)
+        assert notified == {"configure_account_signal"}
+        assert listener.wait(0.0) == set()
+
+        db.session.add(
+            m.UpdatedFlagsSignal(
+                creditor_id=C_ID,
+                debtor_id=D_ID,
+                update_id=1,
+                config_flags=0,
+                ts=datetime.now(tz=timezone.utc),
+            )
+        )
+        db.session.commit()
+        assert listener.wait(0.2) == set()
+    finally:
+        listener.close()
+
+
+def test_flush_signals(mocker, db_session):
+    send_signalbus_messages = mocker.patch(
+        "swpt_creditors.models.UpdatedFlagsSignal.send_signalbus_messages"
+    )
+    for creditor_id in [C_ID, C_ID + 1, C_ID + 2, -C_ID - 1]:
+        db.session.add(
+            m.UpdatedFlagsSignal(
+                creditor_id=creditor_id,
+                debtor_id=D_ID,
+                update_id=1,
+                config_flags=0,
+                ts=datetime.now(tz=timezone.utc),
+            )
+        )
+    db.session.commit()
+
+    assert flush_signals(m.UpdatedFlagsSignal, 1, 2) == 2
+    sent = send_signalbus_messages.call_args[0][0]
+    assert sorted(s.creditor_id for s in sent) == [-C_ID - 1, C_ID + 1]
+    assert sorted(
+        s.creditor_id for s in m.UpdatedFlagsSignal.query.all()
+    ) == [C_ID, C_ID + 2]
+
+    stats = FlushStats(0.0)
+    assert flush_signals(m.UpdatedFlagsSignal, 1, 2, stats) == 0
+    assert flush_signals(m.UpdatedFlagsSignal, 0, 2, stats) == 2
+    assert m.UpdatedFlagsSignal.query.all() == []
+
+    table_stats = stats.snapshot()["tables"]["updated_flags_signal"]
+    assert table_stats["flushed"] == 2
+    assert table_stats["bursts"] == 1
+    assert table_stats["max_age"] >= 0.0
+
+
+def test_flush_stats():
+    stats = FlushStats(0.0)
+    stats.record("t1", 10, 1.5)
+    stats.record("t1", 5, 0.5)
+    stats.record("t2", 1, 0.0)
+    snapshot = stats.snapshot(reset=True)
+    assert snapshot["tables"] == {
+        "t1": {"flushed": 15, "bursts": 2, "max_age": 1.5},
+        "t2": {"flushed": 1, "bursts": 1, "max_age": 0.0},
+    }
+    assert stats.snapshot()["tables"] == {}
+
+
+def test_get_outbox_stats(db_session):
+    db.session.add(
+        m.UpdatedFlagsSignal(
+            creditor_id=C_ID,
+            debtor_id=D_ID,
+            update_id=1,
+            config_flags=0,
+            ts=datetime.now(tz=timezone.utc),
+        )
+    )
+    db.session.commit()
+
+    stats = get_outbox_stats(
+        [m.UpdatedFlagsSignal, m.ConfigureAccountSignal], period=0.01
+    )
+    assert stats["updated_flags_signal"]["max_age"] >= 0.0
+    assert stats["configure_account_signal"]["max_age"] == 0.0
+    for table_stats in stats.values():
+        assert table_stats["backlog"] >= 0
+        assert table_stats["inserted"] >= 0
+        assert table_stats["flushed"] >= 0
+        assert "flushed_per_sec" in table_stats
@@ -0,0 +1,90 @@
+import json
+import pytest
+from datetime import datetime, timezone
+from swpt_pythonlib import rabbitmq
+from swpt_creditors import models as m
+from swpt_creditors.extensions import (
+    db,
+    CREDITORS_IN_EXCHANGE,
+    CREDITORS_OUT_EXCHANGE,
+)
+from swpt_creditors.flush_utils import flush_signals
+from swpt_creditors.inmemory_broker import (
+    InMemoryBroker,
+    UnroutableMessage,
+    publishing_to,
+)
+from tests.smp_messages import VALID_MESSAGES
+
+C_ID = 4294967296
+
+
+def _create_message(exchange, routing_key, data, mandatory=False):
+    return rabbitmq.Message(
+        exchange=exchange,
+        routing_key=routing_key,
+        body=json.dumps(data).encode("utf8"),
+        properties=rabbitmq.MessageProperties(
+            content_type="application/json", type=data["type"]
+        ),
+        mandatory=mandatory,
+    )
+
+
+def test_routing():
+    broker = InMemoryBroker()
+    broker.bind("q1", "e1", "0.1.#")
+    broker.bind("q2", "e1", "*.1")
+    broker.bind("q3", "e2")
+    data = {"type": "Test"}
+
+    broker.publish(_create_message("e1", "0.1", data))
+    broker.publish(_create_message("e1", "0.1.0.1", data))
+    broker.publish(_create_message("e1", "1.1", data))
+    broker.publish(_create_message("e1", "1.0", data))
+    broker.publish(_create_message("e2", "whatever", data))
+    assert broker.message_count("q1") == 2
+    assert broker.message_count("q2") == 2
+    assert broker.message_count("q3") == 1
+
+    with pytest.raises(UnroutableMessage):
+        broker.publish(_create_message("e1", "1.0", data, mandatory=True))
+
+
+def test_pipeline(app, db_session):
+    from swpt_creditors.actors import SmpConsumer
+
+    broker = InMemoryBroker()
+    broker.bind("swpt_creditors", CREDITORS_IN_EXCHANGE)
+    broker.bind("accounts", CREDITORS_OUT_EXCHANGE)
+
+    # An `AccountUpdate` for an unknown account should result in a
+    # `ConfigureAccount` message which schedules the account for
+    # deletion.
+    update = {
+        **VALID_MESSAGES["AccountUpdate"],
+        "ts": datetime.now(tz=timezone.utc).isoformat(),
+    }
+    broker.publish(_create_message(CREDITORS_IN_EXCHANGE, "", update))
+    broker.publish(
+        _create_message(CREDITORS_IN_EXCHANGE, "", {"type": "AccountPurge"})
+    )
+    result = broker.consume(
+        SmpConsumer(), "swpt_creditors", app=app, threads=2
+    )
+    assert result.acked == 1
+    assert result.rejected == 1
+    assert broker.message_count("swpt_creditors") == 0
+    assert len(broker.dead_letters("swpt_creditors")) == 1
+    assert len(m.ConfigureAccountSignal.query.all()) == 1
+
+    with publishing_to(broker):
+        assert flush_signals(m.ConfigureAccountSignal) == 1
+
+    assert len(m.ConfigureAccountSignal.query.all()) == 0
+    message = broker.get("accounts")
+    assert message.properties.type == "ConfigureAccount"
+    data = json.loads(message.body)
+    assert data["creditor_id"] == C_ID
+    assert data["debtor_id"] == update["debtor_id"]
+    db.session.close()
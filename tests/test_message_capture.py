@@ -0,0 +1,43 @@
+from swpt_pythonlib.rabbitmq import MessageProperties
+from swpt_creditors.message_capture import (
+    CapturedMessage,
+    write_messages,
+    read_messages,
+)
+
+
+def test_write_and_read_messages(tmp_path):
+    properties = MessageProperties(
+        content_type="application/json",
+        type="AccountPurge",
+        headers={
+            "message-type": "AccountPurge",
+            "debtor-id": -1,
+            "creditor-id": 4294967296,
+        },
+        delivery_mode=2,
+        message_id="123",
+        timestamp=1700000000,
+        app_id="swpt_accounts",
+    )
+    messages = [
+        CapturedMessage.from_properties(properties, b"{}"),
+        CapturedMessage(type=None, content_type=None, body=b"\x00\xff"),
+    ]
+    filename = str(tmp_path / "messages.gz")
+    assert write_messages(filename, messages) == 2
+    assert list(read_messages(filename)) == messages
+
+    replayed = messages[0].get_properties()
+    for field in [
+        "content_type",
+        "type",
+        "headers",
+        "delivery_mode",
+        "message_id",
+        "timestamp",
+        "app_id",
+    ]:
+        assert getattr(replayed, field) == getattr(properties, field)
+
+    assert replayed.correlation_id is None
@@ -0,0 +1,132 @@
+import json
+import math
+import pytest
+from marshmallow import ValidationError
+from swpt_creditors.message_codecs import (
+    parse_json,
+    compile_schema,
+    get_body_parser,
+    encode_body,
+    is_supported_content_type,
+    CT_JSON,
+    CT_MSGPACK,
+    CT_CBOR,
+)
+from tests.smp_messages import VALID_MESSAGES, TS
+
+REPLACEMENT_VALUES = [
+    None,
+    True,
+    0,
+    1,
+    -1,
+    1.0,
+    1.5,
+    float("nan"),
+    float("inf"),
+    2**63,
+    -(2**63) - 1,
+    2**80,
+    "",
+    "1",
+    "x" * 3000,
+    "2019-10-01",
+    TS,
+    "2019-10-01T00:00:00",
+    "INVALID",
+    [],
+    {},
+]
+
+
+def _generate_variants(message_type, message):
+    yield message
+    yield {**message, "unknown_field": 1}
+    yield {**message, "type": "WrongType"}
+    yield [message]
+    yield "not an object"
+    for key in message:
+        yield {k: v for k, v in message.items() if k != key}
+        for value in REPLACEMENT_VALUES:
+            yield {**message, key: value}
+
+
+def _load(load, data):
+    try:
+        return "OK", load(data)
+    except ValidationError as e:
+        return "ERROR", e.messages
+
+
+@pytest.mark.parametrize("message_type", list(VALID_MESSAGES))
+def test_compiled_schema_matches_marshmallow(message_type):
+    from swpt_creditors.actors import _MESSAGE_TYPES
+
+    schema = _MESSAGE_TYPES[message_type][0]
+    compiled_load = compile_schema(schema)
+    accepted = 0
+
+    for data in _generate_variants(
+        message_type, VALID_MESSAGES[message_type]
+    ):
+        expected = _load(schema.load, data)
+        assert _load(compiled_load, data) == expected
+        if expected[0] == "OK":
+            accepted += 1
+
+    # Make sure that the test is not vacuous.
+    assert accepted > 1
+
+
+def test_parse_json():
+    for body in [
+        b'{"a": 1, "b": [1.5, "x", null, true]}',
+        b'{"a": 1, "a": 2}',
+        b'{"big": 123456789012345678901234567890}',
+        b"[9223372036854775807, -9223372036854775808, -9999999999999999999]",
+        b"[1e400, 0.1]",
+        '{"s": "ж"}'.encode("utf8"),
+        b'"\\ud800"',
+    ]:
+        assert parse_json(body) == json.loads(body.decode("utf8"))
+
+    assert math.isnan(parse_json(b"NaN"))
+
+    for body in [b"", b"{", b"[1,]", b"\xff\xfe", b'{"a": 1} x']:
+        with pytest.raises((UnicodeError, json.JSONDecodeError)):
+            parse_json(body)
+
+
+@pytest.mark.parametrize("content_type", [CT_JSON, CT_MSGPACK, CT_CBOR])
+def test_encode_and_parse_body(content_type):
+    if content_type == CT_MSGPACK:
+        pytest.importorskip("msgpack")
+    if content_type == CT_CBOR:
+        pytest.importorskip("cbor2")
+
+    assert is_supported_content_type(content_type)
+    for fast in [False, True]:
+        parse = get_body_parser(content_type, fast)
+        for data in VALID_MESSAGES.values():
+            assert parse(encode_body(data, content_type)) == data
+
+        for body in [b"", b"\xc1", b"\xff\xfe\xfd"]:
+            with pytest.raises(ValueError):
+                parse(body)
+
+
+def test_unsupported_content_type():
+    assert get_body_parser("text/plain") is None
+    assert get_body_parser(None) is None
+    assert not is_supported_content_type("text/plain")
+    with pytest.raises(RuntimeError):
+        encode_body({}, "text/plain")
+
+    from swpt_creditors import create_app
+
+    with pytest.raises(RuntimeError, match="PROTOCOL_BROKER_CONTENT_TYPE"):
+        create_app({"PROTOCOL_BROKER_CONTENT_TYPE": "text/plain"})
+
+    assert encode_body({"a": "ж", "b": 1.5}, CT_JSON) == (
+        '{"a":"ж","b":1.5}'.encode("utf8")
+    )
@@ -1,3 +1,5 @@
+import time
+import pytest
 from datetime import datetime, timezone, timedelta
 from swpt_creditors import models as m
 
@@ -12,6 +14,13 @@ def test_sibnalbus_burst_count(app):
     assert isinstance(m.UpdatedPolicySignal.signalbus_burst_count, int)
     assert isinstance(m.UpdatedFlagsSignal.signalbus_burst_count, int)
     assert isinstance(m.RejectedConfigSignal.signalbus_burst_count, int)
+    assert isinstance(m.ConfigureAccountSignal.signalbus_flush_period, float)
+    assert isinstance(m.PrepareTransferSignal.signalbus_flush_period, float)
+    assert isinstance(m.FinalizeTransferSignal.signalbus_flush_period, float)
+    assert isinstance(m.UpdatedLedgerSignal.signalbus_flush_period, float)
+    assert isinstance(m.UpdatedPolicySignal.signalbus_flush_period, float)
+    assert isinstance(m.UpdatedFlagsSignal.signalbus_flush_period, float)
+    assert isinstance(m.RejectedConfigSignal.signalbus_flush_period, float)
 
 
 def test_account_data(db_session):
@@ -186,3 +195,212 @@ def test_log_entry_tuple_size(db_session, current_ts):
     toast_tuple_target = 200
     some_extra_bytes = 40
     assert tuple_byte_size + some_extra_bytes <= toast_tuple_target
+
+
+def _create_signals():
+    current_ts = datetime.now(tz=timezone.utc)
+    return [
+        m.ConfigureAccountSignal(
+            creditor_id=1,
+            debtor_id=-2,
+            ts=current_ts,
+            seqnum=3,
+            negligible_amount=1e30,
+            config_data="ж",
+            config_flags=0,
+        ),
+        m.PrepareTransferSignal(
+            creditor_id=1,
+            coordinator_request_id=2,
+            debtor_id=-3,
+            recipient="recipient",
+            locked_amount=1000,
+            final_interest_rate_ts=current_ts,
+            max_commit_delay=2147483647,
+            inserted_at=current_ts,
+        ),
+        m.FinalizeTransferSignal(
+            creditor_id=1,
+            signal_id=2,
+            debtor_id=-3,
+            transfer_id=4,
+            coordinator_id=1,
+            coordinator_request_id=5,
+            committed_amount=0,
+            transfer_note_format="json",
+            transfer_note='{"a": "ж"}',
+            inserted_at=current_ts,
+        ),
+        m.UpdatedLedgerSignal(
+            creditor_id=1,
+            debtor_id=-2,
+            update_id=3,
+            creation_date=current_ts.date(),
+            account_id="",
+            principal=-9223372036854775808,
+            last_transfer_number=0,
+            ts=current_ts,
+        ),
+        m.UpdatedPolicySignal(
+            creditor_id=1,
+            debtor_id=-2,
+            update_id=3,
+            policy_name=None,
+            min_principal=0,
+            max_principal=100,
+            peg_exchange_rate=1,
+            peg_debtor_id=None,
+            ts=current_ts,
+        ),
+        m.UpdatedFlagsSignal(
+            creditor_id=1,
+            debtor_id=-2,
+            update_id=3,
+            config_flags=1,
+            ts=current_ts,
+        ),
+        m.RejectedConfigSignal(
+            debtor_id=-2,
+            creditor_id=1,
+            signal_id=3,
+            config_ts=current_ts,
+            config_seqnum=4,
+            config_flags=0,
+            config_data="",
+            negligible_amount=0.5,
+            rejection_code="TEST",
+            inserted_at=current_ts,
+        ),
+    ]
+
+
+def test_compiled_signal_dump(app):
+    from swpt_creditors.message_codecs import encode_body, CT_JSON
+
+    for signal in _create_signals():
+        cls = type(signal)
+        expected = cls.__marshmallow_schema__.dump(signal)
+        data = cls._get_dump_function()(signal)
+        assert data == expected
+        assert list(data) == list(expected)
+        assert encode_body(data, CT_JSON) == encode_body(expected, CT_JSON)
+
+
+@pytest.mark.slow
+def test_compiled_signal_dump_benchmark(app, pytestconfig):
+    from swpt_creditors.message_codecs import encode_body, CT_JSON
+
+    # NOTE: The timings are only reported, because they are not
+    # reliable enough to be asserted (on a busy machine, for example).
+    reporter = pytestconfig.pluginmanager.get_plugin("terminalreporter")
+    for signal in _create_signals():
+        cls = type(signal)
+        schema_dump = cls.__marshmallow_schema__.dump
+        compiled_dump = cls._get_dump_function()
+
+        started_at = time.perf_counter()
+        for _ in range(5000):
+            encode_body(schema_dump(signal), CT_JSON)
+        schema_seconds = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        for _ in range(5000):
+            encode_body(compiled_dump(signal), CT_JSON)
+        compiled_seconds = time.perf_counter() - started_at
+
+        if reporter is not None:
+            reporter.write_line(
+                f"{cls.__name__}: {schema_seconds:.3f}s (marshmallow), "
+                f"{compiled_seconds:.3f}s (compiled)"
+            )
+
+
+def test_exclude_superseded_trade_signals(app):
+    current_ts = datetime.now(tz=timezone.utc)
+    signals = [
+        m.UpdatedFlagsSignal(
+            creditor_id=creditor_id,
+            debtor_id=-2,
+            update_id=update_id,
+            config_flags=0,
+            ts=current_ts,
+        )
+        for creditor_id, update_id in [(1, 2), (1, 3), (1, 1), (2, 1)]
+    ]
+    assert m.UpdatedFlagsSignal._exclude_superseded(signals) == signals
+
+    app.config["APP_FLUSH_LATEST_TRADE_SIGNALS_ONLY"] = True
+    try:
+        latest = m.UpdatedFlagsSignal._exclude_superseded(signals)
+    finally:
+        app.config["APP_FLUSH_LATEST_TRADE_SIGNALS_ONLY"] = False
+
+    assert sorted((s.creditor_id, s.update_id) for s in latest) == [
+        (1, 3),
+        (2, 1),
+    ]
+
+
+def test_exclude_superseded_configs(app):
+    current_ts = datetime.now(tz=timezone.utc)
+    signals = [
+        m.ConfigureAccountSignal(
+            creditor_id=creditor_id,
+            debtor_id=-2,
+            ts=current_ts + timedelta(seconds=seconds),
+            seqnum=seqnum,
+            negligible_amount=0.0,
+            config_data="",
+            config_flags=0,
+        )
+        for creditor_id, seconds, seqnum in [
+            (1, 0, 2147483647),
+            (1, 0, -2147483648),
+            (1, -1, 5),
+            (2, 0, 1),
+        ]
+    ]
+    assert m.ConfigureAccountSignal._exclude_superseded(signals) == signals
+
+    app.config["APP_FLUSH_LATEST_CONFIGS_ONLY"] = True
+    try:
+        latest = m.ConfigureAccountSignal._exclude_superseded(signals)
+    finally:
+        app.config["APP_FLUSH_LATEST_CONFIGS_ONLY"] = False
+
+    assert sorted((s.creditor_id, s.seqnum) for s in latest) == [
+        (1, -2147483648),
+        (2, 1),
+    ]
+
+
+@pytest.mark.parametrize("channels", [1, 3])
+def test_publish_messages(app, channels):
+    from swpt_pythonlib import rabbitmq
+    from swpt_creditors.models.common import publish_messages
+    from swpt_creditors.inmemory_broker import InMemoryBroker, publishing_to
+
+    broker = InMemoryBroker()
+    broker.bind("q", "e")
+    messages = [
+        rabbitmq.Message(
+            exchange="e",
+            routing_key=f"0.{i % 7}",
+            body=str(i).encode("ascii"),
+            properties=rabbitmq.MessageProperties(type="Test"),
+        )
+        for i in range(100)
+    ]
+    app.config["FLUSH_PUBLISHING_CHANNELS"] = channels
+    try:
+        with publishing_to(broker):
+            publish_messages(messages)
+    finally:
+        app.config["FLUSH_PUBLISHING_CHANNELS"] = 1
+
+    received = [broker.get("q") for _ in range(broker.message_count("q"))]
+    assert sorted(received, key=lambda m: int(m.body)) == messages
+    for routing_key in {m.routing_key for m in messages}:
+        assert [m for m in received if m.routing_key == routing_key] == [
+            m for m in messages if m.routing_key == routing_key
+        ]
@@ -4,6 +4,7 @@ from datetime import date, timedelta, datetime, timezone
 from uuid import UUID
 from swpt_pythonlib.utils import i64_to_u64
 from swpt_creditors import procedures as p
+from swpt_creditors.procedures import account_updates
 from swpt_creditors import models
 from swpt_creditors.extensions import db
 from swpt_creditors.models import (
@@ -394,6 +395,85 @@ def test_process_account_update_signal(account):
     assert len(models.UpdatedLedgerSignal.query.all()) == 2
 
 
+def test_process_account_update_heartbeat(account):
+    def get_data():
+        return AccountData.query.filter_by(
+            creditor_id=C_ID, debtor_id=D_ID
+        ).one()
+
+    ad = get_data()
+    current_ts = datetime.now(tz=timezone.utc)
+    params = {
+        "debtor_id": D_ID,
+        "creditor_id": C_ID,
+        "creation_date": date(2020, 1, 15),
+        "last_change_ts": current_ts,
+        "last_change_seqnum": 1,
+        "principal": 1000,
+        "interest": 12.0,
+        "interest_rate": 5.0,
+        "last_interest_rate_change_ts": current_ts - timedelta(days=1),
+        "transfer_note_max_bytes": 500,
+        "last_config_ts": ad.last_config_ts,
+        "last_config_seqnum": ad.last_config_seqnum,
+        "negligible_amount": ad.negligible_amount,
+        "config_flags": ad.config_flags,
+        "config_data": "",
+        "account_id": str(C_ID),
+        "debtor_info_iri": None,
+        "debtor_info_content_type": None,
+        "debtor_info_sha256": None,
+        "last_transfer_number": 0,
+        "last_transfer_committed_at": current_ts - timedelta(days=2),
+        "ts": current_ts,
+        "ttl": 10000,
+    }
+    p.process_account_update_signal(**params)
+    ad = get_data()
+    assert ad.last_change_seqnum == 1
+    assert ad.last_heartbeat_ts == current_ts
+    assert ad.principal == 1000
+
+    # A pure heartbeat updates only the heartbeat timestamp.
+    time.sleep(0.01)
+    params["ts"] = datetime.now(tz=timezone.utc)
+    params["principal"] = 2000
+    p.process_account_update_signal(**params)
+    ad = get_data()
+    assert ad.last_heartbeat_ts == params["ts"]
+    assert ad.principal == 1000
+
+    # An older event does not change anything.
+    params["ts"] = current_ts
+    params["last_change_ts"] = current_ts - timedelta(seconds=1)
+    p.process_account_update_signal(**params)
+    ad = get_data()
+    assert ad.last_heartbeat_ts > current_ts
+    assert ad.principal == 1000
+
+    # A stale heartbeat is handled by the fast path.
+    last_heartbeat_ts = ad.last_heartbeat_ts
+    assert account_updates._process_heartbeat(
+        creditor_id=C_ID,
+        debtor_id=D_ID,
+        creation_date=params["creation_date"],
+        last_change_ts=params["last_change_ts"],
+        last_change_seqnum=params["last_change_seqnum"],
+        ts=current_ts,
+        current_ts=datetime.now(tz=timezone.utc),
+    )
+    assert get_data().last_heartbeat_ts == last_heartbeat_ts
+
+    # A newer event is processed in full.
+    params["ts"] = datetime.now(tz=timezone.utc)
+    params["last_change_ts"] = current_ts
+    params["last_change_seqnum"] = 2
+    p.process_account_update_signal(**params)
+    ad = get_data()
+    assert ad.last_change_seqnum == 2
+    assert ad.principal == 2000
+
+
 def test_process_rejected_config_signal(account):
     c = p.get_account_config(C_ID, D_ID)
     assert c.config_error is None